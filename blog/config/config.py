@@ -31,6 +31,10 @@ class AppConfig(GoodConf):
     REDIS_ENABLED = Field(default=False, help="If False, db caching will be used.")
     REDIS_URL = Field(default="redis://127.0.0.1:6379")
     REDIS_PREFIX = Field(default="blog")
+    SEARCH_BACKEND = Field(
+        default="",
+        help="Dotted path of Tangerine's search backend class; empty picks one for the database.",
+    )
     SECRET_KEY: str = Field(
         initial=lambda: base64.b64encode(os.urandom(60)).decode(),
         description="Used for cryptographic signing. "
@@ -55,6 +55,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "blog.tangerine.middleware.PageCacheMiddleware",
 ]
 
 # Default integer type for auto-primary-keys
@@ -185,6 +186,19 @@ else:
         }
     }
 
+# Full-text search for Tangerine posts; see blog/tangerine/search.py
+TANGERINE_SEARCH_BACKEND = config.SEARCH_BACKEND
+
+# Seconds anonymous readers' pages are cached; see blog/tangerine/middleware.py
+TANGERINE_PAGE_CACHE_TIMEOUT = 600
+
+# Run comment jobs (spam check, approval, moderator email) in the request that queues them. Set to
+# False to run them with `manage.py tangerine_worker` instead; see blog/tangerine/jobs.py
+TANGERINE_JOBS_INLINE = True
+
+# Model file of the built-in spam classifier (`manage.py tangerine_train_spam`); see
+# blog/tangerine/spam.py
+TANGERINE_SPAM_MODEL_PATH = os.path.join(BASE_DIR, "tangerine-spam.model")
 
 ACCOUNT_EMAIL_VERIFICATION = "none"
 ACCOUNT_LOGIN_ATTEMPTS_LIMIT = None
@@ -59,4 +59,7 @@ TEST_RUNNER = "django.test.runner.DiscoverRunner"
 # Use fast password hasher so tests run faster
 PASSWORD_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]
 
+# Run queued comment jobs as soon as they're queued, so tests don't need a worker
+TANGERINE_JOBS_INLINE = True
+
 STATICFILES_STORAGE = "django.contrib.staticfiles.storage.StaticFilesStorage"
@@ -9,8 +9,10 @@ from tangerine.models import (
     RelatedLink,
     Blog,
     Comment,
+    CommentJob,
     AuthorPage,
 )
+from tangerine.ops import MODERATION_ACTIONS, moderate_comments
 
 
 class PostAdmin(admin.ModelAdmin):
@@ -73,9 +75,27 @@ class CategoryAdmin(admin.ModelAdmin):
     list_display = ["title", "blog"]
 
 
+def moderation_action(action, description):
+    # Admin action running one of `ops.moderate_comments()`'s actions on the selected comments.
+    def run(modeladmin, request, queryset):
+        num_changed = moderate_comments(queryset, action)
+        modeladmin.message_user(
+            request, "{} comment(s) {}.".format(num_changed, MODERATION_ACTIONS[action])
+        )
+
+    run.__name__ = "{}_comments".format(action)
+    return admin.action(run, description=description)
+
+
 class CommentAdmin(admin.ModelAdmin):
     raw_id_fields = ("post", "parent", "author")
 
+    actions = [
+        moderation_action("approve", "Approve selected comments"),
+        moderation_action("unapprove", "Unapprove selected comments"),
+        moderation_action("spam", "Mark selected comments as spam"),
+    ]
+
     list_display = (
         comment_body_intro,
         "post",
@@ -89,6 +109,26 @@ class CommentAdmin(admin.ModelAdmin):
         "approved",
     ]
 
+    def delete_queryset(self, request, queryset):
+        # Used by the "Delete selected" action.
+        moderate_comments(queryset, "delete")
+
+
+class CommentJobAdmin(admin.ModelAdmin):
+    raw_id_fields = ("comment",)
+
+    list_display = (
+        "comment",
+        "task",
+        "run_after",
+        "attempts",
+        "failed",
+    )
+    list_filter = [
+        "task",
+        "failed",
+    ]
+
 
 class BlogAdmin(admin.ModelAdmin):
     fieldsets = (
@@ -96,7 +136,7 @@ class BlogAdmin(admin.ModelAdmin):
         (
             "Posts",
             {
-                "fields": ("num_posts_per_list_view", "show_future"),
+                "fields": ("num_posts_per_list_view", "pagination", "show_future"),
             },
         ),
         (
@@ -106,6 +146,7 @@ class BlogAdmin(admin.ModelAdmin):
                     "comment_system",
                     "enable_comments_global",
                     "auto_approve_previous_commentors",
+                    "spam_filter",
                     "moderation_email",
                 ),
             },
@@ -126,5 +167,6 @@ admin.site.register(Blog, BlogAdmin)
 admin.site.register(Category, CategoryAdmin)
 admin.site.register(AuthorPage)
 admin.site.register(Comment, CommentAdmin)
+admin.site.register(CommentJob, CommentJobAdmin)
 admin.site.register(Post, PostAdmin)
 admin.site.register(RelatedLinkGroup, RelatedLinkGroupAdmin)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class BlogConfig(AppConfig):
     name = "blog"
+
+    def ready(self):
+        # Connect cache invalidation and other signal receivers.
+        from blog.tangerine import signals  # noqa: F401
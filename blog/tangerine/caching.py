@@ -0,0 +1,290 @@
+"""Read-through caches for Tangerine's hot, rarely-changing data.
+
+Blog config rows are read on nearly every request (by `PostManager`, the views and the comment
+workflow in `ops`), but change only when someone edits a Blog in the Admin. An installation has only
+a handful, so they're all loaded with one query and looked up by slug or pk in memory. The list goes
+through two layers:
+
+1. A per-request memo, cleared on `request_started`/`request_finished`, so a single request never
+   sees the same Blog twice from the database (or sees it change halfway through a render).
+2. A per-process LRU shared by all requests in a worker. It is stamped with a version token kept in
+   Django's cache; saving or deleting any Blog bumps the token (see `signals.py`) once the change is
+   committed, so every uwsgi worker drops its LRU on its next request. If the configured cache can't
+   hold the token (e.g. `DummyCache`), the LRU is skipped and only the per-request memo is used.
+
+Code running outside the request cycle (management commands, shell, tests) can call
+`clear_blog_cache()` to force fresh reads. `memoize_for_request()` offers just the first layer, for
+other data read many times per render.
+
+Derived data that is more expensive to build (e.g. the sidebar's category list) lives in Django's
+cache instead, via `get_versioned()`: each entry belongs to a named scope whose version token is
+bumped by `bump_version()` when anything it depends on changes (after the transaction making the
+change commits). Each blog has a content scope (`content_scope()`) for data derived from its posts
+and everything shown alongside them (comments, categories, blogroll, blog settings), bumped whenever
+any of that is saved or deleted.
+
+The same version tokens tag the anonymous page cache (see `middleware.py`): list pages carry their
+blog's content version, and each post's page carries the version of its own page scope
+(`page_scope()`).
+
+The emails of approved commentors, checked for every comment posted, are held in each process as a
+set (`get_approved_commentors()`), reloaded whenever the approved commentors scope is bumped.
+"""
+
+import copy
+import threading
+import uuid
+from collections import OrderedDict
+
+from asgiref.local import Local
+
+from django.core.cache import cache
+from django.db import transaction
+from django.http import Http404
+
+BLOG_VERSION_KEY = "tangerine:blog_version"
+SCOPE_VERSION_KEY = "tangerine:{}_version"
+BLOG_LRU_SIZE = 128
+APPROVED_COMMENTORS_SCOPE = "approved_commentors"
+
+_request = Local()
+_process_lru = OrderedDict()
+_process_lru_version = None
+_process_lru_lock = threading.Lock()
+
+# (version token, frozenset of emails) of the approved commentors last loaded by this process.
+_approved_commentors = None
+
+# Sentinel for "not in the cache", so that None can be cached too.
+_MISSING = object()
+
+
+def _get_shared_version(key=BLOG_VERSION_KEY):
+    """Return the cross-process version token stored under `key`, creating one if needed.
+    None if the cache can't store it."""
+
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def _get_memo():
+    """Per-request memo. On first use in a request, sync the process LRU with the shared version
+    token."""
+
+    global _process_lru_version
+
+    memo = getattr(_request, "memo", None)
+    if memo is None:
+        memo = _request.memo = {}
+        version = _get_shared_version()
+        if version is None or version != _process_lru_version:
+            with _process_lru_lock:
+                _process_lru.clear()
+                _process_lru_version = version
+    return memo
+
+
+def _cached(key, loader):
+    memo = _get_memo()
+    if key in memo:
+        value = memo[key]
+    else:
+        with _process_lru_lock:
+            found = key in _process_lru
+            if found:
+                _process_lru.move_to_end(key)
+                value = _process_lru[key]
+        if not found:
+            value = loader()
+            if _process_lru_version is not None:
+                with _process_lru_lock:
+                    _process_lru[key] = value
+                    if len(_process_lru) > BLOG_LRU_SIZE:
+                        _process_lru.popitem(last=False)
+        # Hand each request its own copies, so attribute changes made during one request can't leak
+        # into another.
+        value = [copy.copy(v) for v in value] if isinstance(value, list) else copy.copy(value)
+        memo[key] = value
+    return value
+
+
+def get_all_blogs():
+    """Return a list of all Blogs, ordered by pk. The other lookups here are all served from this
+    list."""
+
+    from blog.tangerine.models import Blog
+
+    return _cached(("all",), lambda: list(Blog.objects.order_by("pk")))
+
+
+def get_blog(slug=None, pk=None):
+    """Return the Blog with the given slug or pk, or None if there isn't one. With neither argument,
+    return the first Blog (the "default" blog for code that isn't blog-aware)."""
+
+    blogs = get_all_blogs()
+    if slug is not None:
+        return next((blog for blog in blogs if blog.slug == slug), None)
+    if pk is not None:
+        return next((blog for blog in blogs if blog.pk == pk), None)
+    return blogs[0] if blogs else None
+
+
+def get_blog_or_404(slug):
+    blog = get_blog(slug=slug)
+    if blog is None:
+        raise Http404("No Blog matches the given query.")
+    return blog
+
+
+def memoize_for_request(key, loader):
+    """Return `loader()`, called at most once per request for a given `key` (a tuple). For data that
+    isn't covered by the Blog version token, so can't be shared between requests."""
+
+    memo = _get_memo()
+    key = ("request",) + key
+    if key not in memo:
+        memo[key] = loader()
+    return memo[key]
+
+
+def get_show_future_blog_ids():
+    """Return a frozenset of ids of Blogs that have `show_future` enabled."""
+
+    return frozenset(blog.pk for blog in get_all_blogs() if blog.show_future)
+
+
+def clear_request_memo(**kwargs):
+    """Forget everything memoized for the current request. Connected to
+    request_started/request_finished."""
+
+    _request.memo = None
+
+
+def clear_blog_cache():
+    """Drop this process's cached Blogs (both layers). Other processes are unaffected; see
+    `invalidate_blog_cache`."""
+
+    global _process_lru_version
+
+    with _process_lru_lock:
+        _process_lru.clear()
+        _process_lru_version = None
+    clear_request_memo()
+
+
+def invalidate_blog_cache(**kwargs):
+    """Bump the shared version token so that every process reloads Blogs. Connected to Blog
+    save/delete.
+
+    This process forgets its Blogs straight away, so it sees its own change; the token is only
+    bumped once the current transaction commits, so that no other process reloads the Blogs before
+    the change is visible to it."""
+
+    def bump():
+        cache.set(BLOG_VERSION_KEY, uuid.uuid4().hex, None)
+        clear_blog_cache()
+
+    clear_blog_cache()
+    transaction.on_commit(bump)
+
+
+def get_versioned(scope, key, loader):
+    """Return the value cached under `key` in `scope`, calling `loader()` to build and store it if
+    needed. Entries stay valid until `bump_version(scope)`. If the cache can't hold the version
+    token, every call loads."""
+
+    full_key = get_versioned_key(scope, key)
+    if full_key is None:
+        return loader()
+
+    value = cache.get(full_key, _MISSING)
+    if value is _MISSING:
+        value = loader()
+        cache.set(full_key, value)
+    return value
+
+
+def get_versioned_key(scope, key):
+    """Return the cache key `get_versioned()` stores `key` in `scope` under, for values that have to
+    be read and written separately (e.g. bodies that are streamed while they're built). None if the
+    cache can't hold the version token."""
+
+    version = _get_shared_version(SCOPE_VERSION_KEY.format(scope))
+    if version is None:
+        return None
+    return "tangerine:{}:{}:{}".format(scope, version, key)
+
+
+def bump_version(scope):
+    """Invalidate everything cached in `scope` by `get_versioned()`, in every process, once the
+    current transaction commits (straight away outside one). Bumping any earlier would let another
+    request rebuild the entries from the old data, and cache them under the new version."""
+
+    transaction.on_commit(
+        lambda: cache.set(SCOPE_VERSION_KEY.format(scope), uuid.uuid4().hex, None)
+    )
+
+
+def content_scope(blog_id):
+    """Return the `get_versioned()` scope for data derived from the content of the blog with this
+    id."""
+
+    return "content:{}".format(blog_id)
+
+
+def get_scope_version(scope):
+    """Return the current version token of `scope` (None if the cache can't store it), for use in
+    cache keys built outside `get_versioned()`."""
+
+    return _get_shared_version(SCOPE_VERSION_KEY.format(scope))
+
+
+def get_content_version(blog_id):
+    """Return the current content version token of the blog with this id, e.g. for the sidebar's
+    `{% cache %}` fragment."""
+
+    return get_scope_version(content_scope(blog_id))
+
+
+def page_scope(path):
+    """Return the scope of the cached page at `path` (a post's permalink), bumped when that post or
+    its comments change."""
+
+    return "page:{}".format(path)
+
+
+def bump_content_version(*blog_ids):
+    """Invalidate everything cached in the content scopes of these blogs."""
+
+    for blog_id in set(blog_ids):
+        if blog_id is not None:
+            bump_version(content_scope(blog_id))
+
+
+def get_approved_commentors():
+    """Return a frozenset of the emails of all approved commentors, loaded once per process and kept
+    until the approved commentors scope is bumped. A set rather than e.g. a Bloom filter, since it
+    has to answer "no" as reliably as "yes" for lookups to skip the database. None if the cache
+    can't hold the version token."""
+
+    global _approved_commentors
+
+    from blog.tangerine.models import ApprovedCommentor
+
+    version = get_scope_version(APPROVED_COMMENTORS_SCOPE)
+    if version is None:
+        return None
+    loaded = _approved_commentors
+    if loaded is None or loaded[0] != version:
+        emails = frozenset(ApprovedCommentor.objects.values_list("email", flat=True))
+        loaded = _approved_commentors = (version, emails)
+    return loaded[1]
+
+
+def invalidate_approved_commentors():
+    """Make every process reload its approved commentors, once the current transaction commits."""
+
+    bump_version(APPROVED_COMMENTORS_SCOPE)
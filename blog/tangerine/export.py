@@ -0,0 +1,378 @@
+"""Static export of a blog's public pages, for serving from a plain file server.
+
+`blog_paths()` lists every public URL of a blog, and `export()` renders them through the Django test
+client (so with the full middleware and template stack, as an anonymous reader would see them) into
+a directory tree that mirrors `urls.py`: a page at `/<blog_slug>/2021/3/4/some-post/` is written to
+`<output>/<blog_slug>/2021/3/4/some-post/index.html`, and the feed to `<output>/<blog_slug>/feed`.
+
+Only the first page of paginated lists is exported, since later pages are addressed by query string.
+Search, comment posting and the management interface need a running Django site and are left out.
+
+Each export leaves a manifest (`MANIFEST_NAME`) in the output directory. For every page it records
+the hash of the file's contents, so output that hasn't changed is never rewritten, and what the
+page showed: the Posts, Comments and Categories loaded while rendering it, and the sidebar parts
+whose template tags ran (see `record_dependency()`). It also holds a fingerprint of each exported
+blog and its public posts, approved comments and categories, and of what those sidebar parts show.
+An incremental export compares those fingerprints with the database and re-renders only:
+
+- the pages that showed an object or sidebar part that has since changed (approving a comment
+  changes its post's comment count, so re-renders the pages showing that post), and
+- every page of a blog whose settings changed, or where a post was published, unpublished,
+  re-dated, given a new slug or re-categorized, since the home, archive and category pages list
+  those posts and every page links to its neighbours.
+
+Whether a new comment or blogroll link re-renders anything depends on the templates: only pages
+that include the sidebar (which needs a `sidebar` block in the site's base template) show them.
+"""
+
+import hashlib
+import json
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.db.models import Q
+from django.db.models.signals import post_init
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from blog.tangerine.middleware import CSRF_TOKEN_RE
+from blog.tangerine.models import Blog, Category, Comment, Post, RelatedLink
+
+# Paths rendered by one worker at a time.
+CHUNK_SIZE = 50
+
+MANIFEST_NAME = ".tangerine-export.json"
+
+# Models whose instances are recorded as dependencies of the pages that load them, with their tag
+# prefixes.
+TRACKED_MODELS = {Post: "post", Comment: "comment", Category: "category"}
+
+# Number of comments the sidebar's Recent Comments shows (see include/sidebar_recent_comments.html).
+RECENT_COMMENTS = 10
+
+# Pages are rendered without caches, so every object they show is loaded (and recorded) afresh.
+NO_CACHES = {"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}
+
+# Tags of the objects loaded during the current render, or None when not recording.
+_dependencies = None
+
+
+def record_dependency(tag):
+    """Record that the page being exported shows what `tag` stands for in `snapshot_objects()`. For
+    template tags showing data that no tracked object carries, e.g. which comments are the latest.
+    Does nothing outside an export."""
+
+    if _dependencies is not None:
+        _dependencies.add(tag)
+
+
+def blog_paths(blog):
+    """Return the paths of every public page of `blog`, sorted."""
+
+    def url(name, *args):
+        return reverse("tangerine:{}".format(name), args=[blog.slug, *args])
+
+    paths = {url("home"), url("feed")}
+
+    posts = Post.pub.filter(blog=blog)
+    paths.update(
+        post.get_absolute_url() for post in posts.only("blog", "slug", "pub_date", "permalink")
+    )
+    for day in posts.datetimes("pub_date", "day"):
+        paths.add(url("date_archive", day.year))
+        paths.add(url("date_archive", day.year, day.month))
+        paths.add(url("date_archive", day.year, day.month, day.day))
+
+    # Pages that belong to no blog are shown under every blog's address.
+    pages = Post.objects.filter(
+        Q(blog=blog) | Q(blog__isnull=True), ptype="page", published=True, trashed=False
+    )
+    paths.update(url("page_detail", slug) for slug in pages.values_list("slug", flat=True))
+
+    for slug in Category.objects.filter(blog=blog).values_list("slug", flat=True):
+        paths.add(url("category", slug))
+
+    # The author view needs an AuthorPage to show.
+    authors = get_user_model().objects.filter(post__in=posts, authorpage__isnull=False).distinct()
+    for username in authors.values_list("username", flat=True):
+        paths.add(url("author", username))
+
+    return sorted(paths)
+
+
+def path_to_file(output_dir, path):
+    """Return the file under `output_dir` that the page at `path` is exported to."""
+
+    parts = [part for part in path.split("/") if part]
+    if path.endswith("/"):
+        parts.append("index.html")
+    return os.path.join(output_dir, *parts)
+
+
+def _record_dependency(sender, instance, **kwargs):
+    if _dependencies is not None and sender in TRACKED_MODELS and instance.pk is not None:
+        _dependencies.add("{}:{}".format(TRACKED_MODELS[sender], instance.pk))
+
+
+def render_paths(paths, output_dir, host, known_hashes=None):
+    """Render each of `paths` and write it out under `output_dir`, unless its file already holds the
+    same content (going by `known_hashes`, a dict of path to content hash).
+
+    Returns a dict of path to `{"hash": ..., "deps": [...], "written": bool}` for the pages
+    rendered, and a list of (path, status code) for the pages that couldn't be."""
+
+    global _dependencies
+
+    known_hashes = known_hashes or {}
+    client = Client(HTTP_HOST=host)
+    results = {}
+    failures = []
+    post_init.connect(_record_dependency)
+    try:
+        with override_settings(CACHES=NO_CACHES):
+            for path in paths:
+                _dependencies = set()
+                response = client.get(path)
+                if response.status_code != 200:
+                    failures.append((path, response.status_code))
+                    continue
+
+                # A static page can't take a comment anyway, and a fresh token would change every
+                # file.
+                content = CSRF_TOKEN_RE.sub(rb"\g<1>\g<2>", response.getvalue())
+                content_hash = hashlib.sha1(content).hexdigest()
+                filename = path_to_file(output_dir, path)
+                written = known_hashes.get(path) != content_hash or not os.path.exists(filename)
+                if written:
+                    os.makedirs(os.path.dirname(filename), exist_ok=True)
+                    with open(filename, "wb") as f:
+                        f.write(content)
+                results[path] = {
+                    "hash": content_hash,
+                    "deps": sorted(_dependencies),
+                    "written": written,
+                }
+    finally:
+        _dependencies = None
+        post_init.disconnect(_record_dependency)
+    return results, failures
+
+
+def _init_worker():
+    # Needed when workers are spawned rather than forked.
+    django.setup()
+
+
+def export_paths(paths, output_dir, host, workers=1, known_hashes=None):
+    """Render `paths` into `output_dir` with `render_paths()`, spread over `workers` processes."""
+
+    if workers <= 1:
+        return render_paths(paths, output_dir, host, known_hashes)
+
+    known_hashes = known_hashes or {}
+    chunks = [paths[i : i + CHUNK_SIZE] for i in range(0, len(paths), CHUNK_SIZE)]
+    # Forked workers mustn't share this process's database connections; each opens its own.
+    connections.close_all()
+    results, failures = {}, []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        for chunk_results, chunk_failures in executor.map(
+            render_paths,
+            chunks,
+            [output_dir] * len(chunks),
+            [host] * len(chunks),
+            [{path: known_hashes.get(path) for path in chunk} for chunk in chunks],
+        ):
+            results.update(chunk_results)
+            failures.extend(chunk_failures)
+    return results, failures
+
+
+def _fingerprint(*values):
+    return hashlib.md5(repr(values).encode()).hexdigest()[:16]
+
+
+def snapshot_objects(blogs):
+    """Return a fingerprint of each of `blogs`, of their public posts (and of the pages outside any
+    blog), approved comments and categories, and of what their sidebar parts show, as a dict of tag
+    (e.g. "post:12") to `[blog id, listing, content]`:
+
+    - `listing` stands for what the object contributes to its blog's lists: None if it shows up in
+      none of them (a comment, a sidebar part), else a hash that changes along with that.
+    - `content` changes whenever the object is saved (for Blogs and Categories: whenever any field
+      changes; for Posts, also whenever their comment count changes).
+
+    Objects that aren't public are left out, so one going private looks the same as one deleted.
+    """
+
+    blog_ids = [blog.pk for blog in blogs]
+    objects = {}
+    for blog in Blog.objects.filter(pk__in=blog_ids).values():
+        objects["blog:{}".format(blog["id"])] = [blog["id"], _fingerprint(*blog.items()), ""]
+        recent_comments = Comment.pub.filter(post__blog=blog["id"]).values_list("pk", "modified")
+        objects["recent_comments:{}".format(blog["id"])] = [
+            blog["id"],
+            None,
+            _fingerprint(list(recent_comments[:RECENT_COMMENTS])),
+        ]
+        links = RelatedLink.objects.filter(group__blog=blog["id"]).order_by("pk")
+        objects["blogroll:{}".format(blog["id"])] = [
+            blog["id"],
+            None,
+            _fingerprint(list(links.values_list("pk", "site_title", "site_url", "link_order"))),
+        ]
+    all_blogs = Blog.objects.order_by("pk").values_list("pk", "slug", "title")
+    objects["all_blogs"] = [None, None, _fingerprint(list(all_blogs))]
+
+    for category in Category.objects.filter(blog__in=blog_ids).values():
+        objects["category:{}".format(category["id"])] = [
+            category["blog_id"],
+            None,
+            _fingerprint(*category.items()),
+        ]
+
+    in_blogs = Q(blog__in=blog_ids) | Q(blog__isnull=True)
+    post_categories = defaultdict(list)
+    for post_id, category_id in (
+        Post.categories.through.objects.filter(category__blog__in=blog_ids)
+        .order_by("post_id", "category_id")
+        .values_list("post_id", "category_id")
+    ):
+        post_categories[post_id].append(category_id)
+    # Pages show regardless of their date; posts only once due, unless their blog shows future
+    # posts.
+    posts = Post.objects.filter(
+        in_blogs,
+        Q(ptype="page") | Q(pub_date__lte=timezone.now()) | Q(blog__show_future=True),
+        published=True,
+        trashed=False,
+    ).values_list(
+        "pk",
+        "blog_id",
+        "modified",
+        "ptype",
+        "pub_date",
+        "permalink",
+        "approved_comment_count",
+        named=True,
+    )
+    for post in posts:
+        listing = _fingerprint(post.ptype, post.pub_date, post.permalink, post_categories[post.pk])
+        content = _fingerprint(post.modified, post.approved_comment_count)
+        objects["post:{}".format(post.pk)] = [post.blog_id, listing, content]
+
+    comments = Comment.pub.filter(post__blog__in=blog_ids).order_by()
+    for pk, blog_id, modified in comments.values_list("pk", "post__blog_id", "modified"):
+        objects["comment:{}".format(pk)] = [blog_id, None, _fingerprint(modified)]
+
+    return objects
+
+
+def find_changes(old_objects, new_objects):
+    """Compare two `snapshot_objects()` results. Returns a set of the ids of blogs whose every page
+    may have changed (None among them standing for all blogs), and a set of tags of objects whose
+    own pages changed."""
+
+    blog_wide, changed = set(), set()
+    for tag in old_objects.keys() | new_objects.keys():
+        old = old_objects.get(tag) or [None, None, None]
+        new = new_objects.get(tag) or [None, None, None]
+        if old == new:
+            continue
+        if (old[1] or new[1]) and (old[:2] != new[:2]):
+            # A blog id of None (a page outside any blog) stands for every blog here too.
+            blog_wide.update(obj[0] for obj in (old_objects.get(tag), new_objects.get(tag)) if obj)
+        else:
+            changed.add(tag)
+    return blog_wide, changed
+
+
+def load_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_manifest(output_dir, manifest):
+    os.makedirs(output_dir, exist_ok=True)
+    filename = os.path.join(output_dir, MANIFEST_NAME)
+    with open(filename + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(filename + ".tmp", filename)
+
+
+def export(blogs, output_dir, host, workers=1, incremental=False):
+    """Export the pages of `blogs` into `output_dir`. With `incremental`, re-render only the pages
+    that changed since the last export into `output_dir` (of the blogs exported then); without a
+    previous export, export everything.
+
+    Returns a dict with the numbers of pages `rendered`, files `written` and files `removed`, and a
+    list of (path, status code) `failures`. Failed pages keep the files of the last export that
+    rendered them."""
+
+    manifest = load_manifest(output_dir)
+
+    if incremental and manifest:
+        blogs = list(Blog.objects.filter(pk__in=manifest["blogs"]).order_by("pk"))
+        objects = snapshot_objects(blogs)
+        pages = manifest["pages"]
+        blog_wide, changed = find_changes(manifest["objects"], objects)
+        relisted = [blog for blog in blogs if None in blog_wide or blog.pk in blog_wide]
+    else:
+        blogs = list(blogs)
+        objects = snapshot_objects(blogs)
+        pages = {}
+        changed = set()
+        relisted = blogs
+        if manifest:
+            # Keep the hashes of existing files, so that unchanged pages aren't rewritten.
+            pages = {
+                path: page
+                for path, page in manifest["pages"].items()
+                if page["blog"] in {blog.pk for blog in blogs}
+            }
+
+    # Path to blog id of every page to render.
+    to_render = {path: blog.pk for blog in relisted for path in blog_paths(blog)}
+    relisted_ids = {blog.pk for blog in relisted}
+    for path, page in pages.items():
+        if path not in to_render and (page.get("retry") or changed.intersection(page["deps"])):
+            to_render[path] = page["blog"]
+    removed = [
+        path
+        for path, page in pages.items()
+        if page["blog"] in relisted_ids and path not in to_render
+    ]
+
+    paths = sorted(to_render)
+    known_hashes = {path: pages[path]["hash"] for path in paths if path in pages}
+    results, failures = export_paths(paths, output_dir, host, workers, known_hashes)
+
+    for path in removed:
+        pages.pop(path, None)
+        try:
+            os.remove(path_to_file(output_dir, path))
+        except FileNotFoundError:
+            pass
+    for path, result in results.items():
+        pages[path] = {"blog": to_render[path], "hash": result["hash"], "deps": result["deps"]}
+    # A page that failed to render keeps its last good file, and is tried again by the next export.
+    for path, status_code in failures:
+        page = pages.setdefault(path, {"blog": to_render[path], "hash": None, "deps": []})
+        page["retry"] = True
+
+    save_manifest(
+        output_dir, {"blogs": [blog.pk for blog in blogs], "objects": objects, "pages": pages}
+    )
+    return {
+        "rendered": len(results),
+        "written": sum(result["written"] for result in results.values()),
+        "removed": len(removed),
+        "failures": failures,
+    }
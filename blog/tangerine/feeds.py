@@ -0,0 +1,268 @@
+"""RSS, Atom and JSON feeds of a blog's posts, or of the posts in one of its categories or by one
+author.
+
+Feeds are written by streaming serializers: posts are read from the database in chunks and each is
+written out as soon as it's read, so no feed is ever built up as a whole in a template context. The
+XML formats reuse Django's feed generators (`django.utils.feedgenerator`) one item at a time.
+
+Feed readers poll constantly, so every feed carries an ETag and Last-Modified time worked out from a
+single aggregate over its posts (see `PostFeed.validators()`); readers that already have the current
+version get a 304, and everyone else gets a body cached, under that ETag, until the blog's content
+changes.
+"""
+
+import hashlib
+import json
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.sites.shortcuts import get_current_site
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.feedgenerator import Atom1Feed, Rss201rev2Feed, SimplerXMLGenerator
+from django.utils.http import http_date
+
+from blog.tangerine.caching import content_scope, get_versioned_key, memoize_for_request
+from blog.tangerine.models import Post
+
+# Posts read from the database at a time while a feed is written.
+CHUNK_SIZE = 100
+
+
+class StreamingFeedMixin:
+    """Writes a feedgenerator feed a piece at a time: the head, then each item as it's added, then
+    the tail."""
+
+    def latest_post_date(self):
+        # Items are written as they come, so the newest date can't be looked up among them.
+        return self.feed["updated"] or timezone.now()
+
+    def stream(self, items):
+        buffer = StringIO()
+        handler = SimplerXMLGenerator(buffer, "utf-8", short_empty_elements=True)
+
+        def drain():
+            chunk = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            return chunk
+
+        self.write_head(handler)
+        yield drain()
+        for item in items:
+            self.items = []
+            self.add_item(**item)
+            self.write_items(handler)
+            yield drain()
+        self.write_tail(handler)
+        yield drain()
+
+
+class StreamingRssFeed(StreamingFeedMixin, Rss201rev2Feed):
+    content_type = "application/rss+xml; charset=utf-8"
+
+    def write_head(self, handler):
+        handler.startDocument()
+        handler.startElement("rss", self.rss_attributes())
+        handler.startElement("channel", self.root_attributes())
+        self.add_root_elements(handler)
+
+    def write_tail(self, handler):
+        self.endChannelElement(handler)
+        handler.endElement("rss")
+
+
+class StreamingAtomFeed(StreamingFeedMixin, Atom1Feed):
+    content_type = "application/atom+xml; charset=utf-8"
+
+    def write_head(self, handler):
+        handler.startDocument()
+        handler.startElement("feed", self.root_attributes())
+        self.add_root_elements(handler)
+
+    def write_tail(self, handler):
+        handler.endElement("feed")
+
+
+class StreamingJSONFeed:
+    """JSON Feed 1.1 (https://www.jsonfeed.org/version/1.1/), taking the same arguments and items as
+    the feedgenerator classes above."""
+
+    content_type = "application/feed+json; charset=utf-8"
+
+    def __init__(self, title, link, description, language=None, feed_url=None, **kwargs):
+        self.feed = {
+            "version": "https://jsonfeed.org/version/1.1",
+            "title": title,
+            "home_page_url": link,
+            "feed_url": feed_url,
+            "description": description,
+            "language": language,
+        }
+
+    def stream(self, items):
+        yield json.dumps(self.feed)[:-1] + ', "items": ['
+        for n, item in enumerate(items):
+            entry = {
+                "id": item["unique_id"],
+                "url": item["link"],
+                "title": item["title"],
+                "content_html": item["description"],
+                "date_published": item["pubdate"].isoformat(),
+                "date_modified": item["updateddate"].isoformat(),
+                "tags": item["categories"],
+            }
+            if item["author_name"]:
+                entry["authors"] = [{"name": item["author_name"]}]
+            yield (", " if n else "") + json.dumps(entry)
+        yield "]}"
+
+
+FORMATS = {
+    "rss": StreamingRssFeed,
+    "atom": StreamingAtomFeed,
+    "json": StreamingJSONFeed,
+}
+
+
+class PostFeed:
+    """The posts of one feed (newest first, as many as the blog lists per page), and what to call
+    them. `key` tells feeds of the same blog apart in caches."""
+
+    def __init__(self, blog, posts, title, link, key):
+        self.blog = blog
+        self.posts = posts
+        self.title = title
+        self.link = link
+        self.key = key
+
+    def validators(self):
+        """Return a hash of the feed's state and its Last-Modified time, from a single aggregate
+        over its posts. Both change whenever one of its posts is published, edited, unpublished or
+        deleted."""
+
+        def load():
+            stats = self.posts.aggregate(
+                newest=Max("pub_date"), modified=Max("modified"), num_posts=Count("pk")
+            )
+            last_modified = max(filter(None, (stats["newest"], stats["modified"])), default=None)
+            blog = self.blog
+            state = (
+                self.key,
+                blog.slug,
+                blog.title,
+                blog.num_posts_per_list_view,
+                last_modified,
+                stats["num_posts"],
+            )
+            return hashlib.md5(repr(state).encode()).hexdigest(), last_modified
+
+        return memoize_for_request(("feed_validators", self.blog.pk, self.key), load)
+
+    def items(self, site_url):
+        posts = (
+            self.posts.order_by("-pub_date")
+            .listing()[: self.blog.num_posts_per_list_view]
+            .iterator(chunk_size=CHUNK_SIZE)
+        )
+        for post in posts:
+            link = site_url + post.get_absolute_url()
+            yield {
+                "title": post.title,
+                "link": link,
+                "description": post.excerpt,
+                "unique_id": link,
+                "pubdate": post.pub_date,
+                "updateddate": post.modified,
+                "author_name": post.author.get_full_name() if post.author else None,
+                "categories": [category.title for category in post.categories.all()],
+            }
+
+    def stream(self, request, feed_format):
+        """Yield the feed in `feed_format` (a key of FORMATS) a piece at a time."""
+
+        site_url = "https://{}".format(get_current_site(request))
+        generator = FORMATS[feed_format](
+            title=self.title,
+            link=site_url + self.link,
+            description="Recent content from {}".format(self.title),
+            language=settings.LANGUAGE_CODE,
+            feed_url=site_url + request.path,
+            updated=self.validators()[1],
+        )
+        return generator.stream(self.items(site_url))
+
+
+def blog_feed(blog):
+    return PostFeed(
+        blog,
+        Post.pub.filter(blog=blog),
+        blog.title,
+        reverse("tangerine:home", args=[blog.slug]),
+        "blog",
+    )
+
+
+def category_feed(blog, category):
+    return PostFeed(
+        blog,
+        Post.pub.filter(blog=blog, categories=category),
+        "{}: {}".format(blog.title, category.title),
+        reverse("tangerine:category", args=[blog.slug, category.slug]),
+        "category:{}".format(category.pk),
+    )
+
+
+def author_feed(blog, user):
+    return PostFeed(
+        blog,
+        Post.pub.filter(blog=blog, author=user),
+        "{}: {}".format(blog.title, user.get_full_name() or user.get_username()),
+        reverse("tangerine:author", args=[blog.slug, user.get_username()]),
+        "author:{}".format(user.pk),
+    )
+
+
+def _store_when_done(chunks, key):
+    """Pass `chunks` through, then cache them joined up under `key` once the last one has been
+    sent."""
+
+    parts = []
+    for chunk in chunks:
+        parts.append(chunk)
+        yield chunk
+    cache.set(key, "".join(parts))
+
+
+def serve_feed(request, feed, feed_format):
+    """Return a response with `feed` in `feed_format`: a 304 if the client has it already, else the
+    cached body, else the feed streamed as it's written (and cached once complete)."""
+
+    if feed_format not in FORMATS:
+        raise Http404("No such feed format.")
+    content_type = FORMATS[feed_format].content_type
+
+    state, last_modified = feed.validators()
+    etag = quote_etag("{}-{}".format(state, feed_format))
+    last_modified = int(last_modified.timestamp()) if last_modified else None
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        key = get_versioned_key(content_scope(feed.blog.pk), "feed:{}".format(etag))
+        body = cache.get(key) if key else None
+        if body is not None:
+            response = HttpResponse(body, content_type=content_type)
+        else:
+            chunks = feed.stream(request, feed_format)
+            if key:
+                chunks = _store_when_done(chunks, key)
+            response = StreamingHttpResponse(chunks, content_type=content_type)
+
+    response["ETag"] = etag
+    if last_modified:
+        response["Last-Modified"] = http_date(last_modified)
+    return response
@@ -0,0 +1,96 @@
+"""Database-backed queue for the slow steps of processing a new comment.
+
+Posting a comment only saves it, unapproved, and queues a `CommentJob` for its spam check. Each step
+queues the next one when it's done: the spam check (a call to Akismet, if configured) is followed by
+approval, and approval by the email to the moderator. The steps themselves are functions in
+`ops.py`, named in `TASKS`.
+
+By default (`TANGERINE_JOBS_INLINE = True`, or the setting left out) jobs are run as soon as they're
+queued, in the same process, so a site needs nothing else running. Sites that set it to False run
+the jobs with the `tangerine_worker` management command instead, which must then be kept running
+alongside the web server: until a worker picks them up, new comments stay unapproved and unchecked.
+A job that raises is retried after a delay that doubles with every attempt, and given up on (marked
+`failed`, with the error kept in `last_error`) after `MAX_ATTEMPTS`.
+"""
+
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from blog.tangerine.models import CommentJob
+
+# Function run by each task, called with the job's comment.
+TASKS = {
+    "spam_check": "blog.tangerine.ops.check_comment_spam",
+    "approval": "blog.tangerine.ops.approve_comment",
+    "notify": "blog.tangerine.ops.notify_moderator",
+}
+
+MAX_ATTEMPTS = 5
+
+# Seconds before a failed job is retried the first time; doubled after every further failure.
+RETRY_DELAY = 30
+
+# Seconds a job is left to the worker that claimed it, before another worker may take it over.
+LEASE = 600
+
+
+def jobs_inline():
+    return getattr(settings, "TANGERINE_JOBS_INLINE", True)
+
+
+def enqueue(comment, task):
+    """Queue `task` (a key of TASKS) for `comment`, or run it right away if jobs are run inline."""
+
+    job = CommentJob.objects.create(comment=comment, task=task)
+    if jobs_inline():
+        run_job(job)
+    return job
+
+
+def claim_job():
+    """Return the next job that's due, leased to the caller, or None if no job is due.
+
+    The lease pushes the job's `run_after` forward, so other workers pass it over while it runs but
+    pick it up again if this one dies without finishing it."""
+
+    now = timezone.now()
+    with transaction.atomic():
+        job = (
+            CommentJob.objects.select_for_update(skip_locked=True)
+            .filter(failed=False, run_after__lte=now)
+            .first()
+        )
+        if job is not None:
+            job.attempts += 1
+            job.run_after = now + timedelta(seconds=LEASE)
+            job.save(update_fields=["attempts", "run_after", "modified"])
+    return job
+
+
+def run_job(job):
+    """Run `job`, and delete it if it succeeds. If it fails, schedule it to be retried, or mark it
+    failed. Returns True if the job succeeded."""
+
+    if jobs_inline() and not job.attempts:
+        # Inline jobs aren't claimed by a worker; count the attempt here.
+        job.attempts = 1
+    try:
+        with transaction.atomic():
+            import_string(TASKS[job.task])(job.comment)
+            job.delete()
+    except Exception:
+        job.last_error = traceback.format_exc()
+        if job.attempts >= MAX_ATTEMPTS:
+            job.failed = True
+        else:
+            job.run_after = timezone.now() + timedelta(
+                seconds=RETRY_DELAY * 2 ** (job.attempts - 1)
+            )
+        job.save(update_fields=["attempts", "run_after", "last_error", "failed", "modified"])
+        return False
+    return True
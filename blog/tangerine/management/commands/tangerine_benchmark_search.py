@@ -0,0 +1,94 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from blog.tangerine.models import Blog, Post
+from blog.tangerine.search import SearchBackend, get_search_backend
+
+WORDS = (
+    "tangerine orange citrus grove harvest market farmer season winter summer rain drought river "
+    "valley mountain coast city road bridge station library museum garden kitchen recipe bread "
+    "coffee music guitar piano concert festival election council budget school teacher student "
+    "science physics python django database server network security privacy camera photo travel "
+    "train flight hotel island ocean"
+).split()
+
+# Made-up filler words, so that the real ones above are spread across common and rare.
+FILLER_WORDS = 5000
+
+# Common words, rare words and phrases that appear in no post at all.
+QUERIES = ["citrus", "harvest season", "python django database", "ocean island travel", "zeppelin"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Time full-text search against the plain icontains search on a throwaway set of generated "
+        "posts. Everything is created in a transaction that is rolled back at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--posts", type=int, default=100000, help="Number of posts to generate."
+        )
+        parser.add_argument("--runs", type=int, default=5, help="Times to run each query.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.benchmark(options["posts"], options["runs"])
+            transaction.set_rollback(True)
+
+    def benchmark(self, num_posts, runs):
+        backend = get_search_backend()
+        blog = Blog.objects.create(title="Search benchmark", slug="tangerine-search-benchmark")
+
+        print("Generating {} posts...".format(num_posts))
+        rng = random.Random(42)
+        letters = "abcdefghijklmnopqrstuvwxyz"
+        vocabulary = list(WORDS) + [
+            "".join(rng.choices(letters, k=rng.randint(4, 10))) for _ in range(FILLER_WORDS)
+        ]
+        rng.shuffle(vocabulary)
+        # Word frequencies roughly follow Zipf's law, as in real text.
+        weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+
+        def text(num_words):
+            return " ".join(rng.choices(vocabulary, weights, k=num_words))
+
+        now = timezone.now()
+        posts = (
+            Post(
+                blog=blog,
+                title=text(6).capitalize(),
+                slug="benchmark-{}".format(n),
+                summary=text(20),
+                content="<p>{}</p>".format(text(300)),
+                pub_date=now - timedelta(hours=n),
+            )
+            for n in range(num_posts)
+        )
+        Post.objects.bulk_create(posts, batch_size=1000)
+
+        started = time.perf_counter()
+        backend.rebuild()
+        print(
+            "Indexed with {} in {:.1f}s.".format(
+                type(backend).__name__, time.perf_counter() - started
+            )
+        )
+
+        print("{:<25} {:>8} {:>14} {:>14}".format("query", "matches", "icontains ms", "indexed ms"))
+        for q in QUERIES:
+            # As in the search view: count the matches, then fetch the first page.
+            timings = []
+            for engine in (SearchBackend(), backend):
+                started = time.perf_counter()
+                for _ in range(runs):
+                    results = engine.search(q, blog=blog)
+                    matches = results.count()
+                    list(results[:25])
+                timings.append((time.perf_counter() - started) * 1000 / runs)
+            print("{:<25} {:>8} {:>14.1f} {:>14.1f}".format(q, matches, *timings))
@@ -0,0 +1,67 @@
+import os
+import time
+
+from django.contrib.sites.models import Site
+from django.core.management.base import BaseCommand, CommandError
+
+from blog.tangerine.export import export
+from blog.tangerine.models import Blog
+
+
+class Command(BaseCommand):
+    help = (
+        "Render every public page of a blog (or of all blogs) to static files under OUTPUT_DIR, "
+        "laid out like the site's URLs so a web server can serve them directly. "
+        "With --incremental, re-render only the pages affected by changes since the last export. "
+        "Publishing, unpublishing or re-dating a post still re-renders all of its blog's pages."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("output_dir", help="Directory to write the pages to.")
+        parser.add_argument("--blog", help="Slug of the blog to export. Default: all blogs.")
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            help="Update the last export into OUTPUT_DIR, covering the same blogs. Pages that "
+            "failed to render last time are tried again.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="Number of processes rendering pages. Default: one per CPU.",
+        )
+        parser.add_argument(
+            "--host",
+            help="Host name the pages are rendered for. Default: the current Site's domain.",
+        )
+
+    def handle(self, *args, **options):
+        blogs = Blog.objects.order_by("pk")
+        if options["blog"]:
+            if options["incremental"]:
+                raise CommandError(
+                    "--incremental covers the blogs of the last export; drop --blog."
+                )
+            blogs = blogs.filter(slug=options["blog"])
+            if not blogs:
+                raise CommandError("No blog with slug '{}'.".format(options["blog"]))
+        host = options["host"] or Site.objects.get_current().domain
+
+        started = time.perf_counter()
+        result = export(
+            blogs, options["output_dir"], host, options["workers"], options["incremental"]
+        )
+        elapsed = time.perf_counter() - started
+
+        for path, status_code in result["failures"]:
+            print("Couldn't render {} (status {}); kept its last export.".format(path, status_code))
+        print(
+            "Rendered {} pages in {:.1f}s ({:.1f} pages/sec): {} files written, {} removed.".format(
+                result["rendered"],
+                elapsed,
+                result["rendered"] / elapsed if elapsed else 0,
+                result["written"],
+                result["removed"],
+            )
+        )
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from blog.tangerine.models import ArchiveMonth
+
+
+class Command(BaseCommand):
+    help = (
+        "Recount the per-month post counts behind the date archive sidebar from every blog's posts."
+    )
+
+    def handle(self, *args, **options):
+        num_months = ArchiveMonth.objects.rebuild()
+        print("Rebuilt date archives: {} months.".format(num_months))
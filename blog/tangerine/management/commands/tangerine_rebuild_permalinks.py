@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from blog.tangerine.models import Post
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild every Post's stored permalink, e.g. after changing the URL configuration or "
+        "TIME_ZONE."
+    )
+
+    def handle(self, *args, **options):
+        num_posts = Post.objects.all().rebuild_permalinks()
+        print("Rebuilt permalinks for {} posts.".format(num_posts))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from blog.tangerine.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = "Re-index every Post in the full-text search backend."
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        num_posts = backend.rebuild()
+        print("Indexed {} posts with {}.".format(num_posts, type(backend).__name__))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from blog.tangerine.models import Post
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute every Post's stored approved comment count and last comment time from its "
+        "comments."
+    )
+
+    def handle(self, *args, **options):
+        num_posts = Post.objects.all().recount_comments()
+        print("Recounted comments for {} posts.".format(num_posts))
@@ -0,0 +1,31 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from blog.tangerine.models import Comment
+from blog.tangerine.spam import MIN_TRAINING, get_model_path, train
+
+
+class Command(BaseCommand):
+    help = (
+        "Train the built-in spam classifier from scratch on every comment's spam flag, replacing "
+        "any earlier model. Moderation keeps it up to date after that."
+    )
+
+    def handle(self, *args, **options):
+        path = get_model_path()
+        if not path:
+            raise CommandError("Set TANGERINE_SPAM_MODEL_PATH to where the model should be saved.")
+
+        classifier = train(Comment.objects.all())
+        print(
+            "Trained on {} spam and {} ham comments; saved {} ({:.0f} KB).".format(
+                classifier.num_spam, classifier.num_ham, path, os.path.getsize(path) / 1024
+            )
+        )
+        if min(classifier.num_spam, classifier.num_ham) < MIN_TRAINING:
+            print(
+                "The classifier needs at least {} of each to flag anything as spam.".format(
+                    MIN_TRAINING
+                )
+            )
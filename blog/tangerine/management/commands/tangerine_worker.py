@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from blog.tangerine.caching import clear_request_memo
+from blog.tangerine.jobs import claim_job, run_job
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued comment jobs (spam checks, approvals, moderator emails) as they come due, "
+        "for sites that set TANGERINE_JOBS_INLINE = False. "
+        "Failed jobs are retried with increasing delays. Run as many workers as you like."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Run the jobs that are due now, then exit.",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=5,
+            help="Seconds to wait before looking again when no job is due. Default: 5.",
+        )
+
+    def handle(self, *args, **options):
+        succeeded = failed = 0
+        while True:
+            # Don't hang on to a connection the database has dropped while we slept. Each job also
+            # starts with a fresh memo, as a request would, so that it sees the current Blog
+            # settings.
+            close_old_connections()
+            clear_request_memo()
+            job = claim_job()
+            if job is None:
+                if options["once"]:
+                    break
+                time.sleep(options["sleep"])
+                continue
+
+            if run_job(job):
+                succeeded += 1
+            else:
+                failed += 1
+                print("{} failed (attempt {}).".format(job, job.attempts))
+        print("Ran {} jobs: {} succeeded, {} failed.".format(succeeded + failed, succeeded, failed))
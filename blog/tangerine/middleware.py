@@ -0,0 +1,117 @@
+"""Full-page cache for anonymous readers.
+
+`PageCacheMiddleware` stores the rendered responses of Tangerine's public reading views
+(`CACHED_VIEWS`) for anonymous GET requests, keyed by blog slug, path and query string, and serves
+later requests for the same page straight from Django's cache without running the view.
+
+Entries are tagged with version tokens from `caching.py` rather than deleted when content changes:
+
+- List pages (home, categories, date archives, the feed) carry their blog's content version, so
+  saving a post, comment, category etc. in a blog drops that blog's list pages and no other blog's.
+- A post's page carries the version of its own page scope, bumped only when that post or one of its
+  comments is saved or deleted, or the post is added to or removed from a category (see
+  `signals.py`). Parts of it that depend on other posts (the sidebar, next/previous links) can lag
+  behind for up to `TANGERINE_PAGE_CACHE_TIMEOUT` seconds.
+
+Requests from logged-in users, and requests with flash messages waiting to be shown, always go to
+the view. Cached pages that contain a form get a fresh CSRF token for each request they're served
+to.
+
+Add the middleware after `CsrfViewMiddleware`, `AuthenticationMiddleware` and `MessageMiddleware`.
+"""
+
+import hashlib
+import re
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe, urlencode
+
+from blog.tangerine.caching import content_scope, get_blog, get_scope_version, page_scope
+
+# URL names of the views whose pages are cached.
+CACHED_VIEWS = ("home", "post_detail", "category", "date_archive", "feed")
+
+# Seconds a cached page is kept, at most.
+DEFAULT_TIMEOUT = 600
+
+CSRF_TOKEN_RE = re.compile(rb'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+CSRF_PLACEHOLDER = b"__tangerine_csrf_token__"
+
+
+def get_page_cache_key(request):
+    """Return the cache key for the page `request` asks for, or None if the page can't be cached."""
+
+    match = request.resolver_match
+    blog = get_blog(slug=match.kwargs["blog_slug"])
+    if blog is None:
+        return None
+
+    # Build the path back from the URL arguments so that e.g. /2020/01/02/ and /2020/1/2/ share an
+    # entry.
+    path = reverse(match.view_name, args=match.args, kwargs=match.kwargs)
+    if match.url_name == "post_detail":
+        scope = page_scope(path)
+    else:
+        scope = content_scope(blog.pk)
+    version = get_scope_version(scope)
+    if version is None:
+        return None
+
+    query = urlencode(sorted(request.GET.lists()), doseq=True)
+    digest = hashlib.md5("{}?{}".format(path, query).encode()).hexdigest()
+    return "tangerine:page:{}:{}:{}".format(blog.slug, version, digest)
+
+
+class PageCacheMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.timeout = getattr(settings, "TANGERINE_PAGE_CACHE_TIMEOUT", DEFAULT_TIMEOUT)
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        key = getattr(request, "_tangerine_page_cache_key", None)
+        if key and response.status_code == 200 and not response.streaming:
+            content = CSRF_TOKEN_RE.sub(rb"\g<1>" + CSRF_PLACEHOLDER + rb"\g<2>", response.content)
+            cache.set(key, (content, dict(response.items())), self.timeout)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        if (
+            match.namespace != "tangerine"
+            or match.url_name not in CACHED_VIEWS
+            or request.method not in ("GET", "HEAD")
+            or request.user.is_authenticated
+            or get_messages(request)
+        ):
+            return None
+
+        key = get_page_cache_key(request)
+        if key is None:
+            return None
+        cached = cache.get(key)
+        if cached is None:
+            if request.method == "GET":
+                request._tangerine_page_cache_key = key
+            return None
+
+        content, headers = cached
+        if CSRF_PLACEHOLDER in content:
+            content = content.replace(CSRF_PLACEHOLDER, get_token(request).encode())
+        response = HttpResponse(content)
+        for header, value in headers.items():
+            response[header] = value
+        # Pages whose views validate conditional requests (e.g. the feed) still answer them when
+        # cached.
+        return get_conditional_response(
+            request,
+            etag=response.get("ETag"),
+            last_modified=parse_http_date_safe(response.get("Last-Modified")),
+            response=response,
+        )
@@ -0,0 +1,51 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tangerine", "0033_auto_20180127_2314"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(
+                condition=models.Q(("ptype", "post"), ("published", True), ("trashed", False)),
+                fields=["blog", "-pub_date"],
+                name="post_pub_blog_date_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(
+                condition=models.Q(("ptype", "post"), ("published", True), ("trashed", False)),
+                fields=["-pub_date"],
+                name="post_pub_date_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(
+                condition=models.Q(("approved", True)),
+                fields=["post", "modified"],
+                name="comment_pub_post_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(
+                condition=models.Q(("approved", True)),
+                fields=["parent", "modified"],
+                name="comment_pub_parent_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(
+                condition=models.Q(("approved", True)),
+                fields=["-created"],
+                name="comment_pub_created_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tangerine", "0034_post_comment_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="blog",
+            name="pagination",
+            field=models.CharField(
+                choices=[
+                    ("page", "Numbered pages"),
+                    ("keyset", "Older/newer links (faster on large blogs)"),
+                ],
+                default="page",
+                help_text="How list views are split into pages. Numbered pages must count every post in the list; older/newer links don't, and stay fast however far back readers page.",
+                max_length=8,
+            ),
+        ),
+    ]
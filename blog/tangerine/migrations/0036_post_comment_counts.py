@@ -0,0 +1,36 @@
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def recount_comments(apps, schema_editor):
+    Post = apps.get_model("tangerine", "Post")
+    Comment = apps.get_model("tangerine", "Comment")
+    approved_comments = Comment.objects.filter(post=OuterRef("pk"), approved=True).order_by()
+    Post.objects.update(
+        approved_comment_count=Coalesce(
+            Subquery(approved_comments.values("post").annotate(num=Count("pk")).values("num")), 0
+        ),
+        last_comment_at=Subquery(approved_comments.order_by("-created").values("created")[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tangerine", "0035_blog_pagination"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="approved_comment_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="post",
+            name="last_comment_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(recount_comments, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncMonth
+import django.db.models.deletion
+
+
+def count_archive_months(apps, schema_editor):
+    Post = apps.get_model("tangerine", "Post")
+    ArchiveMonth = apps.get_model("tangerine", "ArchiveMonth")
+    counts = (
+        Post.objects.filter(blog__isnull=False, published=True, trashed=False, ptype="post")
+        .annotate(month=TruncMonth("pub_date", output_field=models.DateField()))
+        .values("blog", "month")
+        .annotate(num_posts=Count("pk"))
+        .order_by()
+    )
+    ArchiveMonth.objects.bulk_create(
+        ArchiveMonth(blog_id=row["blog"], month=row["month"], num_posts=row["num_posts"])
+        for row in counts
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tangerine", "0036_post_comment_counts"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchiveMonth",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("month", models.DateField(help_text="First day of the month.")),
+                ("num_posts", models.PositiveIntegerField(default=0)),
+                (
+                    "blog",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="tangerine.Blog"
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("blog", "month")},
+            },
+        ),
+        migrations.RunPython(count_archive_months, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations, models
+from django.urls import reverse
+from django.utils.timezone import is_aware, make_naive
+
+
+def build_permalinks(apps, schema_editor):
+    Post = apps.get_model("tangerine", "Post")
+    posts = list(Post.objects.filter(blog__isnull=False).select_related("blog"))
+    for post in posts:
+        naive_date = make_naive(post.pub_date) if is_aware(post.pub_date) else post.pub_date
+        post.permalink = reverse(
+            "tangerine:post_detail",
+            args=[post.blog.slug, naive_date.year, naive_date.month, naive_date.day, post.slug],
+        )
+    Post.objects.bulk_update(posts, ["permalink"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tangerine", "0037_archivemonth"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="permalink",
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.RunPython(build_permalinks, migrations.RunPython.noop),
+    ]
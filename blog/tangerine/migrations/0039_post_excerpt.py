@@ -0,0 +1,33 @@
+from django.db import migrations, models
+
+from blog.tangerine.models import make_excerpt, make_meta_description
+
+
+def build_excerpts(apps, schema_editor):
+    Post = apps.get_model("tangerine", "Post")
+    posts = list(Post.objects.only("summary", "content"))
+    for post in posts:
+        post.excerpt = make_excerpt(post.summary, post.content)
+        post.meta_description = make_meta_description(post.summary, post.content)
+    Post.objects.bulk_update(posts, ["excerpt", "meta_description"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tangerine", "0038_post_permalink"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="excerpt",
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name="post",
+            name="meta_description",
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.RunPython(build_excerpts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,80 @@
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import django_extensions.db.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tangerine", "0039_post_excerpt"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CommentJob",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                (
+                    "created",
+                    django_extensions.db.fields.CreationDateTimeField(
+                        auto_now_add=True, verbose_name="created"
+                    ),
+                ),
+                (
+                    "modified",
+                    django_extensions.db.fields.ModificationDateTimeField(
+                        auto_now=True, verbose_name="modified"
+                    ),
+                ),
+                (
+                    "task",
+                    models.CharField(
+                        choices=[
+                            ("spam_check", "Spam check"),
+                            ("approval", "Approval"),
+                            ("notify", "Moderator notification"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                (
+                    "run_after",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now,
+                        help_text="The job isn't run before this time.",
+                    ),
+                ),
+                ("attempts", models.PositiveIntegerField(default=0)),
+                ("last_error", models.TextField(blank=True)),
+                (
+                    "failed",
+                    models.BooleanField(
+                        default=False, help_text="Given up on after too many attempts."
+                    ),
+                ),
+                (
+                    "comment",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="tangerine.Comment"
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["run_after", "pk"],
+            },
+        ),
+        migrations.AddIndex(
+            model_name="commentjob",
+            index=models.Index(
+                condition=models.Q(("failed", False)),
+                fields=["run_after"],
+                name="commentjob_due_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,37 @@
+from django.db import migrations, models
+
+
+def dedupe_emails(apps, schema_editor):
+    # Keep the oldest row for each address (compared trimmed and lowercased, as stored from now on).
+    ApprovedCommentor = apps.get_model("tangerine", "ApprovedCommentor")
+    kept = {}
+    duplicates = []
+    renamed = []
+    for commentor in ApprovedCommentor.objects.order_by("pk").only("email"):
+        email = commentor.email.strip().lower()
+        if email in kept:
+            duplicates.append(commentor.pk)
+        else:
+            kept[email] = commentor
+            if commentor.email != email:
+                commentor.email = email
+                renamed.append(commentor)
+    for i in range(0, len(duplicates), 500):
+        ApprovedCommentor.objects.filter(pk__in=duplicates[i : i + 500]).delete()
+    ApprovedCommentor.objects.bulk_update(renamed, ["email"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tangerine", "0040_commentjob"),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_emails, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="approvedcommentor",
+            name="email",
+            field=models.EmailField(max_length=254, unique=True),
+        ),
+    ]
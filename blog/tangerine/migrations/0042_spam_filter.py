@@ -0,0 +1,29 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tangerine", "0041_approvedcommentor_email_unique"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="blog",
+            name="spam_filter",
+            field=models.CharField(
+                choices=[
+                    ("akismet", "Akismet (needs an Akismet key)"),
+                    ("bayes", "Built-in classifier, trained on your moderation"),
+                ],
+                default="akismet",
+                help_text="How new comments are checked for spam. The built-in classifier needs training first: see the tangerine_train_spam management command.",
+                max_length=12,
+            ),
+        ),
+        migrations.AddField(
+            model_name="comment",
+            name="spam_trained",
+            field=models.BooleanField(editable=False, null=True),
+        ),
+    ]
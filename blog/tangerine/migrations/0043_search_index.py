@@ -0,0 +1,108 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class RunSQLFor(migrations.RunSQL):
+    """RunSQL on databases of one vendor only: each full-text search backend keeps its own kind of
+    index."""
+
+    def __init__(self, vendor, *args, **kwargs):
+        self.vendor = vendor
+        super().__init__(*args, **kwargs)
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == self.vendor:
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == self.vendor:
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+def fill_search_index(apps, schema_editor):
+    from blog.tangerine.search import BACKENDS
+
+    backend_class = BACKENDS.get(schema_editor.connection.vendor)
+    if backend_class is not None:
+        backend_class().rebuild(apps.get_model("tangerine", "Post").objects.all())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tangerine", "0042_spam_filter"),
+    ]
+
+    operations = [
+        # Sites that ran earlier versions already have the tables (created after `migrate`), hence
+        # IF NOT EXISTS.
+        # SQLiteSearchBackend: an FTS5 table, whose rowids are post ids.
+        RunSQLFor(
+            "sqlite",
+            sql=[
+                "CREATE VIRTUAL TABLE IF NOT EXISTS tangerine_post_fts USING fts5("
+                "blog, title, summary, content, tokenize = 'porter unicode61')",
+            ],
+            reverse_sql=["DROP TABLE tangerine_post_fts"],
+        ),
+        # PostgresSearchBackend: weighted tsvectors. btree_gin lets a single GIN index cover both
+        # the blog and the document.
+        RunSQLFor(
+            "postgresql",
+            sql=[
+                "CREATE EXTENSION IF NOT EXISTS btree_gin",
+                "CREATE TABLE IF NOT EXISTS tangerine_post_search ("
+                "post_id integer PRIMARY KEY REFERENCES tangerine_post (id) "
+                "ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+                "blog_id integer, "
+                "document tsvector NOT NULL)",
+                "CREATE INDEX IF NOT EXISTS tangerine_post_search_idx "
+                "ON tangerine_post_search USING gin (blog_id, document)",
+            ],
+            # The extension is left installed: other apps may have come to rely on it.
+            reverse_sql=["DROP TABLE tangerine_post_search"],
+        ),
+        migrations.CreateModel(
+            name="SQLiteSearchEntry",
+            fields=[
+                (
+                    "post",
+                    models.OneToOneField(
+                        db_column="rowid",
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        primary_key=True,
+                        related_name="sqlite_search_entry",
+                        serialize=False,
+                        to="tangerine.Post",
+                    ),
+                ),
+                ("index", models.TextField(db_column="tangerine_post_fts")),
+            ],
+            options={
+                "db_table": "tangerine_post_fts",
+                "managed": False,
+            },
+        ),
+        migrations.CreateModel(
+            name="PostgresSearchEntry",
+            fields=[
+                (
+                    "post",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        primary_key=True,
+                        related_name="postgres_search_entry",
+                        serialize=False,
+                        to="tangerine.Post",
+                    ),
+                ),
+                ("blog_id", models.IntegerField(null=True)),
+                ("document", models.TextField()),
+            ],
+            options={
+                "db_table": "tangerine_post_search",
+                "managed": False,
+            },
+        ),
+        migrations.RunPython(fill_search_index, migrations.RunPython.noop),
+    ]
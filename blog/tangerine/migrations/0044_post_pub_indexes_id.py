@@ -0,0 +1,35 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tangerine", "0043_search_index"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="post",
+            name="post_pub_blog_date_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="post",
+            name="post_pub_date_idx",
+        ),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(
+                condition=models.Q(("ptype", "post"), ("published", True), ("trashed", False)),
+                fields=["blog", "-pub_date", "-id"],
+                name="post_pub_blog_date_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(
+                condition=models.Q(("ptype", "post"), ("published", True), ("trashed", False)),
+                fields=["-pub_date", "-id"],
+                name="post_pub_date_idx",
+            ),
+        ),
+    ]
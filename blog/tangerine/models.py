@@ -1,13 +1,28 @@
+from collections import defaultdict
+from html import unescape
+
 from django.contrib.auth import get_user_model
 from django.contrib.sites.models import Site
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Greatest, TruncMonth
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.html import strip_tags
+from django.utils.text import Truncator
 from django.utils.timezone import make_naive, is_aware
 
 
 from django_extensions.db.models import TimeStampedModel
 
+from blog.tangerine.caching import (
+    bump_version,
+    get_approved_commentors,
+    get_blog,
+    get_show_future_blog_ids,
+    invalidate_approved_commentors,
+)
+
 # from taggit.managers import TaggableManager
 
 
@@ -16,9 +31,24 @@ POST_TYPE_CHOICES = (
     ("page", "Page"),
 )
 
+PAGINATION_CHOICES = (
+    ("page", "Numbered pages"),
+    ("keyset", "Older/newer links (faster on large blogs)"),
+)
+
+# Length of the excerpt shown for posts without a summary on list views and feeds, and of the meta
+# description.
+EXCERPT_WORDS = 20
+META_DESCRIPTION_WORDS = 5
+
 # FIXME Also support Disqus, Facebook, other commenting systems?
 COMMENT_SYSTEM_CHOICES = (("native", "Native"),)
 
+SPAM_FILTER_CHOICES = (
+    ("akismet", "Akismet (needs an Akismet key)"),
+    ("bayes", "Built-in classifier, trained on your moderation"),
+)
+
 
 class Blog(models.Model):
     """Blog-wide meta/config for a Tangerine installation. Only one instance of this model is allowed."""
@@ -44,6 +74,14 @@ class Blog(models.Model):
         help_text="Used on default homepage, categories, date archives, etc.)",
     )
 
+    pagination = models.CharField(
+        choices=PAGINATION_CHOICES,
+        default="page",
+        max_length=8,
+        help_text="How list views are split into pages. Numbered pages must count every post in "
+        "the list; older/newer links don't, and stay fast however far back readers page.",
+    )
+
     google_analytics_id = models.CharField(
         blank=True,
         help_text="Enter just the GA tracking ID provided by Google, not the entire codeblock, e.g UA-123456-2.",
@@ -75,6 +113,14 @@ class Blog(models.Model):
         help_text='Select the commenting system to be used. Tangerine\'s is "Native".',
     )
 
+    spam_filter = models.CharField(
+        choices=SPAM_FILTER_CHOICES,
+        default="akismet",
+        max_length=12,
+        help_text="How new comments are checked for spam. The built-in classifier needs training "
+        "first: see the tangerine_train_spam management command.",
+    )
+
     from_email = models.CharField(
         default="June Carter-Cash <june@example.com>",
         max_length=100,
@@ -125,9 +171,75 @@ class Category(models.Model):
         return self.title
 
 
-class PostManager(models.Manager):
-    """Filter out all unpublished and trashed posts by calling Post.pub.all() from anywhere.
-    Filter out future posts if show_future disabled in Blog config.
+def make_excerpt(summary, content):
+    """Return the HTML shown for a post on list views: its summary if it has one, else the start of
+    its content (with any tags left open by the cut closed again)."""
+
+    return summary or Truncator(content).words(EXCERPT_WORDS, html=True)
+
+
+def make_meta_description(summary, content):
+    """Return a plain-text description of a post, for its page's `<meta name="description">`."""
+
+    text = " ".join(unescape(strip_tags(summary or content)).split())
+    return text if summary else Truncator(text).words(META_DESCRIPTION_WORDS)
+
+
+class PostQuerySet(models.QuerySet):
+    def listing(self):
+        """Prepare posts for list views (post_loop.html, feeds): preload blog, author and
+        categories, and skip the content and summary, which lists show through `excerpt`. The number
+        of queries is then fixed no matter how many posts are rendered."""
+
+        return (
+            self.select_related("blog", "author")
+            .prefetch_related("categories")
+            .defer("content", "summary")
+        )
+
+    def rebuild_permalinks(self, blog=None):
+        """Rebuild and store the permalinks of these posts (which must all belong to `blog`, if
+        given), without going through `Post.save()`. Returns the number of posts updated."""
+
+        posts = list(self.only("pk", "blog", "slug", "pub_date"))
+        for post in posts:
+            post.permalink = post.build_permalink(blog)
+        self.model.objects.bulk_update(posts, ["permalink"], batch_size=500)
+        return len(posts)
+
+    def update_comment_counts(self, delta=0):
+        """Shift the stored approved comment count of these posts by `delta` and refresh
+        `last_comment_at`, in a single atomic UPDATE. Called by signal receivers as comments come
+        and go (see `signals.py`)."""
+
+        return self.update(
+            # Never below zero, even if the stored count has drifted.
+            approved_comment_count=Greatest(F("approved_comment_count") + delta, 0),
+            last_comment_at=Subquery(
+                Comment.objects.filter(post=OuterRef("pk"), approved=True)
+                .order_by("-created")
+                .values("created")[:1]
+            ),
+        )
+
+    def recount_comments(self):
+        """Recompute the stored approved comment count and `last_comment_at` of these posts from
+        scratch, in a single UPDATE. Repairs any drift; see the `tangerine_recount_comments`
+        management command."""
+
+        approved_comments = Comment.objects.filter(post=OuterRef("pk"), approved=True).order_by()
+        return self.update(
+            approved_comment_count=Coalesce(
+                Subquery(approved_comments.values("post").annotate(num=Count("pk")).values("num")),
+                0,
+            ),
+            last_comment_at=Subquery(approved_comments.order_by("-created").values("created")[:1]),
+        )
+
+
+class PostManager(models.Manager.from_queryset(PostQuerySet)):
+    """Filter out all unpublished and trashed posts by calling Post.pub.all() from anywhere. Filter
+    out future posts unless show_future is enabled in the config of the Blog each post belongs to.
 
     Intentionally does not filter by blog, so calls can either be:
     `Post.pub.all()` or `Post.pub.filter(blog=blog)`.
@@ -141,14 +253,21 @@ class PostManager(models.Manager):
             .filter(published=True, ptype="post", trashed=False)
             .order_by("-pub_date")
         )
-        config = Blog.objects.first()
 
-        if not config.show_future:
-            qs = qs.exclude(pub_date__gt=timezone.now())
+        # Blog config comes from the cache layer, so this usually costs no query at all.
+        show_future_ids = get_show_future_blog_ids()
+        if show_future_ids:
+            qs = qs.filter(Q(pub_date__lte=timezone.now()) | Q(blog_id__in=show_future_ids))
+        else:
+            qs = qs.filter(pub_date__lte=timezone.now())
 
         return qs
 
 
+# Post fields kept up to date by signal receivers as comments come and go (see `signals.py`).
+COMMENT_COUNTER_FIELDS = ("approved_comment_count", "last_comment_at")
+
+
 class Post(TimeStampedModel):
     """Core definition for a Blog Post"""
 
@@ -193,6 +312,20 @@ class Post(TimeStampedModel):
         blank=True,
     )
 
+    # URL path of the post, built by `save()` so that rendering links needs no URL resolution or
+    # Blog lookup. Rebuilt for all of a blog's posts when its slug changes (see `signals.py`).
+    permalink = models.CharField(max_length=255, blank=True, editable=False)
+
+    # Built from summary and content by `save()`, so that list views and page headers needn't load
+    # or truncate the whole content on every render.
+    excerpt = models.TextField(blank=True, editable=False)
+    meta_description = models.TextField(blank=True, editable=False)
+
+    # Denormalized from Comment, so list views needn't count comments per post. Kept up to date by
+    # signal receivers in `signals.py`; `manage.py tangerine_recount_comments` rebuilds them.
+    approved_comment_count = models.PositiveIntegerField(default=0, editable=False)
+    last_comment_at = models.DateTimeField(blank=True, null=True, editable=False)
+
     # Used instead of 'created' or 'modified' datetime fields in queries (for editorial control over publication date).
     # Initial pub_date is set in `Post.save()`.
     pub_date = models.DateTimeField(
@@ -216,16 +349,45 @@ class Post(TimeStampedModel):
 
     # tags = TaggableManager()
 
-    objects = models.Manager()  # The default manager, unfiltered by manager (admin use only)
+    # The default manager, unfiltered by manager (admin use only)
+    objects = PostQuerySet.as_manager()
     pub = PostManager()  # Post.pub.all() gets just published, non-trashed posts
 
+    class Meta:
+        # Partial indexes matching the filters applied by PostManager, so that public views can walk
+        # posts in pub_date order (per blog, or across blogs) without scanning and sorting the
+        # table. The id breaks ties between posts published at the same time, as keyset pagination
+        # does.
+        indexes = [
+            models.Index(
+                fields=["blog", "-pub_date", "-id"],
+                name="post_pub_blog_date_idx",
+                condition=Q(published=True, ptype="post", trashed=False),
+            ),
+            models.Index(
+                fields=["-pub_date", "-id"],
+                name="post_pub_date_idx",
+                condition=Q(published=True, ptype="post", trashed=False),
+            ),
+        ]
+
     def get_absolute_url(self):
+        # Stored at save time; only posts saved before `permalink` existed need building on the fly.
+        return self.permalink or self.build_permalink()
+
+    def build_permalink(self, blog=None):
+        """Return the URL path of this post's detail page. Pass `blog` if it isn't the one in the
+        cache (e.g. while its slug is being changed)."""
+
+        blog = blog or get_blog(pk=self.blog_id)
+        if blog is None:
+            return ""
         # TZ awareness can throw off date resolution when near day boundaries, and generate 404s.
         # If USE_TZ=True in settings, `make_naive` so URL elements always match date elements in `self.pub_date`.
         naive_date = make_naive(self.pub_date) if is_aware(self.pub_date) else self.pub_date
         return reverse(
             "tangerine:post_detail",
-            args=[self.blog.slug, naive_date.year, naive_date.month, naive_date.day, self.slug],
+            args=[blog.slug, naive_date.year, naive_date.month, naive_date.day, self.slug],
         )
 
     def top_level_comments(self):
@@ -233,20 +395,186 @@ class Post(TimeStampedModel):
         # Get their children in a comment method.
         return self.comment_set.filter(parent__isnull=True, approved=True).order_by("modified")
 
+    def comment_tree(self):
+        """Return all approved comments on this Post as a flat list in threaded (depth-first) order,
+        each with a `depth` attribute (0 for top-level comments). Fetches every comment in a single
+        query and builds the tree in memory, so threads of any depth cost the same. Replies to
+        unapproved comments are left out, along with their parent."""
+
+        children = defaultdict(list)
+        for comment in Comment.pub.filter(post=self).order_by("modified"):
+            children[comment.parent_id].append(comment)
+
+        tree = []
+        stack = [(comment, 0) for comment in reversed(children[None])]
+        while stack:
+            comment, depth = stack.pop()
+            comment.depth = depth
+            tree.append(comment)
+            stack.extend((child, depth + 1) for child in reversed(children[comment.id]))
+        return tree
+
     def num_comments(self):
-        # Return number of all comments for this Post, regardless whether top-level or threaded.
-        return self.comment_set.filter(approved=True).count()
+        # Return number of all approved comments for this Post, regardless whether top-level or
+        # threaded.
+        return self.approved_comment_count
 
     def save(self, *args, **kwargs):
         # Populate pub_date if needed; don't update if already exists.
         if not self.pub_date:
             self.pub_date = timezone.now()
-        return super(Post, self).save(*args, **kwargs)
+
+        self.permalink = self.build_permalink()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and {"slug", "blog", "pub_date"} & set(update_fields):
+            kwargs["update_fields"] = update_fields = [*update_fields, "permalink"]
+
+        deferred = self.get_deferred_fields()
+        if not {"summary", "content"} & deferred:
+            self.excerpt = make_excerpt(self.summary, self.content)
+            self.meta_description = make_meta_description(self.summary, self.content)
+            if update_fields is not None and {"summary", "content"} & set(update_fields):
+                kwargs["update_fields"] = [*update_fields, "excerpt", "meta_description"]
+
+        # Partial saves are modifications too: conditional GETs and static exports go by `modified`.
+        if kwargs.get("update_fields") is not None and "modified" not in kwargs["update_fields"]:
+            kwargs["update_fields"] = [*kwargs["update_fields"], "modified"]
+
+        super(Post, self).save(*args, **kwargs)
+
+        # Signal receivers have compared against the old values by now; later saves compare against
+        # these.
+        self._loaded_values = {
+            f.attname: getattr(self, f.attname)
+            for f in self._meta.concrete_fields
+            if f.attname not in deferred
+        }
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        # Comment counters are maintained in the database by signal receivers. Unless they were
+        # changed on this instance, leave them out of the UPDATE, so that values loaded before the
+        # latest comments arrived can't overwrite them. (Inserts write them as usual.)
+        loaded = getattr(self, "_loaded_values", {})
+        values = [
+            (field, model, value)
+            for field, model, value in values
+            if field.attname not in COMMENT_COUNTER_FIELDS
+            or (field.attname in loaded and loaded[field.attname] != value)
+        ]
+        return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # Remember field values as loaded, so signal receivers can tell what a save changed.
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
 
     def __str__(self):
         return self.title
 
 
+# Posts counted in the date archive: those that date_archive views can show.
+ARCHIVED_POSTS = Q(blog__isnull=False, published=True, trashed=False, ptype="post")
+
+
+def archive_month(pub_date):
+    """Return the first day of the month `pub_date` falls in (in the current time zone), as a
+    date."""
+
+    if is_aware(pub_date):
+        pub_date = timezone.localtime(pub_date)
+    return pub_date.date().replace(day=1)
+
+
+class ArchiveMonthManager(models.Manager):
+    def adjust(self, blog_id, month, delta):
+        """Add `delta` (which may be negative) to the post count of `blog_id`'s archive `month`."""
+
+        rows = self.filter(blog_id=blog_id, month=month)
+        if not rows.update(num_posts=Greatest(F("num_posts") + delta, 0)) and delta > 0:
+            _, created = self.get_or_create(
+                blog_id=blog_id, month=month, defaults={"num_posts": delta}
+            )
+            if not created:
+                rows.update(num_posts=F("num_posts") + delta)
+
+    def rebuild(self):
+        """Recount every blog's archive months from its posts. Returns the number of months
+        stored."""
+
+        counts = (
+            Post.objects.filter(ARCHIVED_POSTS)
+            .annotate(month=TruncMonth("pub_date", output_field=models.DateField()))
+            .values("blog", "month")
+            .annotate(num_posts=Count("pk"))
+            .order_by()
+        )
+        with transaction.atomic():
+            self.all().delete()
+            months = self.bulk_create(
+                ArchiveMonth(blog_id=row["blog"], month=row["month"], num_posts=row["num_posts"])
+                for row in counts
+            )
+        bump_version("date_archives")
+        return len(months)
+
+
+class ArchiveMonth(models.Model):
+    """Number of published posts per blog per month, for the sidebar's date archive
+    (`get_date_archives`). Kept up to date by signal receivers in `signals.py` as posts are saved
+    and deleted; `manage.py tangerine_rebuild_archives` recounts from scratch."""
+
+    blog = models.ForeignKey(Blog, on_delete=models.CASCADE)
+    month = models.DateField(help_text="First day of the month.")
+    num_posts = models.PositiveIntegerField(default=0)
+
+    objects = ArchiveMonthManager()
+
+    class Meta:
+        unique_together = ("blog", "month")
+
+    def __str__(self):
+        return "{}: {:%B %Y}".format(self.blog, self.month)
+
+
+class SQLiteSearchEntry(models.Model):
+    """A post's row in the FTS5 index of `search.SQLiteSearchBackend`, created by migration 0043.
+    Declared (but not managed) only so that searches can join the index to Post; the backend writes
+    rows with plain SQL."""
+
+    post = models.OneToOneField(
+        Post,
+        primary_key=True,
+        db_column="rowid",
+        on_delete=models.DO_NOTHING,
+        related_name="sqlite_search_entry",
+    )
+    # FTS5's hidden column named after the table, which MATCH and bm25() are given.
+    index = models.TextField(db_column="tangerine_post_fts")
+
+    class Meta:
+        managed = False
+        db_table = "tangerine_post_fts"
+
+
+class PostgresSearchEntry(models.Model):
+    """A post's row in the index of `search.PostgresSearchBackend`, created by migration 0043.
+    Declared (but not managed) only so that searches can join the index to Post; the backend writes
+    rows with plain SQL."""
+
+    post = models.OneToOneField(
+        Post, primary_key=True, on_delete=models.DO_NOTHING, related_name="postgres_search_entry"
+    )
+    blog_id = models.IntegerField(null=True)
+    # A tsvector, only ever read by Postgres functions.
+    document = models.TextField()
+
+    class Meta:
+        managed = False
+        db_table = "tangerine_post_search"
+
+
 class CommentManager(models.Manager):
     """Filter out unapproved comments by calling Comment.pub.all() from anywhere."""
 
@@ -301,9 +629,41 @@ class Comment(TimeStampedModel):
         default=False
     )  # Check installed spam systems to verify but assume the best
 
+    # Which way the built-in spam classifier counts this comment (see `spam.py`): None if it hasn't
+    # learned from it.
+    spam_trained = models.BooleanField(null=True, editable=False)
+
     objects = models.Manager()  # The default manager, unfiltered by manager (admin use only)
     pub = CommentManager()  # Comment.pub.all() gets just approved comments
 
+    class Meta:
+        # Partial indexes over approved comments only, for the per-post thread (ordered by
+        # `modified`), replies to a comment, and site-wide recent comments (ordered by `-created`).
+        indexes = [
+            models.Index(
+                fields=["post", "modified"],
+                name="comment_pub_post_idx",
+                condition=Q(approved=True),
+            ),
+            models.Index(
+                fields=["parent", "modified"],
+                name="comment_pub_parent_idx",
+                condition=Q(approved=True),
+            ),
+            models.Index(
+                fields=["-created"],
+                name="comment_pub_created_idx",
+                condition=Q(approved=True),
+            ),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # Remember approval state as loaded, so signal receivers can tell when it changes.
+        instance = super().from_db(db, field_names, values)
+        instance._approved_in_db = instance.approved if "approved" in field_names else None
+        return instance
+
     def child_comments(self):
         # To support comment threading, return comments that are children of this one.
         return Comment.pub.filter(parent=self).order_by("modified")
@@ -312,18 +672,102 @@ class Comment(TimeStampedModel):
         return "{}...".format(self.body[:10])
 
 
+def normalize_email(email):
+    """Return `email` as ApprovedCommentor stores it: trimmed and lowercased, so that the same
+    address always matches however it's typed."""
+
+    return (email or "").strip().lower()
+
+
+class ApprovedCommentorQuerySet(models.QuerySet):
+    def is_approved(self, email):
+        """Return True if `email` belongs to an approved commentor. Answered from this process's
+        copy of the list (see `caching.get_approved_commentors()`) when the cache allows, so usually
+        without a query."""
+
+        email = normalize_email(email)
+        if not email:
+            return False
+        emails = get_approved_commentors()
+        if emails is None:
+            return self.filter(email=email).exists()
+        return email in emails
+
+    def approve_emails(self, emails):
+        """Add `emails` to the approved commentors, in one INSERT that skips those already there."""
+
+        emails = {normalize_email(email) for email in emails} - {""}
+        self.bulk_create(
+            [ApprovedCommentor(email=email) for email in emails], ignore_conflicts=True
+        )
+        invalidate_approved_commentors()
+
+    def revoke_emails(self, emails):
+        """Remove `emails` from the approved commentors, in one DELETE."""
+
+        self.filter(email__in={normalize_email(email) for email in emails}).delete()
+        invalidate_approved_commentors()
+
+
 class ApprovedCommentor(TimeStampedModel):
-    """Store emails of approved commentors. If option is enabled, future comments by these
-    email addrs will be auto-approved."""
+    """Store emails of approved commentors. If option is enabled, future comments by these email
+    addrs will be auto-approved. Emails are stored normalized (see `normalize_email()`); add and
+    remove them with `approve_emails()` and `revoke_emails()`."""
 
     email = models.EmailField(
         blank=False,
+        unique=True,
     )
 
+    objects = ApprovedCommentorQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        self.email = normalize_email(self.email)
+        super().save(*args, **kwargs)
+        invalidate_approved_commentors()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        invalidate_approved_commentors()
+        return result
+
     def __str__(self):
         return self.email
 
 
+class CommentJob(TimeStampedModel):
+    """One step of processing a newly posted comment (spam check, approval, moderator notification),
+    queued to run outside the request that posted it. See `jobs.py`."""
+
+    TASK_CHOICES = (
+        ("spam_check", "Spam check"),
+        ("approval", "Approval"),
+        ("notify", "Moderator notification"),
+    )
+
+    comment = models.ForeignKey(Comment, on_delete=models.CASCADE)
+    task = models.CharField(max_length=20, choices=TASK_CHOICES)
+    run_after = models.DateTimeField(
+        default=timezone.now, help_text="The job isn't run before this time."
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    failed = models.BooleanField(default=False, help_text="Given up on after too many attempts.")
+
+    class Meta:
+        ordering = ["run_after", "pk"]
+        indexes = [
+            models.Index(
+                fields=["run_after"],
+                name="commentjob_due_idx",
+                condition=Q(failed=False),
+            ),
+        ]
+
+    def __str__(self):
+        return "{} for comment {}".format(self.get_task_display(), self.comment_id)
+
+
 class RelatedLinkGroup(models.Model):
     """A set of related links (like a Blogroll), orderable in the Admin.
     Tangerine supports multiple RelatedLinkGroups, addressable by slug."""
@@ -1,14 +1,59 @@
 # from ipware.ip import get_ip
 # import akismet
+import re
+import threading
+
 import bleach
 
 from django.conf import settings
 from django.contrib import messages
 from django.core.mail import send_mail
-from django.db.models import Q
+from django.db import connections, transaction
+from django.db.models.functions import Lower, Trim
 from django.template.loader import render_to_string
-
-from blog.tangerine.models import ApprovedCommentor, Blog, Comment, Post
+from django.utils import timezone
+
+from blog.tangerine.caching import bump_content_version, bump_version, get_blog, page_scope
+from blog.tangerine.jobs import enqueue, jobs_inline
+from blog.tangerine.models import ApprovedCommentor, Comment, CommentJob, Post, normalize_email
+from blog.tangerine.search import get_search_backend
+from blog.tangerine.spam import get_classifier, learn
+
+# Actions `moderate_comments()` takes, with what they make of a comment.
+MODERATION_ACTIONS = {
+    "approve": "approved",
+    "unapprove": "unapproved",
+    "spam": "marked as spam",
+    "delete": "deleted",
+}
+
+# Comments deleted per DELETE statement by `moderate_comments()`, within every database's limit on
+# parameters.
+DELETE_BATCH_SIZE = 500
+
+# Characters that make bleach change a text even if it has no tags: `<` may start one, `&` and `>`
+# are escaped, and most control characters are dropped. Texts without any are returned as they are,
+# unparsed.
+NEEDS_CLEANING_RE = re.compile(r"[\x00-\x08\x0b-\x1f&<>]")
+
+# Per-thread bleach Cleaners (they aren't thread-safe), by allowed tags.
+_cleaners = threading.local()
+
+
+def get_cleaner(tags=None):
+    """Return a bleach Cleaner allowing `tags`, or by default the tags allowed in comments (see
+    `sanitize_comment`). Building one sets up a whole html5lib parser, so each thread keeps the
+    Cleaners it builds; a change to BLEACH_ALLOWED_TAGS gets a new one."""
+
+    if tags is None:
+        tags = getattr(settings, "BLEACH_ALLOWED_TAGS", bleach.sanitizer.ALLOWED_TAGS)
+    tags = frozenset(tags)
+    cleaners = getattr(_cleaners, "by_tags", None)
+    if cleaners is None or len(cleaners) > 8:
+        cleaners = _cleaners.by_tags = {}
+    if tags not in cleaners:
+        cleaners[tags] = bleach.sanitizer.Cleaner(tags=tags, strip=True)
+    return cleaners[tags]
 
 
 def sanitize_comment(comment):
@@ -20,23 +65,41 @@ def sanitize_comment(comment):
     BLEACH_ALLOWED_TAGS = ['hr', 'b', 'i']
     """
 
-    if hasattr(settings, "BLEACH_ALLOWED_TAGS"):
-        allowed_tags = settings.BLEACH_ALLOWED_TAGS
-    else:
-        allowed_tags = bleach.sanitizer.ALLOWED_TAGS
+    if not NEEDS_CLEANING_RE.search(comment):
+        return comment
+    return get_cleaner().clean(comment)
+
+
+def sanitize_batch(texts, tags=None):
+    """Sanitize many comment (or other) bodies at once, e.g. for imports or to re-sanitize stored
+    comments after BLEACH_ALLOWED_TAGS changes. Takes an iterable of HTML strings and the tags to
+    allow (default: those allowed in comments), returns a list of the sanitized strings in the same
+    order."""
+
+    clean = get_cleaner(tags).clean
+    needs_cleaning = NEEDS_CLEANING_RE.search
+    return [clean(text) if needs_cleaning(text) else text for text in texts]
 
-    return bleach.clean(comment, tags=allowed_tags, strip=True)
 
+def get_comment_config(comment):
+    """Return the (cached) Blog config governing a comment: that of the Blog its Post belongs to.
+    Pages don't belong to a Blog, so fall back to the default Blog for comments on those."""
 
-def get_comment_approval(email, authenticated):
+    blog_id = comment.post.blog_id if comment.post_id else None
+    return get_blog(pk=blog_id) if blog_id else get_blog()
+
+
+def get_comment_approval(email, authenticated, config=None):
     """Comment approval workflow.
     `auto_approve` doesn't mean blanket approval, but "IF email is in ApprovedCommentor table".
-    Authenticated commenters are always allowed to comment without moderation."""
+    Authenticated commenters are always allowed to comment without moderation.
+    Pass the Blog the comment belongs to as `config`; defaults to the default Blog."""
 
-    config = Blog.objects.first()
+    if config is None:
+        config = get_blog()
     auto_approve = config.auto_approve_previous_commentors
 
-    if authenticated or (auto_approve and ApprovedCommentor.objects.filter(email=email).exists()):
+    if authenticated or (auto_approve and ApprovedCommentor.objects.is_approved(email)):
         return True
     else:
         return False
@@ -52,36 +115,36 @@ def toggle_approval(comment):
     If auto_approve is enabled in Blog config and comment is approved, also add user to ApprovedCommentors,
     (or remove if unapproving)."""
 
-    config = Blog.objects.first()
+    config = get_comment_config(comment)
     auto_approve = config.auto_approve_previous_commentors
 
     if auto_approve:
         if comment.approved:
             # Toggling state for an approved comment, so we now remove commenter from ApprovedCommentors
-            ApprovedCommentor.objects.filter(email=comment.email).delete()
+            ApprovedCommentor.objects.revoke_emails([comment.email])
         else:
             # Toggling state for an unapproved comment, so we now add commenter to ApprovedCommentors
-            ApprovedCommentor.objects.create(email=comment.email)
+            ApprovedCommentor.objects.approve_emails([comment.email])
 
     # Then flip comment approval state to the opposite of whatever it is now.
     comment.approved = not comment.approved
     comment.save()
 
 
-def send_comment_moderation_email(comment):
+def send_comment_moderation_email(comment, fail_silently=True):
     """Alert post author that comment needs moderation, or has been automatically published.
     Comments need moderation if they are marked as spam or not set to auto-approve.
 
     Takes a comment object, returns nothing"""
 
-    config = Blog.objects.first()
+    config = get_comment_config(comment)
 
     if comment.spam or not comment.approved:
         # send moderation email
-        subject = "A new comment on {} requires moderation".format(config.site_title)
+        subject = "A new comment on {} requires moderation".format(config.title)
     else:
         # send announcement email
-        subject = "A new comment on {} has been automatically published".format(config.site_title)
+        subject = "A new comment on {} has been automatically published".format(config.title)
 
     send_mail(
         subject,
@@ -92,12 +155,13 @@ def send_comment_moderation_email(comment):
         [
             config.moderation_email,
         ],
-        fail_silently=True,
+        fail_silently=fail_silently,
     )
 
 
 def process_comment(request, comment, post):
-    """Set attributes, spam check, get IP address, sanitize, etc. No return value."""
+    """Set attributes, get IP address, sanitize, save, and queue the spam check etc. No return
+    value."""
 
     if request.user.is_authenticated:
         # We already set auth user's name and email in the form's inital vals.
@@ -121,39 +185,74 @@ def process_comment(request, comment, post):
     #     comment.ip_address = ip
     comment.user_agent = request.META.get("HTTP_USER_AGENT", "")
 
-    # Run spam check
-    comment.spam = spam_check(comment)
-
     # Strip disallowed HTML tags. See tangerine docs to customize.
     comment.body = sanitize_comment(comment.body)
 
-    # Call comment approval workflow
-    comment.approved = get_comment_approval(comment.email, request.user.is_authenticated)
+    # Save the comment unapproved; the spam check, approval and moderator email are queued (see
+    # `jobs.py`), so that a slow Akismet or mail server doesn't hold up the request.
+    comment.approved = False
+    comment.save()
+    enqueue(comment, "spam_check")
+
+    if not jobs_inline():
+        messages.add_message(
+            request,
+            messages.INFO,
+            "Your comment has been received, and will appear once it has been checked.",
+        )
+        return
+
+    # The queued steps have already run.
+    comment.refresh_from_db(fields=["spam", "approved"])
     if comment.approved:
         messages.add_message(request, messages.SUCCESS, "Your comment has been posted.")
     else:
         messages.add_message(request, messages.INFO, "Your comment has been held for moderation.")
 
+
+def check_comment_spam(comment):
+    """First queued step for a new comment: run the spam check, then queue approval."""
+
+    comment.spam = spam_check(comment)
+    comment.save()
+    enqueue(comment, "approval")
+
+
+def approve_comment(comment):
+    """Second queued step: apply the comment approval workflow, then queue the moderator email."""
+
+    comment.approved = get_comment_approval(
+        comment.email, comment.author_id is not None, get_comment_config(comment)
+    )
     comment.save()
+    enqueue(comment, "notify")
 
-    # Alert post author that comment needs moderation, or that it's been auto-published:
-    send_comment_moderation_email(comment)
+
+def notify_moderator(comment):
+    """Last queued step: alert post author that comment needs moderation, or that it's been
+    auto-published. Mail errors are raised, so that the job is retried."""
+
+    send_comment_moderation_email(comment, fail_silently=False)
+
+
+def _akismet_kwargs(comment):
+    return {
+        "comment_author": comment.name,
+        "comment_author_email": comment.email,
+        "comment_author_url": comment.website,
+        "comment_content": comment.body,
+    }
 
 
 def akismet_spam_ham(comment):
     """Submit comment to Akismet spam/ham API, using current spam status"""
 
-    config = Blog.objects.first()
+    config = get_comment_config(comment)
     if config.akismet_key:
 
         # akismet_api = akismet.Akismet(key=config.akismet_key, blog_url=config.site_url)
 
-        kwargs = {
-            "comment_author": comment.name,
-            "comment_author_email": comment.email,
-            "comment_author_url": comment.website,
-            "comment_content": comment.body,
-        }
+        kwargs = _akismet_kwargs(comment)  # noqa: F841
 
         # if comment.spam is True:
         #     submit = akismet_api.submit_spam(comment.ip_address, comment.user_agent, **kwargs)
@@ -182,37 +281,139 @@ def toggle_spam(comment):
     comment.save()
     toggle_approval(comment)
 
+    # Teach the built-in classifier, if it's been trained.
+    learn([comment], comment.spam)
+
+
+def _auto_approve_emails(comments):
+    """Return the emails of commenters among `comments` whose blogs auto-approve previous
+    commentors."""
+
+    emails = set()
+    for email, blog_id in comments.values_list("email", "post__blog_id").distinct():
+        config = get_blog(pk=blog_id) if blog_id else get_blog()
+        if config.auto_approve_previous_commentors and email:
+            emails.add(email)
+    return emails
+
+
+def _comments_changed(post_ids):
+    """Do what signal receivers do when comments are saved or deleted one by one, for comments
+    changed in bulk on the posts with `post_ids`: recount their comments and drop the cached pages
+    that show them."""
+
+    posts = Post.objects.filter(pk__in=post_ids)
+    posts.recount_comments()
+    blog_ids = set()
+    for blog_id, permalink in posts.values_list("blog_id", "permalink"):
+        blog_ids.add(blog_id)
+        if permalink:
+            bump_version(page_scope(permalink))
+    bump_content_version(*blog_ids)
+
+
+def _delete_comments(comment_ids, using):
+    """Delete the comments with these ids with plain DELETEs, skipping the collector and the
+    per-comment signals (which `_comments_changed` stands in for). Returns the number of comments
+    deleted."""
+
+    connection = connections[using]
+    quote_name = connection.ops.quote_name
+    sql = "DELETE FROM {} WHERE {} IN ({{}})".format(
+        quote_name(Comment._meta.db_table), quote_name(Comment._meta.pk.column)
+    )
+    comment_ids = sorted(comment_ids)
+    num_deleted = 0
+    with connection.cursor() as cursor:
+        for i in range(0, len(comment_ids), DELETE_BATCH_SIZE):
+            batch = comment_ids[i : i + DELETE_BATCH_SIZE]
+            cursor.execute(sql.format(", ".join(["%s"] * len(batch))), batch)
+            num_deleted += cursor.rowcount
+    return num_deleted
+
+
+def moderate_comments(comments, action):
+    """Apply a moderation `action` to every comment in the queryset `comments`:
+
+    - "approve": approve them (and clear their spam flag),
+    - "unapprove": unapprove them,
+    - "spam": mark them as spam and unapprove them,
+    - "delete": delete them, along with any replies to them.
+
+    Each action changes the comments with a single UPDATE (or a DELETE per `DELETE_BATCH_SIZE`
+    comments), instead of saving or deleting them one at a time. Where auto-approval is on,
+    approving adds their commenters' emails to ApprovedCommentor in one bulk insert, and unapproving
+    removes those of commenters left with no approved comments in one DELETE. The built-in spam
+    classifier learns from "approve" and "spam"; Akismet isn't told, as in `akismet_spam_ham()`.
+    Returns the number of comments changed."""
+
+    if action not in MODERATION_ACTIONS:
+        raise ValueError("Unknown moderation action: {}".format(action))
+
+    # The classifier is told first, outside the transaction, while the comments still have their old
+    # spam flags.
+    if action == "approve":
+        learn(comments.iterator(), spam=False)
+    elif action == "spam":
+        learn(comments.iterator(), spam=True)
+
+    now = timezone.now()
+    with transaction.atomic():
+        post_ids = set(comments.values_list("post_id", flat=True))
+        if action == "delete":
+            # Replies go too, as they would by cascade.
+            comment_ids = set(comments.values_list("pk", flat=True))
+            replies = comment_ids
+            while replies:
+                replies = (
+                    set(Comment.objects.filter(parent__in=replies).values_list("pk", flat=True))
+                    - comment_ids
+                )
+                comment_ids |= replies
+            comments = Comment.objects.filter(pk__in=comment_ids)
+            post_ids.update(comments.values_list("post_id", flat=True))
+            CommentJob.objects.filter(comment__in=comment_ids).delete()
+            num_changed = _delete_comments(comment_ids, comments.db)
+        else:
+            emails = _auto_approve_emails(comments)
+            if action == "approve":
+                num_changed = comments.update(approved=True, spam=False, modified=now)
+                ApprovedCommentor.objects.approve_emails(emails)
+            else:
+                if action == "spam":
+                    num_changed = comments.update(approved=False, spam=True, modified=now)
+                else:
+                    num_changed = comments.update(approved=False, modified=now)
+                # Commenters who still have other approved comments stay approved.
+                emails = {normalize_email(email) for email in emails}
+                still_approved = (
+                    Comment.objects.filter(approved=True)
+                    .annotate(normalized_email=Lower(Trim("email")))
+                    .filter(normalized_email__in=emails)
+                    .values_list("normalized_email", flat=True)
+                )
+                ApprovedCommentor.objects.revoke_emails(emails - set(still_approved))
+        _comments_changed(post_ids)
+    return num_changed
+
 
 def spam_check(comment):
     # Pass comment object into configured spam control engines and return True or False
-    config = Blog.objects.first()
-    spam_status = False
+    config = get_comment_config(comment)
 
-    if config.akismet_key:
-        akismet_api = akismet.Akismet(key=config.akismet_key, blog_url=config.site_url)
-        spam_status = akismet_api.comment_check(
-            comment.ip_address,
-            comment.user_agent,
-            comment_author=comment.name,
-            comment_author_email=comment.email,
-            comment_author_url=comment.website,
-            comment_content=comment.body,
-        )
-
-        return spam_status
+    if config.spam_filter == "bayes":
+        classifier = get_classifier()
+        return classifier is not None and classifier.is_spam(comment)
 
-    return spam_status
+    # As in `akismet_spam_ham`, the Akismet client isn't wired up, so Akismet blogs flag nothing.
+    return False
 
 
-def get_search_qs(q):
-    """Takes q as a search string, returns ORM results for Posts matching search terms.
-    Searches all installed blogs - if you want to filter per blog, do it with .filter() in the call, not here."""
+def get_search_qs(q, blog=None):
+    """Takes q as a search string, returns ORM results for Posts matching search terms, most
+    relevant first (see `search.py` for the backends). Searches all installed blogs unless `blog` is
+    given."""
 
-    if q:
-        qs = Post.objects.filter(
-            Q(title__icontains=q) | Q(summary__icontains=q) | Q(content__icontains=q)
-        )
-    else:
-        q = None
-        qs = Post.objects.none()
-    return qs
+    if not q or not q.strip():
+        return Post.objects.none()
+    return get_search_backend().search(q, blog=blog)
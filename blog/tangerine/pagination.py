@@ -0,0 +1,133 @@
+"""Pagination for Post list views.
+
+Blogs choose a pagination style in their config (`Blog.pagination`):
+
+- "page" uses Django's Paginator: numbered `?page=n` links, at the cost of a COUNT(*) and an OFFSET
+  query that gets slower the deeper the page.
+- "keyset" pages by the (pub_date, id) of the last post shown, via `?after=<cursor>` /
+  `?before=<cursor>` links. Every page costs one index range scan, however deep it is, and nothing
+  is counted.
+
+Both return an object that post_loop.html can render: iterable, with `has_previous()` /
+`has_next()`.
+"""
+
+import base64
+from datetime import datetime
+
+from django.core.paginator import Paginator
+from django.db.models import Q
+
+
+def encode_cursor(post):
+    raw = "{}|{}".format(post.pub_date.isoformat(), post.pk)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Return the (pub_date, id) encoded in `cursor`, or None if it isn't a valid cursor."""
+
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        pub_date, pk = raw.split("|")
+        return datetime.fromisoformat(pub_date), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+class KeysetPage:
+    """One page of posts, newest first, plus links to the neighbouring pages."""
+
+    def __init__(self, object_list, has_previous, has_next, query):
+        self.object_list = object_list
+        self._has_previous = has_previous
+        self._has_next = has_next
+        self.query = query
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_next(self):
+        return self._has_next
+
+    def _link(self, direction, post):
+        query = self.query.copy()
+        for key in ("page", "after", "before"):
+            query.pop(key, None)
+        query[direction] = encode_cursor(post)
+        return "?{}".format(query.urlencode())
+
+    @property
+    def previous_page_link(self):
+        # Newer posts: those before the first post on this page.
+        return self._link("before", self.object_list[0]) if self._has_previous else ""
+
+    @property
+    def next_page_link(self):
+        # Older posts: those after the last post on this page.
+        return self._link("after", self.object_list[-1]) if self._has_next else ""
+
+
+def posts_after(posts, cursor):
+    """Return `posts` older than the (pub_date, id) `cursor`, newest first."""
+
+    pub_date, pk = cursor
+    # The pub_date bound is implied by the rest, but lets the database seek into the index for it.
+    return posts.filter(
+        Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, pk__lt=pk), pub_date__lte=pub_date
+    ).order_by("-pub_date", "-pk")
+
+
+def posts_before(posts, cursor):
+    """Return `posts` newer than the (pub_date, id) `cursor`, oldest first."""
+
+    pub_date, pk = cursor
+    return posts.filter(
+        Q(pub_date__gt=pub_date) | Q(pub_date=pub_date, pk__gt=pk), pub_date__gte=pub_date
+    ).order_by("pub_date", "pk")
+
+
+def keyset_paginate(posts, per_page, query):
+    """Page through `posts` (newest first) using the `after`/`before` cursor in `query` (a
+    QueryDict)."""
+
+    after = decode_cursor(query.get("after", ""))
+    before = decode_cursor(query.get("before", ""))
+
+    if before:
+        object_list = list(posts_before(posts, before)[: per_page + 1])
+        has_previous = len(object_list) > per_page
+        object_list = object_list[:per_page][::-1]
+        has_next = True
+    else:
+        if after:
+            posts = posts_after(posts, after)
+        object_list = list(posts.order_by("-pub_date", "-pk")[: per_page + 1])
+        has_next = len(object_list) > per_page
+        object_list = object_list[:per_page]
+        has_previous = after is not None
+
+    if not object_list:
+        has_previous = has_next = False
+    return KeysetPage(object_list, has_previous, has_next, query)
+
+
+def paginate_posts(request, posts, blog, per_page=None):
+    """Return the requested page of `posts`, paginated in the style configured for `blog`.
+    `per_page` defaults to the blog's `num_posts_per_list_view`."""
+
+    per_page = per_page or blog.num_posts_per_list_view
+    if blog.pagination == "keyset":
+        return keyset_paginate(posts, per_page, request.GET)
+
+    paginator = Paginator(posts, per_page)
+    return paginator.get_page(request.GET.get("page"))
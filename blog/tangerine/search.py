@@ -0,0 +1,284 @@
+"""Full-text search over Posts.
+
+Search goes through a backend, picked by `get_search_backend()` to suit the database in use:
+
+- `SQLiteSearchBackend` (development, tests): an FTS5 virtual table, stemmed by the porter tokenizer
+  and ranked by bm25.
+- `PostgresSearchBackend` (production): a table of weighted `tsvector`s with a GIN index, ranked by
+  `ts_rank`.
+- `SearchBackend` (anything else): plain `icontains` matching, newest first. No index to maintain.
+
+Set `TANGERINE_SEARCH_BACKEND` in settings to the dotted path of a backend class to override the
+choice.
+
+Indexes hold every post, keyed by post id and tagged with its blog so searches can be limited to one
+blog inside the index itself. The index tables are created (and filled) by migration 0043, for
+whichever database it runs on. Signal receivers (see `signals.py`) keep them up to date as posts are
+saved and deleted; `manage.py tangerine_rebuild_search_index` rebuilds the index from scratch, e.g.
+after bulk changes that bypass signals.
+
+The search view doesn't page through backend querysets directly: `get_ranked_post_ids()` caches each
+search's ranked result ids, per blog, until that blog's content changes.
+"""
+
+import hashlib
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import BooleanField, F, FloatField, Func, Q, Value
+from django.utils.html import strip_tags
+from django.utils.module_loading import import_string
+
+from blog.tangerine.caching import content_scope, get_versioned
+from blog.tangerine.models import Post, PostgresSearchEntry, SQLiteSearchEntry
+
+# Number of posts read and indexed at a time during a rebuild.
+REBUILD_BATCH_SIZE = 1000
+
+# Most results kept for one cached search; see `get_ranked_post_ids()`.
+MAX_CACHED_RESULTS = 1000
+
+# Words too common to narrow a search down, left out of indexed searches (unless a query has nothing
+# else).
+STOP_WORDS = frozenset(
+    "a an and are as at be but by for from has have he her his i if in into is it its me my no not "
+    "of on or our she so than that the their them then there these they this to was we were what "
+    "when which who will with you your".split()
+)
+
+
+def search_terms(q):
+    """Split a user's search string into words, dropping punctuation and any query syntax."""
+
+    return re.findall(r"\w+", q)
+
+
+class SearchBackend:
+    """Matches posts containing the search string (case-insensitively) in title, summary or content.
+    Subclasses replace this with an index; their `search()` must return Posts annotated with `rank`,
+    most relevant first."""
+
+    def normalize_query(self, q):
+        """Return `q` reduced to a canonical form, which is what gets searched for and is the key
+        its results are cached under (see `get_ranked_post_ids()`). Anything the backend's query
+        syntax gives meaning to must survive. Matching here is case-insensitive and on the whole
+        string, so only case and spacing can go."""
+
+        return " ".join(q.casefold().split())
+
+    def search(self, q, blog=None):
+        qs = Post.objects.filter(
+            Q(title__icontains=q) | Q(summary__icontains=q) | Q(content__icontains=q)
+        )
+        if blog is not None:
+            qs = qs.filter(blog=blog)
+        return qs.order_by("-pub_date")
+
+    def index_posts(self, posts):
+        """Add `posts` to the index, or refresh them if already there."""
+
+    def remove_posts(self, post_ids):
+        """Drop the posts with these ids from the index."""
+
+    def clear(self):
+        """Empty the index."""
+
+    def rebuild(self, posts=None):
+        """Re-index every post (every post in queryset `posts`, if given, e.g. of a historical model
+        during a migration). Returns the number of posts indexed."""
+
+        if posts is None:
+            posts = Post.objects.all()
+        self.clear()
+        num_posts = 0
+        batch = []
+        for post in posts.only("blog", "title", "summary", "content").iterator(
+            chunk_size=REBUILD_BATCH_SIZE
+        ):
+            batch.append(post)
+            if len(batch) == REBUILD_BATCH_SIZE:
+                self.index_posts(batch)
+                num_posts += len(batch)
+                batch = []
+        self.index_posts(batch)
+        return num_posts + len(batch)
+
+
+class IndexedSearchBackend(SearchBackend):
+    """Base for backends that match posts containing every word of the query, in any order."""
+
+    def normalize_query(self, q):
+        # Query syntax is ignored, so the words are all that's left to keep.
+        terms = sorted(set(search_terms(q.casefold())))
+        return " ".join([t for t in terms if t not in STOP_WORDS] or terms)
+
+
+class Matches(Func):
+    """`document <operator> query`, e.g. an FTS5 MATCH or a tsvector @@, for use in `filter()`.
+    Filter on `<index entry>__isnull=False` alongside, so that the index is joined with an inner
+    join and the database can start from the matches."""
+
+    template = "%(expressions)s"
+    output_field = BooleanField()
+
+    def __init__(self, document, query, operator):
+        super().__init__(document, query, arg_joiner=" {} ".format(operator))
+
+
+class SQLiteSearchBackend(IndexedSearchBackend):
+    table = SQLiteSearchEntry._meta.db_table
+
+    # bm25 weights for the blog, title, summary and content columns. Matches in titles count most.
+    weights = (0.0, 10.0, 5.0, 1.0)
+
+    def search(self, q, blog=None):
+        terms = search_terms(q)
+        if not terms:
+            return Post.objects.none()
+
+        # Quote every word so nothing in it is read as FTS5 syntax. Only text columns are searched,
+        # and the blog column narrows matches to one blog's posts.
+        match = "{title summary content} : (%s)" % " ".join('"{}"'.format(t) for t in terms)
+        if blog is not None:
+            match = 'blog : "b{}" AND {}'.format(blog.pk, match)
+
+        index = F("sqlite_search_entry__index")
+        rank = Func(index, *map(Value, self.weights), function="bm25", output_field=FloatField())
+        return (
+            Post.objects.filter(
+                Matches(index, Value(match), "MATCH"), sqlite_search_entry__isnull=False
+            )
+            .annotate(rank=rank)
+            .order_by("rank", "-pub_date")
+        )
+
+    def index_posts(self, posts):
+        if not posts:
+            return
+        self.remove_posts([post.pk for post in posts])
+        rows = [
+            (
+                post.pk,
+                "b{}".format(post.blog_id) if post.blog_id else "",
+                post.title,
+                strip_tags(post.summary),
+                strip_tags(post.content),
+            )
+            for post in posts
+        ]
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO {} (rowid, blog, title, summary, content) "
+                "VALUES (%s, %s, %s, %s, %s)".format(self.table),
+                rows,
+            )
+
+    def remove_posts(self, post_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                "DELETE FROM {} WHERE rowid = %s".format(self.table), [(pk,) for pk in post_ids]
+            )
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM {}".format(self.table))
+
+
+class PostgresSearchBackend(IndexedSearchBackend):
+    table = PostgresSearchEntry._meta.db_table
+
+    # Text search configuration used to stem and drop stop words, in documents and queries alike.
+    config = "english"
+
+    def normalize_query(self, q):
+        # websearch_to_tsquery() reads "quoted phrases", -exclusions and "or" (in any case), so
+        # unlike other indexed backends, word order and punctuation matter. Postgres drops stop
+        # words itself.
+        return " ".join(q.lower().split())
+
+    def search(self, q, blog=None):
+        if not search_terms(q):
+            return Post.objects.none()
+
+        document = F("postgres_search_entry__document")
+        query = Func(Value(self.config), Value(q), function="websearch_to_tsquery")
+        qs = Post.objects.filter(
+            Matches(document, query, "@@"), postgres_search_entry__isnull=False
+        )
+        if blog is not None:
+            # Filtered in the index rather than on Post, so one GIN scan finds the blog's matches.
+            qs = qs.filter(postgres_search_entry__blog_id=blog.pk)
+        rank = Func(document, query, function="ts_rank", output_field=FloatField())
+        return qs.annotate(rank=rank).order_by("-rank", "-pub_date")
+
+    def index_posts(self, posts):
+        if not posts:
+            return
+        rows = [
+            (
+                post.pk,
+                post.blog_id,
+                self.config,
+                post.title,
+                self.config,
+                strip_tags(post.summary),
+                self.config,
+                strip_tags(post.content),
+            )
+            for post in posts
+        ]
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO {} (post_id, blog_id, document) VALUES (%s, %s, "
+                "setweight(to_tsvector(%s, %s), 'A') || "
+                "setweight(to_tsvector(%s, %s), 'B') || "
+                "setweight(to_tsvector(%s, %s), 'C')) "
+                "ON CONFLICT (post_id) DO UPDATE "
+                "SET blog_id = EXCLUDED.blog_id, document = EXCLUDED.document".format(self.table),
+                rows,
+            )
+
+    def remove_posts(self, post_ids):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM {} WHERE post_id = ANY(%s)".format(self.table), [list(post_ids)]
+            )
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute("TRUNCATE {}".format(self.table))
+
+
+BACKENDS = {
+    "sqlite": SQLiteSearchBackend,
+    "postgresql": PostgresSearchBackend,
+}
+
+
+def get_search_backend():
+    """Return the search backend named by `TANGERINE_SEARCH_BACKEND`, or else the one for the
+    database in use."""
+
+    path = getattr(settings, "TANGERINE_SEARCH_BACKEND", "")
+    backend_class = import_string(path) if path else BACKENDS.get(connection.vendor, SearchBackend)
+    return backend_class()
+
+
+def get_ranked_post_ids(q, blog):
+    """Return the ids of `blog`'s posts matching search string `q`, most relevant first, at most
+    MAX_CACHED_RESULTS of them. The backend searches for the normalized query (see
+    `SearchBackend.normalize_query()`), and results are cached under it until the blog's content
+    changes, so one search serves every page of results, and variants of the query that differ only
+    in case, spacing or (for SQLite) word order and stop words share the entry."""
+
+    backend = get_search_backend()
+    q = backend.normalize_query(q)
+    if not q:
+        return []
+
+    def load():
+        return list(backend.search(q, blog=blog).values_list("pk", flat=True)[:MAX_CACHED_RESULTS])
+
+    key = "search:{}:{}".format(type(backend).__name__, hashlib.md5(q.encode()).hexdigest())
+    return get_versioned(content_scope(blog.pk), key, load)
@@ -0,0 +1,284 @@
+"""Signal receivers that keep Tangerine's caches (see `caching.py`) and denormalized fields
+in step with the database."""
+
+from django.core.signals import request_finished, request_started
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.urls import reverse
+
+from blog.tangerine.caching import (
+    bump_content_version,
+    bump_version,
+    clear_request_memo,
+    invalidate_blog_cache,
+    page_scope,
+)
+from blog.tangerine.models import (
+    ArchiveMonth,
+    Blog,
+    Category,
+    Comment,
+    Post,
+    RelatedLink,
+    RelatedLinkGroup,
+    archive_month,
+)
+from blog.tangerine.search import get_search_backend
+
+# Post fields that decide whether, and under which month, a post is counted in ArchiveMonth.
+ARCHIVE_FIELDS = ("blog_id", "pub_date", "published", "trashed", "ptype")
+
+
+def update_comment_counts_on_save(sender, instance, created, raw=False, **kwargs):
+    """Keep Post.approved_comment_count and last_comment_at in step when a comment is added,
+    approved or unapproved (whether through `ops.toggle_approval`, `ops.toggle_spam`, the Admin or
+    anything else that saves it)."""
+
+    if raw:
+        return
+
+    was_approved = False if created else getattr(instance, "_approved_in_db", None)
+    posts = Post.objects.filter(pk=instance.post_id)
+    if was_approved is None:
+        # Comment wasn't loaded normally, so we can't tell what changed; count this post's comments
+        # afresh.
+        posts.recount_comments()
+    elif instance.approved != was_approved:
+        posts.update_comment_counts(1 if instance.approved else -1)
+    instance._approved_in_db = instance.approved
+
+
+def update_comment_counts_on_delete(sender, instance, **kwargs):
+    was_approved = getattr(instance, "_approved_in_db", None)
+    if was_approved is None:
+        was_approved = instance.approved
+    if was_approved:
+        Post.objects.filter(pk=instance.post_id).update_comment_counts(-1)
+
+
+def update_permalinks_on_blog_save(sender, instance, created, raw=False, **kwargs):
+    """Rebuild the stored permalinks of a blog's posts after its slug changes."""
+
+    if raw or created:
+        return
+    prefix = reverse("tangerine:home", args=[instance.slug])
+    stale = Post.objects.filter(blog=instance).exclude(permalink__startswith=prefix)
+    stale.rebuild_permalinks(instance)
+
+
+def _archive_bucket(values):
+    """Return the (blog_id, month) a post with these field values is counted under, or None if it
+    isn't."""
+
+    if (
+        values["blog_id"]
+        and values["published"]
+        and not values["trashed"]
+        and values["ptype"] == "post"
+    ):
+        return values["blog_id"], archive_month(values["pub_date"])
+    return None
+
+
+def read_archive_fields(sender, instance, raw=False, **kwargs):
+    """Before a post that wasn't loaded with all of ARCHIVE_FIELDS (e.g. through `.only()`, or built
+    by hand) is saved, read the missing ones from its row, so `update_archive_on_save` can tell what
+    changed. Nothing is read for posts that aren't in the database yet."""
+
+    if raw or instance.pk is None:
+        return
+    loaded = getattr(instance, "_loaded_values", {})
+    missing = [field for field in ARCHIVE_FIELDS if field not in loaded]
+    if missing:
+        row = Post.objects.filter(pk=instance.pk).values(*missing).first()
+        if row is not None:
+            instance._loaded_values = {**loaded, **row}
+
+
+def update_archive_on_save(sender, instance, created, raw=False, **kwargs):
+    """Move a post between ArchiveMonth counts when it's published, trashed, re-dated or moved to
+    another blog."""
+
+    if raw:
+        return
+
+    loaded = getattr(instance, "_loaded_values", {})
+    old = None if created else _archive_bucket(loaded)
+    new = _archive_bucket({field: getattr(instance, field) for field in ARCHIVE_FIELDS})
+    if old != new:
+        if old:
+            ArchiveMonth.objects.adjust(*old, -1)
+        if new:
+            ArchiveMonth.objects.adjust(*new, 1)
+        bump_version("date_archives")
+
+
+def update_archive_on_delete(sender, instance, **kwargs):
+    loaded = getattr(instance, "_loaded_values", {})
+    values = {field: loaded.get(field, getattr(instance, field)) for field in ARCHIVE_FIELDS}
+    bucket = _archive_bucket(values)
+    if bucket:
+        ArchiveMonth.objects.adjust(*bucket, -1)
+        bump_version("date_archives")
+
+
+def update_search_index_on_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        get_search_backend().index_posts([instance])
+
+
+def update_search_index_on_delete(sender, instance, **kwargs):
+    get_search_backend().remove_posts([instance.pk])
+
+
+def invalidate_blog_content(sender, instance, **kwargs):
+    """Bump the content version of the blog a post belongs to (and any blog it was just moved
+    from)."""
+
+    loaded = getattr(instance, "_loaded_values", {})
+    bump_content_version(instance.blog_id, loaded.get("blog_id"))
+
+
+def invalidate_post_page(sender, instance, **kwargs):
+    """Drop the cached page of a changed post (at its old address too, if that just changed), or of
+    the post a changed comment belongs to."""
+
+    if isinstance(instance, Comment):
+        paths = Post.objects.filter(pk=instance.post_id).values_list("permalink", flat=True)
+    else:
+        paths = {instance.permalink, getattr(instance, "_loaded_values", {}).get("permalink")}
+    for path in paths:
+        if path:
+            bump_version(page_scope(path))
+
+
+def invalidate_related_blog_content(sender, instance, **kwargs):
+    """Bump the content version of the blog whose pages show a changed Comment, Category or blogroll
+    entry."""
+
+    if isinstance(instance, Comment):
+        blog_ids = Post.objects.filter(pk=instance.post_id).values_list("blog_id", flat=True)
+    elif isinstance(instance, RelatedLink):
+        blog_ids = RelatedLinkGroup.objects.filter(pk=instance.group_id).values_list(
+            "blog_id", flat=True
+        )
+    else:
+        blog_ids = [instance.blog_id]
+    bump_content_version(*blog_ids)
+
+
+def invalidate_all_blog_content(sender, instance, **kwargs):
+    # Every blog's pages list all blogs, so a change to any Blog touches them all.
+    bump_content_version(instance.pk, *Blog.objects.values_list("pk", flat=True))
+
+
+def invalidate_categories(sender, **kwargs):
+    """Drop cached category lists (`get_categories`) when posts or categories change."""
+
+    bump_version("categories")
+
+
+def invalidate_post_categories(sender, instance, action, reverse, pk_set, **kwargs):
+    """Drop cached category lists, and the list and post pages showing the posts involved, when
+    posts are added to or removed from categories (from either side of the relation)."""
+
+    if reverse and action == "pre_clear":
+        # By "post_clear" the category has no posts left to look up, so note them now.
+        instance._cleared_post_ids = list(instance.post_set.values_list("pk", flat=True))
+        return
+    # m2m_changed fires before and after each change; the "post_" actions are the ones that leave
+    # new data behind.
+    if not action.startswith("post_"):
+        return
+
+    bump_version("categories")
+    if reverse:
+        post_ids = instance.__dict__.pop("_cleared_post_ids", []) if pk_set is None else pk_set
+        posts = list(Post.objects.filter(pk__in=post_ids).values_list("blog_id", "permalink"))
+    else:
+        posts = [(instance.blog_id, instance.permalink)]
+    bump_content_version(instance.blog_id, *(blog_id for blog_id, permalink in posts))
+    for blog_id, permalink in posts:
+        if permalink:
+            bump_version(page_scope(permalink))
+
+
+request_started.connect(clear_request_memo, dispatch_uid="tangerine_clear_memo_start")
+request_finished.connect(clear_request_memo, dispatch_uid="tangerine_clear_memo_finish")
+
+post_save.connect(invalidate_blog_cache, sender=Blog, dispatch_uid="tangerine_blog_saved")
+post_delete.connect(invalidate_blog_cache, sender=Blog, dispatch_uid="tangerine_blog_deleted")
+post_save.connect(
+    update_permalinks_on_blog_save, sender=Blog, dispatch_uid="tangerine_blog_permalinks"
+)
+
+post_save.connect(
+    update_comment_counts_on_save, sender=Comment, dispatch_uid="tangerine_comment_saved"
+)
+post_delete.connect(
+    update_comment_counts_on_delete, sender=Comment, dispatch_uid="tangerine_comment_deleted"
+)
+
+pre_save.connect(read_archive_fields, sender=Post, dispatch_uid="tangerine_archive_post_saving")
+post_save.connect(update_archive_on_save, sender=Post, dispatch_uid="tangerine_archive_post_saved")
+post_delete.connect(
+    update_archive_on_delete, sender=Post, dispatch_uid="tangerine_archive_post_deleted"
+)
+
+post_save.connect(invalidate_blog_content, sender=Post, dispatch_uid="tangerine_content_post_saved")
+post_delete.connect(
+    invalidate_blog_content, sender=Post, dispatch_uid="tangerine_content_post_deleted"
+)
+
+for model in (Post, Comment):
+    post_save.connect(
+        invalidate_post_page,
+        sender=model,
+        dispatch_uid="tangerine_page_{}_saved".format(model.__name__),
+    )
+    post_delete.connect(
+        invalidate_post_page,
+        sender=model,
+        dispatch_uid="tangerine_page_{}_deleted".format(model.__name__),
+    )
+
+for model in (Comment, Category, RelatedLink, RelatedLinkGroup):
+    post_save.connect(
+        invalidate_related_blog_content,
+        sender=model,
+        dispatch_uid="tangerine_content_{}_saved".format(model.__name__),
+    )
+    post_delete.connect(
+        invalidate_related_blog_content,
+        sender=model,
+        dispatch_uid="tangerine_content_{}_deleted".format(model.__name__),
+    )
+post_save.connect(
+    invalidate_all_blog_content, sender=Blog, dispatch_uid="tangerine_content_blog_saved"
+)
+post_delete.connect(
+    invalidate_all_blog_content, sender=Blog, dispatch_uid="tangerine_content_blog_deleted"
+)
+
+post_save.connect(
+    update_search_index_on_save, sender=Post, dispatch_uid="tangerine_search_post_saved"
+)
+post_delete.connect(
+    update_search_index_on_delete, sender=Post, dispatch_uid="tangerine_search_post_deleted"
+)
+
+for model in (Post, Category):
+    post_save.connect(
+        invalidate_categories,
+        sender=model,
+        dispatch_uid="tangerine_categories_{}_saved".format(model.__name__),
+    )
+    post_delete.connect(
+        invalidate_categories,
+        sender=model,
+        dispatch_uid="tangerine_categories_{}_deleted".format(model.__name__),
+    )
+m2m_changed.connect(
+    invalidate_post_categories,
+    sender=Post.categories.through,
+    dispatch_uid="tangerine_post_categories_changed",
+)
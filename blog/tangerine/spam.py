@@ -0,0 +1,204 @@
+"""Built-in spam filter: a naive Bayes classifier trained on the site's own moderation decisions.
+
+Blogs whose `spam_filter` is "bayes" have new comments scored here instead of by Akismet, with no
+network call.
+
+Each comment is reduced to a set of features: the words of its body, the commenter's name, email
+domain and website host, and how many links it has. Features are hashed into `NUM_BUCKETS` slots
+(the "hashing trick"), so the model is just two fixed-size arrays counting how many spam and how
+many ham comments had a feature in each slot, plus the number of spam and ham comments seen. On disk
+that's a short header and the two arrays, zlib-compressed (see `SpamClassifier.dumps()`).
+
+`manage.py tangerine_train_spam` builds the model from every comment's `spam` flag. After that,
+moderators marking comments as spam or ham (`ops.toggle_spam`, `ops.moderate_comments`) update it in
+place through `learn()`; `Comment.spam_trained` records which way each comment is counted, so a
+comment that changes sides is moved rather than counted twice.
+"""
+
+import fcntl
+import math
+import os
+import re
+import struct
+import zlib
+from array import array
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db.models import F
+
+from blog.tangerine.models import Comment
+
+NUM_BUCKETS = 2**18
+
+# Comments are flagged as spam above this probability.
+SPAM_THRESHOLD = 0.9
+
+# The classifier abstains (calls everything ham) until it has seen this many comments of each kind.
+MIN_TRAINING = 10
+
+HEADER = struct.Struct("<4sII")
+MAGIC = b"TSB1"
+
+TOKEN_RE = re.compile(r"[^\W_]{2,30}")
+LINK_RE = re.compile(r"https?://", re.IGNORECASE)
+
+
+def get_model_path():
+    return getattr(settings, "TANGERINE_SPAM_MODEL_PATH", None)
+
+
+def comment_features(comment):
+    """Return the set of bucket numbers of `comment`'s features."""
+
+    features = set(TOKEN_RE.findall(comment.body.lower()))
+    features.add("links:{}".format(min(len(LINK_RE.findall(comment.body)), 5)))
+    features.add("name:{}".format(comment.name.strip().lower()))
+    features.add("domain:{}".format(comment.email.rpartition("@")[2].lower()))
+    features.add("site:{}".format(urlsplit(comment.website).hostname or ""))
+    return {zlib.crc32(feature.encode()) % NUM_BUCKETS for feature in features}
+
+
+class SpamClassifier:
+    def __init__(self, spam_counts=None, ham_counts=None, num_spam=0, num_ham=0):
+        if spam_counts is None:
+            spam_counts = array("I", bytes(4 * NUM_BUCKETS))
+        if ham_counts is None:
+            ham_counts = array("I", bytes(4 * NUM_BUCKETS))
+        self.spam_counts = spam_counts
+        self.ham_counts = ham_counts
+        self.num_spam = num_spam
+        self.num_ham = num_ham
+
+    def add(self, comment, spam, count=1):
+        """Count `comment` as spam (or ham) once more, or `count` times (-1 to take back an earlier
+        `add()`)."""
+
+        counts = self.spam_counts if spam else self.ham_counts
+        for bucket in comment_features(comment):
+            counts[bucket] = max(counts[bucket] + count, 0)
+        if spam:
+            self.num_spam = max(self.num_spam + count, 0)
+        else:
+            self.num_ham = max(self.num_ham + count, 0)
+
+    def spam_probability(self, comment):
+        """Return the probability that `comment` is spam, or None if the classifier hasn't seen
+        enough yet."""
+
+        num_spam, num_ham = self.num_spam, self.num_ham
+        if num_spam < MIN_TRAINING or num_ham < MIN_TRAINING:
+            return None
+
+        # Log-odds of spam: the prior, plus each feature's (Laplace-smoothed) likelihood ratio.
+        score = math.log(num_spam / num_ham)
+        spam_counts, ham_counts = self.spam_counts, self.ham_counts
+        for bucket in comment_features(comment):
+            score += math.log((spam_counts[bucket] + 1) / (num_spam + 2))
+            score -= math.log((ham_counts[bucket] + 1) / (num_ham + 2))
+        if score < -30:
+            return 0.0
+        return 1 / (1 + math.exp(-score))
+
+    def is_spam(self, comment):
+        probability = self.spam_probability(comment)
+        return probability is not None and probability > SPAM_THRESHOLD
+
+    def dumps(self):
+        return HEADER.pack(MAGIC, self.num_spam, self.num_ham) + zlib.compress(
+            self.spam_counts.tobytes() + self.ham_counts.tobytes()
+        )
+
+    @classmethod
+    def loads(cls, data):
+        magic, num_spam, num_ham = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("Not a Tangerine spam model.")
+        counts = array("I", zlib.decompress(data[HEADER.size :]))
+        if len(counts) != 2 * NUM_BUCKETS:
+            raise ValueError("Spam model has the wrong number of buckets.")
+        return cls(counts[:NUM_BUCKETS], counts[NUM_BUCKETS:], num_spam, num_ham)
+
+    def save(self, path):
+        # Written aside and moved into place, so readers never see half a model.
+        with open(path + ".tmp", "wb") as f:
+            f.write(self.dumps())
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            return cls.loads(f.read())
+
+
+# (path, modification time, classifier) last loaded by this process.
+_loaded = None
+
+
+def get_classifier():
+    """Return the trained classifier, loaded once per process and reloaded when the file changes.
+    None if no model has been trained."""
+
+    global _loaded
+
+    path = get_model_path()
+    try:
+        mtime = os.stat(path).st_mtime_ns if path else None
+    except FileNotFoundError:
+        mtime = None
+    if mtime is None:
+        return None
+    if _loaded is None or _loaded[:2] != (path, mtime):
+        _loaded = (path, mtime, SpamClassifier.load(path))
+    return _loaded[2]
+
+
+@contextmanager
+def _locked(path):
+    # Serialize read-modify-write cycles on the model between processes.
+    with open(path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def train(comments):
+    """Build a model from scratch from a queryset of comments, labelled by their `spam` flag, and
+    save it. Returns the classifier."""
+
+    classifier = SpamClassifier()
+    fields = ("pk", "body", "name", "email", "website", "spam")
+    for comment in comments.only(*fields).iterator(chunk_size=2000):
+        classifier.add(comment, comment.spam)
+    path = get_model_path()
+    with _locked(path):
+        classifier.save(path)
+        Comment.objects.update(spam_trained=None)
+        comments.update(spam_trained=F("spam"))
+    return classifier
+
+
+def learn(comments, spam):
+    """Tell the model that each of `comments` (an iterable of Comments) is spam (or ham), moving any
+    that it had counted the other way. Does nothing if no model has been trained."""
+
+    path = get_model_path()
+    if not path or not os.path.exists(path):
+        return
+    comments = [comment for comment in comments if comment.spam_trained != spam]
+    if not comments:
+        return
+    with _locked(path):
+        classifier = SpamClassifier.load(path)
+        for comment in comments:
+            if comment.spam_trained is not None:
+                classifier.add(comment, comment.spam_trained, -1)
+            classifier.add(comment, spam)
+            comment.spam_trained = spam
+        classifier.save(path)
+        Comment.objects.filter(pk__in=[comment.pk for comment in comments]).update(
+            spam_trained=spam
+        )
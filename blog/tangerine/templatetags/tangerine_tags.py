@@ -1,15 +1,31 @@
-from datetime import datetime
+from datetime import date, datetime
 
 from libgravatar import Gravatar
 
 from django import template
-from django.utils.timezone import make_naive, make_aware, is_aware
-
-from tangerine.models import Category, RelatedLinkGroup, Blog, Comment, Post
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from tangerine.caching import (
+    get_all_blogs as _get_all_blogs,
+    get_blog,
+    get_content_version as _get_content_version,
+    get_versioned,
+    memoize_for_request,
+)
+from tangerine.export import record_dependency
+from tangerine.models import ArchiveMonth, Category, RelatedLinkGroup, Comment, archive_month
 
 register = template.Library()
 
 
+class ArchiveDate(date):
+    """A year or month returned by `get_date_archives`, carrying the number of published posts in
+    it."""
+
+    num_posts = 0
+
+
 @register.simple_tag
 def get_settings(blog_slug):
     """
@@ -31,23 +47,25 @@ def get_settings(blog_slug):
     {{ tangerine.google_analytics_id }}
     {{ tangerine.enable_comments_global }}
     {{ tangerine.comment_system }}
+
+    The Blog comes from `caching.get_blog`, so however many times a page calls this, it costs at
+    most one query.
     """
 
-    try:
-        config = Blog.objects.get(slug=blog_slug)
-        return {
-            "title": config.title,
-            "slug": config.slug,
-            "tagline": config.tagline,
-            "num_posts_per_list_view": config.num_posts_per_list_view,
-            "enable_comments_global": config.enable_comments_global,
-            "comment_system": config.comment_system,
-            "google_analytics_id": config.google_analytics_id,
-        }
-    except AttributeError:
+    config = get_blog(slug=blog_slug)
+    if config is None:
         raise AttributeError(
             "Site not yet configured. Visit Tangerine/Config in the Admin and create a Config record."
         )
+    return {
+        "title": config.title,
+        "slug": config.slug,
+        "tagline": config.tagline,
+        "num_posts_per_list_view": config.num_posts_per_list_view,
+        "enable_comments_global": config.enable_comments_global,
+        "comment_system": config.comment_system,
+        "google_analytics_id": config.google_analytics_id,
+    }
 
 
 @register.simple_tag
@@ -68,15 +86,22 @@ def get_related_links(blog_slug):
     {% endfor %}
     """
 
-    group = RelatedLinkGroup.objects.filter(blog__slug=blog_slug).first()
-    if group:
-        return {
-            "links": group.relatedlink_set.all(),
-        }
-    else:
-        return {
-            "links": [{"site_title": "No RelatedLinkGroup found for this blog."}],
-        }
+    def load():
+        group = RelatedLinkGroup.objects.filter(blog__slug=blog_slug).first()
+        if group:
+            return {
+                "links": list(group.relatedlink_set.all()),
+            }
+        else:
+            return {
+                "links": [{"site_title": "No RelatedLinkGroup found for this blog."}],
+            }
+
+    blog = get_blog(slug=blog_slug)
+    if blog is not None:
+        record_dependency("blogroll:{}".format(blog.pk))
+    # Looked up once per request.
+    return memoize_for_request(("related_links", blog_slug), load)
 
 
 @register.simple_tag
@@ -85,40 +110,59 @@ def get_date_archives(blog_slug, dtype="year", start="19700101", end="29991231")
     Args:
         dtype: One of 'year' or 'month', determining how "deep" returned dates should go
             (retrieve nested months?). Default: 'year'
-        start: String in format yyyymmdd. No dates will be returned for posts earlier than this date.
-        end: String in format yyyymmdd. No dates will be returned for posts later than this date.
+        start: String in format yyyymmdd. No dates will be returned for months earlier than this
+        date. end: String in format yyyymmdd. No dates will be returned for months later than this
+        date.
 
     Returns:
-        Queryset of qualifying datetime objects.
+        List of qualifying date objects, newest first, each with a `num_posts` attribute.
 
     `start` and `end` default to dates in the distant past and future (i.e. we default to "all dates").
 
-    Returns a set of dates for which posts exist, to be parsed in the template with the `regroup` template tag.
-    (We use `regroup` rather than fancy data structures to provide max customizability at the template level).
-    """
+    Returns a set of dates for which published posts exist, to be parsed in the template with the
+    `regroup` template tag. (We use `regroup` rather than fancy data structures to provide max
+    customizability at the template level).
 
-    start = datetime.strptime(start, "%Y%m%d")
-    end = datetime.strptime(end, "%Y%m%d")
-
-    # To prevent TZ awareness from changing dates when they slip over the midnight boundary,
-    # make dates TZ-naive if containing site uses TZ awareness (time=00:00:00).
-    naive_start = make_naive(start) if is_aware(start) else start
-    naive_end = make_naive(end) if is_aware(end) else end
+    Dates come from the per-month post counts in ArchiveMonth, cached per blog until a post changes.
+    Future months are left out unless the blog shows future posts.
+    """
 
-    # Ironically, need to cast the naive dates back to `aware` to prevent console warnings,
-    # since the ORM expects aware dates.
-    qs = (
-        Post.objects.dates("pub_date", dtype, "DESC")
-        .filter(blog__slug=blog_slug)
-        .exclude(pub_date__lt=make_aware(naive_start))
-        .exclude(pub_date__gt=make_aware(naive_end))
-    )
-    return qs
+    if dtype not in ("year", "month"):
+        raise ValueError("dtype must be 'year' or 'month', not {!r}".format(dtype))
+
+    blog = get_blog(slug=blog_slug)
+    if blog is None:
+        return []
+
+    def load():
+        months = ArchiveMonth.objects.filter(blog=blog, num_posts__gt=0).order_by("-month")
+        return list(months.values_list("month", "num_posts"))
+
+    # Months are the finest grain stored, so compare start/end by month only.
+    start = datetime.strptime(start, "%Y%m%d").date().replace(day=1)
+    end = datetime.strptime(end, "%Y%m%d").date()
+    if not blog.show_future:
+        end = min(end, archive_month(timezone.now()))
+
+    dates = []
+    for month, num_posts in get_versioned("date_archives", blog.pk, load):
+        if not start <= month <= end:
+            continue
+        if dtype == "year":
+            month = month.replace(month=1)
+        if dates and dates[-1] == month:
+            dates[-1].num_posts += num_posts
+        else:
+            archive_date = ArchiveDate(month.year, month.month, 1)
+            archive_date.num_posts = num_posts
+            dates.append(archive_date)
+    return dates
 
 
 @register.simple_tag
 def get_categories(blog_slug):
-    """Returns the set of all categories *with published posts* as an ordered list of Category objects.
+    """Returns the set of all categories *with published posts* as an ordered list of Category
+    objects, each annotated with `num_posts`, its number of published posts.
 
     {'categories': categories}
 
@@ -126,18 +170,33 @@ def get_categories(blog_slug):
 
     {% load tangerine_tags %}
     ...
-    {% get_categories as cats blog_slug %}
+    {% get_categories blog_slug as cats %}
     {% for cat in cats.categories %}
-        <li><a href="{% url 'category' cat.slug %}">{{ cat.name }}</a></li>
+        <li><a href="{% url 'tangerine:category' cat_slug=cat.slug blog_slug=blog_slug %}">{{
+        cat.title }}</a>
+            ({{ cat.num_posts }})</li>
     {% endfor %}
+
+    The list is built with one query and cached per blog until a Post, Category or Post's categories
+    change (see `signals.py`).
     """
-    cats = []
-    for c in Category.objects.filter(blog__slug=blog_slug):
-        if c.post_set.filter(trashed=False, published=True).count() > 0:
-            cats.append(c)
+
+    blog = get_blog(slug=blog_slug)
+    if blog is None:
+        return {"categories": []}
+
+    def load():
+        published = Q(post__published=True, post__trashed=False)
+        cats = (
+            Category.objects.filter(blog=blog)
+            .annotate(num_posts=Count("post", filter=published))
+            .filter(num_posts__gt=0)
+            .order_by("title")
+        )
+        return list(cats)
 
     return {
-        "categories": cats,
+        "categories": get_versioned("categories", blog.pk, load),
     }
 
 
@@ -163,11 +222,14 @@ def get_recent_comments(blog_slug, num_comments=10):
     {% endif %}
     """
 
-    # Return approved comments only
+    blog = get_blog(slug=blog_slug)
+    if blog is not None:
+        record_dependency("recent_comments:{}".format(blog.pk))
+    # Return approved comments only. Their posts are needed to link to them, so fetch them
+    # alongside.
+    comments = Comment.pub.filter(post__blog__slug=blog_slug).select_related("post")
     return {
-        "comments": Comment.pub.filter(post__blog__slug=blog_slug).order_by("-created")[
-            :num_comments
-        ],
+        "comments": comments.order_by("-created")[:num_comments],
     }
 
 
@@ -187,7 +249,26 @@ def get_all_blogs():
         {% endfor %}
     </ul>
     """
-    return Blog.objects.all()
+    record_dependency("all_blogs")
+    # Shares the Blog cache (see `caching.py`), so usually costs no query at all.
+    return _get_all_blogs()
+
+
+@register.simple_tag
+def get_content_version(blog_slug):
+    """Returns a token that changes whenever anything shown in the blog's pages (posts, comments,
+    categories, blogroll, blog settings) changes. Use it to key fragment caches:
+
+    {% load cache tangerine_tags %}
+    ...
+    {% get_content_version blog_slug as content_version %}
+    {% cache 3600 my_fragment blog_slug content_version %}
+        ...
+    {% endcache %}
+    """
+
+    blog = get_blog(slug=blog_slug)
+    return _get_content_version(blog.pk) if blog else None
 
 
 @register.filter
@@ -0,0 +1,23 @@
+import pytest
+
+from django.core.cache import cache
+
+from tangerine.caching import clear_blog_cache
+
+
+@pytest.fixture(autouse=True)
+def fresh_blog_cache():
+    # Tests run outside the request cycle, so nothing else clears memoized Blogs between them.
+    clear_blog_cache()
+
+
+@pytest.fixture
+def locmem_cache(settings):
+    # Test settings use DummyCache; caches that need to hold version tokens need a real one. Version
+    # tokens are only bumped once changes commit, so tests of invalidation use
+    # django_db(transaction=True).
+    settings.CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    cache.clear()
+    clear_blog_cache()
+    yield
+    clear_blog_cache()
@@ -0,0 +1,77 @@
+import datetime
+import pytest
+
+from django.core.cache import cache
+from django.utils.timezone import make_aware
+
+from tangerine.caching import (
+    BLOG_VERSION_KEY,
+    clear_blog_cache,
+    clear_request_memo,
+    get_blog,
+    get_show_future_blog_ids,
+)
+from tangerine.factories import BlogFactory, PostFactory
+from tangerine.models import Post
+
+
+@pytest.mark.django_db
+def test_get_blog_memoized_per_request(django_assert_num_queries):
+    blog = BlogFactory()
+    clear_blog_cache()
+
+    with django_assert_num_queries(1):
+        assert get_blog(slug=blog.slug).pk == blog.pk
+        assert get_blog(slug=blog.slug).pk == blog.pk
+
+    # Every lookup is served from the same list of Blogs, unknown slugs included.
+    with django_assert_num_queries(0):
+        assert get_blog(pk=blog.pk).slug == blog.slug
+        assert get_blog(slug="no-such-blog") is None
+        assert get_show_future_blog_ids() == frozenset()
+
+
+@pytest.mark.django_db
+def test_get_blog_process_lru(locmem_cache, django_assert_num_queries):
+    blog = BlogFactory()
+    clear_blog_cache()
+    get_blog(slug=blog.slug)
+
+    # A new request finds the Blog in the process LRU, so needs no query.
+    clear_request_memo()
+    with django_assert_num_queries(0):
+        assert get_blog(slug=blog.slug).title == blog.title
+
+
+@pytest.mark.django_db
+def test_blog_save_bumps_version(locmem_cache, django_capture_on_commit_callbacks):
+    blog = BlogFactory(title="Before")
+    get_blog(slug=blog.slug)
+    version = cache.get(BLOG_VERSION_KEY)
+
+    # This process sees the change straight away; others only once it's committed.
+    with django_capture_on_commit_callbacks() as callbacks:
+        blog.title = "After"
+        blog.save()
+        assert get_blog(slug=blog.slug).title == "After"
+    assert cache.get(BLOG_VERSION_KEY) == version
+    for callback in callbacks:
+        callback()
+    assert cache.get(BLOG_VERSION_KEY) != version
+    assert get_blog(slug=blog.slug).title == "After"
+
+
+@pytest.mark.django_db
+def test_show_future_per_blog(settings):
+    # show_future must be honoured per blog, not read from whichever Blog happens to be first.
+    settings.USE_TZ = True
+    drip_blog = BlogFactory(show_future=False)
+    future_blog = BlogFactory(show_future=True)
+    future_pub_date = make_aware(datetime.datetime(2037, 2, 2, 3, 3, 3))
+
+    drip_post = PostFactory(blog=drip_blog, pub_date=future_pub_date)
+    future_post = PostFactory(blog=future_blog, pub_date=future_pub_date)
+
+    assert get_show_future_blog_ids() == {future_blog.pk}
+    assert drip_post not in Post.pub.filter(blog=drip_blog)
+    assert future_post in Post.pub.filter(blog=future_blog)
@@ -1,7 +1,12 @@
 import pytest
 
-from tangerine.factories import PostFactory, CommentFactory
-from tangerine.models import Comment
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from tangerine.factories import BlogFactory, PostFactory, CommentFactory
+from tangerine.models import Comment, Post
+from tangerine.ops import toggle_approval, toggle_spam
 
 
 @pytest.fixture()
@@ -37,3 +42,90 @@ def test_threaded_comments():
     assert p.top_level_comments().count() == 5
 
     # Tests for posting of child comments is in test_views, since comment threaded is initiated/handled in templates.
+
+
+@pytest.mark.django_db
+def test_comment_tree(django_assert_num_queries):
+    # The whole thread is loaded in one query and flattened in display order, with a depth for each
+    # comment.
+    p = PostFactory()
+    first = CommentFactory(post=p, body="first")
+    second = CommentFactory(post=p, body="second")
+    reply = CommentFactory(post=p, parent=first, body="reply")
+    reply_to_reply = CommentFactory(post=p, parent=reply, body="reply to reply")
+    hidden = CommentFactory(post=p, parent=second, approved=False)
+    CommentFactory(post=p, parent=hidden)  # Reply to an unapproved comment; not shown.
+
+    with django_assert_num_queries(1):
+        tree = p.comment_tree()
+
+    assert tree == [first, reply, reply_to_reply, second]
+    assert [c.depth for c in tree] == [0, 1, 2, 0]
+
+
+@pytest.mark.django_db
+def test_comment_counters():
+    # Post.approved_comment_count and last_comment_at follow comments as they are added, moderated
+    # and deleted.
+    blog = BlogFactory()
+    p = PostFactory(blog=blog)
+    CommentFactory.create_batch(2, post=p)
+    pending = CommentFactory(post=p, approved=False)
+    p.refresh_from_db()
+    assert p.num_comments() == 2
+    latest = Comment.pub.filter(post=p).order_by("-created").first()
+    assert p.last_comment_at == latest.created
+
+    toggle_approval(pending)
+    p.refresh_from_db()
+    assert p.num_comments() == 3
+    assert p.last_comment_at == pending.created
+
+    # Marking as spam unapproves.
+    toggle_spam(pending)
+    p.refresh_from_db()
+    assert p.num_comments() == 2
+    assert p.last_comment_at == latest.created
+
+    latest.delete()
+    p.refresh_from_db()
+    assert p.num_comments() == 1
+    assert p.last_comment_at == Comment.pub.get(post=p).created
+
+
+@pytest.mark.django_db
+def test_recount_comments_command():
+    p = PostFactory()
+    CommentFactory.create_batch(4, post=p)
+    Post.objects.update(approved_comment_count=99, last_comment_at=None)
+
+    call_command("tangerine_recount_comments")
+    p.refresh_from_db()
+    assert p.num_comments() == 4
+    assert p.last_comment_at is not None
+
+
+@pytest.mark.django_db
+def test_post_save_keeps_comment_counters():
+    # Saving a Post loaded before its comments arrived must not reset the stored counters.
+    p = PostFactory()
+    stale = Post.objects.get(pk=p.pk)
+    CommentFactory.create_batch(2, post=p)
+
+    stale.title = "Edited"
+    stale.save()
+    p.refresh_from_db()
+    assert p.title == "Edited"
+    assert p.num_comments() == 2
+
+    # Otherwise saving works as usual: deferred fields are left alone, and a deleted post is
+    # re-created.
+    listed = Post.objects.listing().get(pk=p.pk)
+    with CaptureQueriesContext(connection) as ctx:
+        listed.save()
+    update = ctx.captured_queries[0]["sql"]
+    assert update.startswith("UPDATE")
+    assert '"content"' not in update and '"approved_comment_count"' not in update
+    Post.objects.filter(pk=p.pk).delete()
+    stale.save()
+    assert Post.objects.filter(pk=p.pk, title="Edited").exists()
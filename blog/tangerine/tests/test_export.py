@@ -0,0 +1,186 @@
+import copy
+import datetime
+import pytest
+
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils.timezone import make_aware
+
+from tangerine import export as export_module
+from tangerine.export import RECENT_COMMENTS, blog_paths, export, load_manifest, path_to_file
+from tangerine.factories import BlogFactory, CategoryFactory, CommentFactory, PostFactory
+from tangerine.models import Comment
+
+
+@pytest.mark.django_db
+def test_export(tmp_path, capsys):
+    blog = BlogFactory()
+    post = PostFactory(blog=blog)
+    post.categories.add(CategoryFactory(blog=blog))
+    page = PostFactory(blog=blog, ptype="page")
+    PostFactory(blog=blog, published=False)
+
+    paths = blog_paths(blog)
+    day = post.pub_date
+    for path in (
+        reverse("tangerine:home", args=[blog.slug]),
+        reverse("tangerine:feed", args=[blog.slug]),
+        post.get_absolute_url(),
+        reverse("tangerine:page_detail", args=[blog.slug, page.slug]),
+        reverse("tangerine:category", args=[blog.slug, post.categories.get().slug]),
+        reverse("tangerine:date_archive", args=[blog.slug, day.year, day.month]),
+    ):
+        assert path in paths
+    assert len([p for p in paths if p.endswith("/{}/".format(page.slug))]) == 1
+
+    call_command("tangerine_export", str(tmp_path), "--workers", "1", "--host", "testserver")
+    assert "Rendered {} pages".format(len(paths)) in capsys.readouterr().out
+
+    detail = tmp_path.joinpath(blog.slug, *post.get_absolute_url().split("/")[2:], "index.html")
+    assert str(detail) == path_to_file(str(tmp_path), post.get_absolute_url())
+    assert post.title in detail.read_text()
+    assert "<rss" in tmp_path.joinpath(blog.slug, "feed").read_text()
+
+
+@pytest.mark.django_db
+def test_export_blogless_pages(tmp_path):
+    blogs = BlogFactory.create_batch(2)
+    page = PostFactory(blog=None, ptype="page", title="About")
+
+    for blog in blogs:
+        assert reverse("tangerine:page_detail", args=[blog.slug, page.slug]) in blog_paths(blog)
+    output = str(tmp_path)
+    assert export(blogs, output, "testserver", incremental=True)["failures"] == []
+    about = path_to_file(output, reverse("tangerine:page_detail", args=[blogs[1].slug, page.slug]))
+    assert "About" in open(about).read()
+
+    # Unpublishing it takes it out of every blog.
+    page.published = False
+    page.save()
+    assert export(blogs, output, "testserver", incremental=True)["removed"] == 2
+    assert not tmp_path.joinpath(about).exists()
+
+
+@pytest.mark.django_db
+def test_incremental_export(tmp_path):
+    blog = BlogFactory()
+    posts = [
+        PostFactory(blog=blog, pub_date=make_aware(datetime.datetime(2020, 1, day, 12, 0)))
+        for day in range(1, 8)
+    ]
+    oldest, newest = posts[0], posts[-1]
+    output = str(tmp_path)
+
+    def run():
+        return export([blog], output, "testserver", incremental=True)
+
+    first = run()
+    assert first["rendered"] == first["written"] == len(blog_paths(blog))
+    assert run() == {"rendered": 0, "written": 0, "removed": 0, "failures": []}
+
+    # An edit re-renders the pages showing that post, and not the pages of posts far from it.
+    newest_file = tmp_path.joinpath(path_to_file(output, newest.get_absolute_url()))
+    newest_file.write_text("untouched")
+    oldest.content = "<p>Take the A Train</p>"
+    oldest.save()
+    result = run()
+    assert 0 < result["rendered"] < first["rendered"]
+    assert "Take the A Train" in open(path_to_file(output, oldest.get_absolute_url())).read()
+    assert newest_file.read_text() == "untouched"
+
+    # So does a comment, once it's approved.
+    comment = CommentFactory(post=oldest, approved=False, name="Duke Ellington")
+    assert run()["rendered"] == 0
+    comment.approved = True
+    comment.save()
+    run()
+    assert "Duke Ellington" in open(path_to_file(output, oldest.get_absolute_url())).read()
+
+    # Publishing or unpublishing a post changes every page's sidebar, and adds or removes pages.
+    oldest.published = False
+    oldest.save()
+    result = run()
+    assert result["removed"] >= 1
+    assert not tmp_path.joinpath(path_to_file(output, oldest.get_absolute_url())).exists()
+
+    # Re-exporting everything rewrites only the files whose content changed.
+    result = export([blog], output, "testserver")
+    assert result["rendered"] == len(blog_paths(blog))
+    assert result["written"] == 0
+
+
+@pytest.mark.django_db
+def test_incremental_export_comments(tmp_path, settings):
+    blog = BlogFactory()
+    post, other_post = PostFactory.create_batch(2, blog=blog)
+    comment = CommentFactory(post=post, approved=False, name="Duke Ellington")
+    Comment.objects.filter(pk=comment.pk).update(created=make_aware(datetime.datetime(2000, 1, 1)))
+    CommentFactory.create_batch(RECENT_COMMENTS, post=other_post)
+    output = str(tmp_path / "output")
+
+    def run():
+        return export([blog], output, "testserver", incremental=True)
+
+    first = run()
+    # Only public objects are fingerprinted.
+    objects = load_manifest(output)["objects"]
+    assert "comment:{}".format(comment.pk) not in objects
+    assert "post:{}".format(post.pk) in objects
+
+    # Approving a comment too old for Recent Comments re-renders only the pages that show its post.
+    comment.refresh_from_db()
+    comment.approved = True
+    comment.save()
+    result = run()
+    assert 0 < result["rendered"] < first["rendered"]
+    assert "Duke Ellington" in open(path_to_file(output, post.get_absolute_url())).read()
+
+    # The site's base template has no sidebar, so a new comment shows on its post's pages only.
+    CommentFactory(post=post, name="Ella Fitzgerald")
+    assert 0 < run()["rendered"] < first["rendered"]
+
+    # Where the base template shows the sidebar, a new comment shows up on every page.
+    site_templates = tmp_path / "templates"
+    site_templates.mkdir()
+    site_templates.joinpath("base.html").write_text(
+        "{% block content %}{% endblock %}<aside>{% block sidebar %}{% endblock %}</aside>"
+    )
+    templates = copy.deepcopy(settings.TEMPLATES)
+    templates[0]["DIRS"] = [str(site_templates)] + templates[0]["DIRS"]
+    settings.TEMPLATES = templates
+    export([blog], output, "testserver")
+    assert "Ella Fitzgerald" in open(path_to_file(output, other_post.get_absolute_url())).read()
+    CommentFactory(post=post, name="Billie Holiday")
+    assert run()["rendered"] == first["rendered"]
+    assert "Billie Holiday" in open(path_to_file(output, other_post.get_absolute_url())).read()
+
+
+@pytest.mark.django_db
+def test_export_failures_keep_files(tmp_path, monkeypatch):
+    blog = BlogFactory()
+    post = PostFactory(blog=blog, content="<p>Mood Indigo</p>")
+    output = str(tmp_path)
+    export([blog], output, "testserver", incremental=True)
+    filename = path_to_file(output, post.get_absolute_url())
+
+    # The post's page fails to render: its old file stays, and nothing is removed.
+    post.content = "<p>Take the A Train</p>"
+    post.save()
+    render_paths = export_module.render_paths
+
+    def failing_render_paths(paths, *args):
+        failing = post.get_absolute_url()
+        results, failures = render_paths([path for path in paths if path != failing], *args)
+        return results, failures + [(failing, 500)]
+
+    monkeypatch.setattr(export_module, "render_paths", failing_render_paths)
+    result = export([blog], output, "testserver", incremental=True)
+    assert result["failures"] == [(post.get_absolute_url(), 500)]
+    assert result["removed"] == 0
+    assert "Mood Indigo" in open(filename).read()
+
+    # The next export tries it again.
+    monkeypatch.undo()
+    result = export([blog], output, "testserver", incremental=True)
+    assert result["rendered"] == 1
+    assert "Take the A Train" in open(filename).read()
@@ -0,0 +1,80 @@
+import json
+import pytest
+from xml.etree import ElementTree
+
+from django.urls import reverse
+
+from tangerine.factories import BlogFactory, CategoryFactory, PostFactory
+
+
+ATOM = "{http://www.w3.org/2005/Atom}"
+
+
+@pytest.fixture
+def feed_posts(django_user_model):
+    blog = BlogFactory()
+    ella = django_user_model.objects.create_user("ella", first_name="Ella", last_name="Fitzgerald")
+    duke = django_user_model.objects.create_user("duke")
+    swing = CategoryFactory(blog=blog, title="Swing")
+    by_ella = PostFactory(blog=blog, author=ella, title="A-Tisket, A-Tasket")
+    by_ella.categories.add(swing)
+    by_duke = PostFactory(blog=blog, author=duke, title="Take the A Train")
+    PostFactory(blog=BlogFactory(), author=ella, title="Elsewhere")
+    return blog, swing, by_ella, by_duke
+
+
+@pytest.mark.django_db
+def test_feed_formats(client, feed_posts):
+    blog, swing, by_ella, by_duke = feed_posts
+
+    rss = ElementTree.fromstring(client.get(reverse("tangerine:feed", args=[blog.slug])).getvalue())
+    assert {item.findtext("title") for item in rss.iter("item")} == {by_ella.title, by_duke.title}
+
+    response = client.get(reverse("tangerine:feed", args=[blog.slug, "atom"]))
+    assert response["Content-Type"] == "application/atom+xml; charset=utf-8"
+    atom = ElementTree.fromstring(response.getvalue())
+    entries = {entry.findtext(ATOM + "title"): entry for entry in atom.iter(ATOM + "entry")}
+    assert set(entries) == {by_ella.title, by_duke.title}
+    assert entries[by_ella.title].find(ATOM + "link").get("href").endswith(by_ella.permalink)
+    assert entries[by_ella.title].findtext(ATOM + "author/" + ATOM + "name") == "Ella Fitzgerald"
+
+    response = client.get(reverse("tangerine:feed", args=[blog.slug, "json"]))
+    assert response["Content-Type"] == "application/feed+json; charset=utf-8"
+    data = json.loads(response.getvalue())
+    assert data["version"] == "https://jsonfeed.org/version/1.1"
+    items = {item["title"]: item for item in data["items"]}
+    assert set(items) == {by_ella.title, by_duke.title}
+    assert items[by_ella.title]["tags"] == ["Swing"]
+    assert items[by_ella.title]["content_html"] == by_ella.excerpt
+
+    assert client.get(reverse("tangerine:feed", args=[blog.slug, "yaml"])).status_code == 404
+
+
+@pytest.mark.django_db
+def test_category_and_author_feeds(client, feed_posts, locmem_cache):
+    blog, swing, by_ella, by_duke = feed_posts
+
+    def titles(url):
+        data = json.loads(client.get(url).getvalue())
+        return [item["title"] for item in data["items"]]
+
+    assert titles(reverse("tangerine:category_feed", args=[blog.slug, swing.slug, "json"])) == [
+        by_ella.title
+    ]
+    assert titles(reverse("tangerine:author_feed", args=[blog.slug, "ella", "json"])) == [
+        by_ella.title
+    ]
+
+    # Each feed is validated on its own: a post outside this category leaves its ETag alone.
+    url = reverse("tangerine:category_feed", args=[blog.slug, swing.slug])
+    etag = client.get(url)["ETag"]
+    assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 304
+    assert (
+        client.get(reverse("tangerine:feed", args=[blog.slug]), HTTP_IF_NONE_MATCH=etag).status_code
+        == 200
+    )
+    PostFactory(blog=blog, title="Mood Indigo")
+    assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 304
+    by_ella.categories.add(CategoryFactory(blog=blog))
+    by_ella.save()
+    assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 200
@@ -0,0 +1,71 @@
+import pytest
+
+from django.db import connection
+
+from tangerine.factories import BlogFactory, CommentFactory, PostFactory
+from tangerine.models import Comment, Post
+from tangerine.pagination import posts_after, posts_before
+
+
+# Every index defined on Post and Comment. A query "uses an index" if its plan mentions one of them.
+INDEX_NAMES = [index.name for model in (Post, Comment) for index in model._meta.indexes]
+
+
+@pytest.fixture
+def blog_with_comments():
+    blog = BlogFactory()
+    for post in PostFactory.create_batch(5, blog=blog):
+        CommentFactory.create_batch(3, post=post)
+    return blog
+
+
+@pytest.fixture
+def no_seqscan():
+    # Tables in tests are tiny, so Postgres would happily scan them whatever indexes exist.
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+
+def assert_uses_index(qs):
+    plan = qs.explain()
+    assert any(name in plan for name in INDEX_NAMES), "No index used:\n{}\n{}".format(
+        qs.query, plan
+    )
+
+
+@pytest.mark.django_db
+def test_post_pub_queries_use_index(blog_with_comments, no_seqscan):
+    blog = blog_with_comments
+    assert_uses_index(Post.pub.all())
+    assert_uses_index(Post.pub.filter(blog=blog))
+    assert_uses_index(Post.pub.filter(blog=blog).listing())
+
+    # Also with show_future enabled for a blog.
+    blog.show_future = True
+    blog.save()
+    assert_uses_index(Post.pub.filter(blog=blog))
+
+
+@pytest.mark.django_db
+def test_keyset_pages_use_index(blog_with_comments, no_seqscan):
+    # Pages are read off the index in order, ties broken by id, however deep they are: no sorting.
+    posts = Post.pub.filter(blog=blog_with_comments)
+    middle = posts.order_by("-pub_date")[2]
+    for qs in (
+        posts_after(posts, (middle.pub_date, middle.pk))[:3],
+        posts_before(posts, (middle.pub_date, middle.pk))[:3],
+    ):
+        assert_uses_index(qs)
+        plan = qs.explain()
+        assert "TEMP B-TREE" not in plan and "Sort" not in plan, plan
+
+
+@pytest.mark.django_db
+def test_comment_pub_queries_use_index(blog_with_comments, no_seqscan):
+    post = Post.objects.first()
+    comment = Comment.objects.first()
+    assert_uses_index(Comment.pub.all())
+    assert_uses_index(Comment.pub.filter(post=post).order_by("modified"))
+    assert_uses_index(post.top_level_comments())
+    assert_uses_index(comment.child_comments())
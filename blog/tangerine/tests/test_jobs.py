@@ -0,0 +1,133 @@
+import pytest
+from datetime import timedelta
+
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.utils import timezone
+
+from tangerine import jobs, ops
+from tangerine.caching import BLOG_VERSION_KEY
+from tangerine.factories import BlogFactory, PostFactory
+from tangerine.models import ApprovedCommentor, Blog, Comment, CommentJob
+
+
+@pytest.fixture
+def post():
+    return PostFactory(blog=BlogFactory(), slug="somepost")
+
+
+@pytest.fixture
+def comment_data():
+    return {"name": "Duke Ellington", "email": "a@b.com", "body": "some content"}
+
+
+@pytest.mark.django_db
+def test_comment_jobs_inline(post, comment_data, admin_client):
+    # Test settings run jobs inline, so the whole pipeline has run by the time the comment is
+    # posted.
+    admin_client.post(post.get_absolute_url(), data=comment_data)
+    comment = Comment.objects.get(post=post)
+    assert comment.approved
+    assert not comment.spam
+    assert not CommentJob.objects.exists()
+    assert len(mail.outbox) == 1
+    assert "automatically published" in mail.outbox[0].subject
+
+
+@pytest.mark.django_db
+def test_comment_jobs_queued(post, comment_data, client, settings):
+    settings.TANGERINE_JOBS_INLINE = False
+    client.post(post.get_absolute_url(), data=comment_data)
+
+    # Posting only saves the comment and queues its spam check.
+    comment = Comment.objects.get(post=post)
+    assert not comment.approved
+    assert list(CommentJob.objects.values_list("task", flat=True)) == ["spam_check"]
+    assert not mail.outbox
+
+    # The worker runs each step, and the ones they queue in turn.
+    call_command("tangerine_worker", once=True)
+    assert not CommentJob.objects.exists()
+    assert len(mail.outbox) == 1
+    assert "requires moderation" in mail.outbox[0].subject
+
+
+@pytest.mark.django_db
+def test_job_retries(post, settings, monkeypatch):
+    settings.TANGERINE_JOBS_INLINE = False
+    comment = Comment.objects.create(post=post, name="Joe", email="joe@example.com", body="Hi")
+
+    def send_mail(*args, **kwargs):
+        raise ConnectionRefusedError
+
+    monkeypatch.setattr(ops, "send_mail", send_mail)
+    job = jobs.enqueue(comment, "notify")
+
+    call_command("tangerine_worker", once=True)
+    job.refresh_from_db()
+    assert job.attempts == 1
+    assert not job.failed
+    assert "ConnectionRefusedError" in job.last_error
+    # Not due again until the retry delay has passed.
+    assert job.run_after > timezone.now() + timedelta(seconds=jobs.RETRY_DELAY - 5)
+    assert jobs.claim_job() is None
+
+    # Delays double with each attempt, until the job is given up on.
+    for attempt in range(2, jobs.MAX_ATTEMPTS + 1):
+        CommentJob.objects.update(run_after=timezone.now())
+        call_command("tangerine_worker", once=True)
+        job.refresh_from_db()
+        assert job.attempts == attempt
+        if attempt < jobs.MAX_ATTEMPTS:
+            delay = timedelta(seconds=jobs.RETRY_DELAY * 2 ** (attempt - 1))
+            assert timezone.now() + delay - timedelta(seconds=5) < job.run_after
+            assert job.run_after <= timezone.now() + delay
+    assert job.failed
+    assert jobs.claim_job() is None
+
+    # Once the mail server is back, a fresh job goes through.
+    monkeypatch.undo()
+    jobs.enqueue(comment, "notify")
+    call_command("tangerine_worker", once=True)
+    assert len(mail.outbox) == 1
+    assert list(CommentJob.objects.all()) == [job]
+
+
+@pytest.mark.django_db
+def test_spam_check_job_with_akismet_key(settings):
+    # Akismet isn't wired up, but a blog with a key mustn't make spam check jobs fail.
+    settings.TANGERINE_JOBS_INLINE = False
+    post = PostFactory(blog=BlogFactory(spam_filter="akismet", akismet_key="abc123"))
+    comment = Comment.objects.create(post=post, name="Joe", email="joe@example.com", body="Hi")
+    assert not ops.spam_check(comment)
+
+    jobs.enqueue(comment, "spam_check")
+    call_command("tangerine_worker", once=True)
+    comment.refresh_from_db()
+    assert not comment.spam
+    assert not CommentJob.objects.filter(comment=comment, failed=True).exists()
+    assert not CommentJob.objects.filter(comment=comment, task="spam_check").exists()
+
+
+@pytest.mark.django_db
+def test_worker_sees_blog_changes(post, settings, locmem_cache):
+    settings.TANGERINE_JOBS_INLINE = False
+    ApprovedCommentor.objects.approve_emails(["joe@example.com"])
+
+    first = Comment.objects.create(post=post, name="Joe", email="joe@example.com", body="Hi")
+    jobs.enqueue(first, "approval")
+    call_command("tangerine_worker", once=True)
+    first.refresh_from_db()
+    assert first.approved
+
+    # Another process turns auto-approval off, and bumps the Blog version token as saving a Blog
+    # does.
+    Blog.objects.filter(pk=post.blog_id).update(auto_approve_previous_commentors=False)
+    cache.set(BLOG_VERSION_KEY, "changed elsewhere", None)
+
+    second = Comment.objects.create(post=post, name="Joe", email="joe@example.com", body="Hi")
+    jobs.enqueue(second, "approval")
+    call_command("tangerine_worker", once=True)
+    second.refresh_from_db()
+    assert not second.approved
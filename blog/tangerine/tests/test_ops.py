@@ -1,11 +1,14 @@
+import bleach
 import pytest
 
 from django.conf import settings
 from django.core import mail
+from django.db import connection
 from django.shortcuts import reverse
+from django.test.utils import CaptureQueriesContext
 
-from tangerine.factories import PostFactory, CommentFactory, ConfigFactory
-from tangerine.models import ApprovedCommentor
+from tangerine.factories import BlogFactory, PostFactory, CommentFactory, ConfigFactory
+from tangerine.models import ApprovedCommentor, Comment, Post
 from tangerine.ops import (
     sanitize_comment,
     get_comment_approval,
@@ -14,6 +17,8 @@ from tangerine.ops import (
     akismet_spam_ham,
     send_comment_moderation_email,
     get_search_qs,
+    moderate_comments,
+    sanitize_batch,
 )
 
 
@@ -45,6 +50,45 @@ def test_comment_approval():
     assert get_comment_approval("joe@example.com", False) is False
 
 
+@pytest.mark.django_db
+def test_approved_commentor_emails():
+    # Emails are stored normalized and only once, however they're typed.
+    ApprovedCommentor.objects.create(email=" Joe@Example.com")
+    ApprovedCommentor.objects.approve_emails(["JOE@example.com", "ann@example.com", ""])
+    assert sorted(ApprovedCommentor.objects.values_list("email", flat=True)) == [
+        "ann@example.com",
+        "joe@example.com",
+    ]
+    assert ApprovedCommentor.objects.is_approved("joe@EXAMPLE.com")
+    assert not ApprovedCommentor.objects.is_approved("bob@example.com")
+    assert not ApprovedCommentor.objects.is_approved("")
+
+    ApprovedCommentor.objects.revoke_emails(["Ann@example.com"])
+    assert not ApprovedCommentor.objects.is_approved("ann@example.com")
+
+
+@pytest.mark.django_db
+def test_approved_commentors_in_memory(
+    locmem_cache, django_assert_num_queries, django_capture_on_commit_callbacks
+):
+    with django_capture_on_commit_callbacks(execute=True):
+        ApprovedCommentor.objects.approve_emails(["joe@example.com"])
+    assert ApprovedCommentor.objects.is_approved("joe@example.com")
+
+    # Once loaded, lookups need no query, either way.
+    with django_assert_num_queries(0):
+        assert ApprovedCommentor.objects.is_approved("Joe@example.com")
+        assert not ApprovedCommentor.objects.is_approved("ann@example.com")
+
+    # Changes are seen as soon as they're committed.
+    with django_capture_on_commit_callbacks(execute=True):
+        ApprovedCommentor.objects.approve_emails(["ann@example.com"])
+    assert ApprovedCommentor.objects.is_approved("ann@example.com")
+    with django_capture_on_commit_callbacks(execute=True):
+        ApprovedCommentor.objects.get(email="joe@example.com").delete()
+    assert not ApprovedCommentor.objects.is_approved("joe@example.com")
+
+
 @pytest.mark.django_db
 def test_approval_toggle():
     config = ConfigFactory()  # auto_approve defaults to True
@@ -86,6 +130,26 @@ def test_comment_sanitizer():
     assert sanitize_comment(comment) == "This is a test"
 
 
+def test_sanitize_batch(settings):
+    # Texts that skip the parser come out just as bleach would leave them.
+    comments = [
+        "Plain text, with 'quotes' and\ttabs\nand newlines",
+        "This <b>is</b> a test",
+        "AT&T > Sprint",
+        "&amp; an entity",
+        "Control\x01characters\r\n",
+        "This <script>is</script> a test",
+    ]
+    expected = [bleach.clean(comment, strip=True) for comment in comments]
+    assert sanitize_batch(comments) == expected
+    assert [sanitize_comment(comment) for comment in comments] == expected
+
+    # A change to the allowed tags is picked up.
+    settings.BLEACH_ALLOWED_TAGS = ["i"]
+    assert sanitize_batch(["<b>bold</b> and <i>italic</i>"]) == ["bold and <i>italic</i>"]
+    assert sanitize_batch(["<b>bold</b>"], tags=["b"]) == ["<b>bold</b>"]
+
+
 @pytest.mark.django_db
 def test_spam_check():
     """For now we are just testing our route to the Akismet API and whether we store submitted comments
@@ -163,6 +227,65 @@ def test_send_comment_moderation_email(email_backend_setup, admin_user):
     )
 
 
+@pytest.mark.django_db
+def test_moderate_comments():
+    post = PostFactory(blog=BlogFactory())
+    c1, c2, c3 = CommentFactory.create_batch(3, post=post, approved=False)
+    reply = CommentFactory(post=post, parent=c1, approved=True)
+    selected = Comment.objects.filter(pk__in=[c1.pk, c2.pk, c3.pk])
+
+    table = connection.ops.quote_name(Comment._meta.db_table)
+
+    def comment_queries(queries, statement):
+        return [q for q in queries if q["sql"].startswith("{} {}".format(statement, table))]
+
+    # Approving updates all the comments in one statement, and remembers their commenters.
+    with CaptureQueriesContext(connection) as queries:
+        assert moderate_comments(selected, "approve") == 3
+    assert len(comment_queries(queries, "UPDATE")) == 1
+    assert Comment.pub.count() == 4
+    assert Post.objects.get(pk=post.pk).approved_comment_count == 4
+    assert set(ApprovedCommentor.objects.values_list("email", flat=True)) == {
+        c1.email,
+        c2.email,
+        c3.email,
+    }
+
+    moderate_comments(Comment.objects.filter(pk=c2.pk), "spam")
+    c2.refresh_from_db()
+    assert c2.spam and not c2.approved
+    assert not ApprovedCommentor.objects.filter(email=c2.email).exists()
+    assert Post.objects.get(pk=post.pk).approved_comment_count == 3
+
+    moderate_comments(Comment.objects.filter(pk=c3.pk), "unapprove")
+    assert Post.objects.get(pk=post.pk).approved_comment_count == 2
+
+    # Deleting a comment takes its replies with it, in one statement.
+    with CaptureQueriesContext(connection) as queries:
+        assert moderate_comments(Comment.objects.filter(pk=c1.pk), "delete") == 2
+    assert len(comment_queries(queries, "DELETE FROM")) == 1
+    assert not Comment.objects.filter(pk__in=[c1.pk, reply.pk]).exists()
+    assert Post.objects.get(pk=post.pk).approved_comment_count == 0
+
+    with pytest.raises(ValueError):
+        moderate_comments(Comment.objects.all(), "publish")
+
+
+@pytest.mark.django_db
+def test_moderate_comments_keeps_approved_commentors():
+    post = PostFactory(blog=BlogFactory())
+    kept, dropped = CommentFactory.create_batch(2, post=post, approved=False)
+    CommentFactory(post=post, email=" {} ".format(kept.email.upper()), approved=True)
+    selected = Comment.objects.filter(pk__in=[kept.pk, dropped.pk])
+    moderate_comments(selected, "approve")
+
+    # Unapproving takes commenters off the approved list only if they have no approved comments
+    # left.
+    moderate_comments(selected, "unapprove")
+    assert ApprovedCommentor.objects.is_approved(kept.email)
+    assert not ApprovedCommentor.objects.is_approved(dropped.email)
+
+
 @pytest.mark.django_db
 def test_get_search_qs():
     # Test reusable queryset generator for Post search terms
@@ -0,0 +1,78 @@
+import datetime
+import pytest
+
+from django.http import QueryDict
+from django.urls import reverse
+from django.utils.timezone import make_aware
+
+from tangerine.factories import BlogFactory, PostFactory
+from tangerine.models import Post
+from tangerine.pagination import decode_cursor, encode_cursor, keyset_paginate
+
+
+@pytest.fixture
+def keyset_blog():
+    blog = BlogFactory(pagination="keyset", num_posts_per_list_view=3)
+    # Two posts share each pub_date, so ordering has to fall back to id to stay stable.
+    for day in range(1, 6):
+        pub_date = make_aware(datetime.datetime(2020, 1, day, 12, 0, 0))
+        PostFactory.create_batch(2, blog=blog, pub_date=pub_date)
+    return blog
+
+
+def query_from_link(link):
+    return QueryDict(link.lstrip("?"))
+
+
+@pytest.mark.django_db
+def test_cursor_round_trip():
+    post = PostFactory()
+    assert decode_cursor(encode_cursor(post)) == (post.pub_date, post.pk)
+    assert decode_cursor("garbage") is None
+
+
+@pytest.mark.django_db
+def test_keyset_walks_all_posts(keyset_blog, django_assert_num_queries):
+    posts = Post.pub.filter(blog=keyset_blog)
+    expected = list(posts.order_by("-pub_date", "-pk"))
+
+    # Walk forward through older posts, one query per page and no COUNT.
+    seen = []
+    query = QueryDict()
+    while True:
+        with django_assert_num_queries(1):
+            page = keyset_paginate(posts, 3, query)
+        seen.extend(page)
+        if not page.has_next():
+            break
+        query = query_from_link(page.next_page_link)
+    assert seen == expected
+
+    # ...then back again through newer posts.
+    assert page.has_previous()
+    seen = list(page)
+    while page.has_previous():
+        page = keyset_paginate(posts, 3, query_from_link(page.previous_page_link))
+        seen = list(page) + seen
+    assert seen == expected
+
+
+@pytest.mark.django_db
+def test_keyset_links_keep_other_params(keyset_blog):
+    page = keyset_paginate(Post.pub.filter(blog=keyset_blog), 3, QueryDict("q=clowns&page=4"))
+    query = query_from_link(page.next_page_link)
+    assert query["q"] == "clowns"
+    assert "page" not in query
+    assert "after" in query
+
+
+@pytest.mark.django_db
+def test_keyset_home_view(keyset_blog, client):
+    url = reverse("tangerine:home", args=[keyset_blog.slug])
+    response = client.get(url)
+    assert response.status_code == 200
+    assert "?after=" in response.content.decode()
+
+    response = client.get(url + response.context["posts"].next_page_link)
+    assert response.status_code == 200
+    assert len(response.context["posts"]) == 3
@@ -4,6 +4,7 @@ import pytest
 from django.utils.timezone import make_aware
 
 from tangerine.factories import (
+    BlogFactory,
     CategoryFactory,
     PostFactory,
     RelatedLinkGroupFactory,
@@ -87,3 +88,76 @@ def test_future_posts(settings):
     config.show_future = True
     config.save()
     assert future_post in Post.pub.all()
+
+
+@pytest.mark.django_db
+def test_listing_queryset(django_assert_num_queries):
+    blog = BlogFactory()
+    cat = CategoryFactory(blog=blog)
+    for post in PostFactory.create_batch(5, blog=blog):
+        post.categories.add(cat)
+        CommentFactory.create_batch(3, post=post)
+        CommentFactory(post=post, approved=False)
+
+    # One query for the posts, one for their categories - however many posts there are.
+    with django_assert_num_queries(2):
+        for post in Post.objects.filter(blog=blog).listing():
+            assert post.num_comments() == 3
+            assert post.categories.count() == 1
+            assert post.blog.slug == blog.slug
+            post.get_absolute_url()
+
+
+@pytest.mark.django_db
+def test_stored_permalink(django_assert_num_queries):
+    blog = BlogFactory(slug="zest")
+    post = PostFactory(
+        blog=blog, slug="peel", pub_date=make_aware(datetime.datetime(2021, 3, 4, 12))
+    )
+    assert post.permalink == "/zest/2021/3/4/peel/"
+
+    # Served straight from the stored path.
+    post = Post.objects.get(pk=post.pk)
+    with django_assert_num_queries(0):
+        assert post.get_absolute_url() == "/zest/2021/3/4/peel/"
+
+    # Rebuilt when the slug or pub_date change...
+    post.slug = "pith"
+    post.pub_date = make_aware(datetime.datetime(2022, 5, 6, 12))
+    post.save()
+    assert Post.objects.get(pk=post.pk).permalink == "/zest/2022/5/6/pith/"
+    post.slug = "juice"
+    post.save(update_fields=["slug"])
+    assert Post.objects.get(pk=post.pk).permalink == "/zest/2022/5/6/juice/"
+
+    # ...and for all of a blog's posts when the blog's slug changes.
+    blog.slug = "rind"
+    blog.save()
+    assert Post.objects.get(pk=post.pk).get_absolute_url() == "/rind/2022/5/6/juice/"
+
+
+@pytest.mark.django_db
+def test_stored_excerpt():
+    words = " ".join("word{}".format(n) for n in range(30))
+    post = PostFactory(summary="", content="<p>Hello <em>{}</em></p>".format(words))
+    assert post.excerpt.startswith("<p>Hello <em>word0 ")
+    assert post.excerpt.endswith("word18…</em></p>")
+    assert post.meta_description == "Hello word0 word1 word2 word3…"
+
+    # Kept up to date when the content changes, even on partial saves...
+    post.content = "<p>Take the <b>A</b> Train &amp; more</p>"
+    post.save(update_fields=["content"])
+    post = Post.objects.get(pk=post.pk)
+    assert post.excerpt == "<p>Take the <b>A</b> Train &amp; more</p>"
+    assert post.meta_description == "Take the A Train &…"
+
+    # ...and a summary takes precedence.
+    post.summary = "<p>Ellington's <i>theme</i></p>"
+    post.save()
+    assert post.excerpt == "<p>Ellington's <i>theme</i></p>"
+    assert post.meta_description == "Ellington's theme"
+
+    # List views never load the content.
+    listed = Post.objects.listing().get(pk=post.pk)
+    assert {"content", "summary"} <= listed.get_deferred_fields()
+    assert listed.excerpt == post.excerpt
@@ -0,0 +1,126 @@
+import pytest
+
+from django.core.management import call_command
+from django.urls import reverse
+
+from tangerine.factories import BlogFactory, PostFactory
+from tangerine.models import Post
+from tangerine.ops import get_search_qs
+from tangerine.search import PostgresSearchBackend, get_ranked_post_ids, get_search_backend
+
+
+@pytest.mark.django_db
+def test_search_ranks_and_stems():
+    in_content = PostFactory(content="<p>We flew home by zeppelin.</p>")
+    in_title = PostFactory(title="Zeppelins over the harbour")
+    in_summary = PostFactory(summary="A zeppelin, briefly")
+
+    # Plural and singular match each other, and title matches outrank summary and content matches.
+    assert list(get_search_qs("zeppelin")) == [in_title, in_summary, in_content]
+    assert list(get_search_qs("ZEPPELINS")) == [in_title, in_summary, in_content]
+
+    # Every word has to match, and query syntax in user input is just ignored.
+    assert list(get_search_qs('harbour "zeppelin*')) == [in_title]
+    assert list(get_search_qs("zeppelin marmalade")) == []
+    assert list(get_search_qs("  ")) == []
+
+
+@pytest.mark.django_db
+def test_search_per_blog():
+    blog1, blog2 = BlogFactory.create_batch(2)
+    post1 = PostFactory(blog=blog1, title="Marmalade")
+    post2 = PostFactory(blog=blog2, title="Marmalade")
+
+    assert list(get_search_qs("marmalade", blog=blog1)) == [post1]
+    assert list(get_search_qs("marmalade", blog=blog2)) == [post2]
+    assert set(get_search_qs("marmalade")) == {post1, post2}
+
+
+@pytest.mark.django_db
+def test_search_index_follows_posts():
+    post = PostFactory(title="Marmalade")
+
+    post.title = "Zeppelin"
+    post.save()
+    assert list(get_search_qs("marmalade")) == []
+    assert list(get_search_qs("zeppelin")) == [post]
+
+    post.delete()
+    assert list(get_search_qs("zeppelin")) == []
+
+    # Posts changed behind the signals' back are picked up by a rebuild.
+    post = PostFactory(title="Zeppelin")
+    Post.objects.filter(pk=post.pk).update(title="Marmalade")
+    call_command("tangerine_rebuild_search_index")
+    assert list(get_search_qs("marmalade")) == [post]
+
+
+@pytest.mark.django_db
+def test_icontains_backend(settings):
+    settings.TANGERINE_SEARCH_BACKEND = "blog.tangerine.search.SearchBackend"
+    assert type(get_search_backend()).__name__ == "SearchBackend"
+
+    post = PostFactory(title="Marmalade sandwiches")
+    assert list(get_search_qs("lade sand")) == [post]
+
+
+def test_normalize_query(settings):
+    backend = get_search_backend()
+    assert backend.normalize_query("  The Clowns,  to the LEFT ") == "clowns left"
+    assert backend.normalize_query("left clowns clowns") == "clowns left"
+    assert backend.normalize_query("To be or not to be") == "be not or to"
+
+    settings.TANGERINE_SEARCH_BACKEND = "blog.tangerine.search.SearchBackend"
+    assert (
+        get_search_backend().normalize_query("  The Clowns,  to the LEFT ")
+        == "the clowns, to the left"
+    )
+
+    # Postgres reads phrases, exclusions and "or" in queries, so they're kept, in order.
+    assert (
+        PostgresSearchBackend().normalize_query(' "Big  Band" -Swing OR bebop ')
+        == '"big band" -swing or bebop'
+    )
+
+
+@pytest.mark.django_db(transaction=True)
+def test_search_results_cached_per_blog(locmem_cache, django_assert_num_queries):
+    blog, other_blog = BlogFactory.create_batch(2)
+    post = PostFactory(blog=blog, title="Marmalade sandwiches")
+
+    with django_assert_num_queries(1):
+        assert get_ranked_post_ids("marmalade sandwiches", blog) == [post.pk]
+    with django_assert_num_queries(0):
+        assert get_ranked_post_ids("Sandwiches and MARMALADE", blog) == [post.pk]
+
+    # Posts saved in another blog leave the cached results alone; saving one in this blog
+    # invalidates them.
+    PostFactory(blog=other_blog, title="Marmalade sandwiches")
+    with django_assert_num_queries(0):
+        get_ranked_post_ids("marmalade sandwiches", blog)
+    newer = PostFactory(blog=blog, content="Sandwiches, with marmalade")
+    assert get_ranked_post_ids("marmalade sandwiches", blog) == [post.pk, newer.pk]
+
+
+@pytest.mark.django_db
+def test_search_view(client):
+    blog = BlogFactory()
+    post = PostFactory(blog=blog, title="Marmalade")
+    url = reverse("tangerine:search", args=[blog.slug])
+
+    response = client.get(url, {"q": "marmalade"})
+    assert response.status_code == 200
+    assert list(response.context["posts"]) == [post]
+
+    # Later pages come from the same ranked ids.
+    others = PostFactory.create_batch(30, blog=blog, content="Toast and marmalade")
+    page1 = list(client.get(url, {"q": "marmalade"}).context["posts"])
+    page2 = list(client.get(url, {"q": "marmalade", "page": 2}).context["posts"])
+    assert page1[0] == post
+    assert (len(page1), len(page2)) == (25, 6)
+    assert set(page1 + page2) == {post, *others}
+
+    # No search terms, no results (and no crash).
+    response = client.get(url)
+    assert response.status_code == 200
+    assert list(response.context["posts"]) == []
@@ -0,0 +1,83 @@
+import pytest
+
+from django.core.management import call_command
+
+from tangerine.factories import BlogFactory, CommentFactory, PostFactory
+from tangerine.models import Comment
+from tangerine.ops import spam_check, toggle_spam
+from tangerine.spam import MIN_TRAINING, SpamClassifier, get_classifier
+
+
+@pytest.fixture
+def model_path(settings, tmp_path):
+    settings.TANGERINE_SPAM_MODEL_PATH = str(tmp_path / "spam.model")
+    return settings.TANGERINE_SPAM_MODEL_PATH
+
+
+@pytest.fixture
+def post():
+    return PostFactory(blog=BlogFactory(spam_filter="bayes"))
+
+
+def make_comments(post):
+    for n in range(MIN_TRAINING + 2):
+        CommentFactory(
+            post=post,
+            spam=True,
+            approved=False,
+            body="Cheap pills, best casino bonus! Click http://pills.example.com/{}".format(n),
+        )
+        CommentFactory(
+            post=post,
+            spam=False,
+            body="Thanks for the thoughtful post about gardening, I tried tomatoes this year.",
+        )
+
+
+@pytest.mark.django_db
+def test_train_and_check(post, model_path):
+    # Untrained, nothing is spam.
+    assert not spam_check(
+        CommentFactory.build(post=post, body="Casino pills bonus http://x.example.com")
+    )
+    assert get_classifier() is None
+
+    make_comments(post)
+    call_command("tangerine_train_spam")
+    classifier = get_classifier()
+    assert (classifier.num_spam, classifier.num_ham) == (MIN_TRAINING + 2, MIN_TRAINING + 2)
+    assert set(Comment.objects.values_list("spam_trained", flat=True)) == {True, False}
+
+    spammy = CommentFactory.build(post=post, body="Best casino bonus and cheap pills here")
+    hammy = CommentFactory.build(
+        post=post, body="Lovely post, my tomatoes did well in the garden too"
+    )
+    assert spam_check(spammy)
+    assert not spam_check(hammy)
+
+    # The model is saved compactly, and survives a round trip.
+    with open(model_path, "rb") as f:
+        data = f.read()
+    assert len(data) < 20000
+    reloaded = SpamClassifier.loads(data)
+    assert reloaded.spam_probability(spammy) == classifier.spam_probability(spammy)
+
+
+@pytest.mark.django_db
+def test_moderation_teaches_classifier(post, model_path):
+    make_comments(post)
+    call_command("tangerine_train_spam")
+    comment = Comment.objects.filter(spam=False).first()
+
+    # Marking a ham comment as spam moves it from one count to the other.
+    toggle_spam(comment)
+    classifier = get_classifier()
+    assert (classifier.num_spam, classifier.num_ham) == (MIN_TRAINING + 3, MIN_TRAINING + 1)
+    comment.refresh_from_db()
+    assert comment.spam_trained is True
+
+    # A comment the model hasn't seen is just added.
+    new_comment = CommentFactory(post=post, spam=True)
+    toggle_spam(new_comment)
+    classifier = get_classifier()
+    assert (classifier.num_spam, classifier.num_ham) == (MIN_TRAINING + 3, MIN_TRAINING + 2)
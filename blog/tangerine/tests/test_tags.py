@@ -1,6 +1,9 @@
 import datetime
 import pytest
 
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils.timezone import make_aware
 
 from tangerine.templatetags.tangerine_tags import (
@@ -12,13 +15,14 @@ from tangerine.templatetags.tangerine_tags import (
     get_date_archives,
 )
 from tangerine.factories import (
+    BlogFactory,
     RelatedLinkGroupFactory,
     CategoryFactory,
     ConfigFactory,
     PostFactory,
     CommentFactory,
 )
-from tangerine.models import Category, Post, Comment
+from tangerine.models import ArchiveMonth, Category, Post, Comment
 
 
 @pytest.fixture(params=[True, False])
@@ -99,6 +103,38 @@ def test_get_non_empty_categories():
     assert empty_cat not in goodcats
 
 
+@pytest.mark.django_db(transaction=True)
+def test_get_categories_counts_and_caching(
+    locmem_cache, django_assert_num_queries, django_assert_max_num_queries
+):
+    blog = BlogFactory()
+    coding = CategoryFactory(title="Coding", slug="coding", blog=blog)
+    empty = CategoryFactory(title="Empty", slug="empty", blog=blog)
+    for post in PostFactory.create_batch(3, blog=blog, published=True, trashed=False):
+        post.categories.add(coding)
+    PostFactory(blog=blog, published=False).categories.add(coding)
+    PostFactory(blog=blog, trashed=True).categories.add(empty)
+
+    # At most the Blog lookup plus one aggregate query; after that, straight from the cache.
+    with django_assert_max_num_queries(2):
+        cats = get_categories(blog.slug)["categories"]
+    assert [(c.title, c.num_posts) for c in cats] == [("Coding", 3)]
+    with django_assert_num_queries(0):
+        get_categories(blog.slug)
+
+    # Linking a published post to a category invalidates the cached list.
+    PostFactory(blog=blog, published=True).categories.add(empty)
+    cats = get_categories(blog.slug)["categories"]
+    assert [(c.title, c.num_posts) for c in cats] == [("Coding", 3), ("Empty", 1)]
+
+    # So does trashing a post.
+    post = coding.post_set.filter(published=True).first()
+    post.trashed = True
+    post.save()
+    cats = get_categories(blog.slug)["categories"]
+    assert [(c.title, c.num_posts) for c in cats] == [("Coding", 2), ("Empty", 1)]
+
+
 @pytest.mark.django_db
 def test_get_recent_comments():
     PostFactory.create_batch(10, published=True)
@@ -155,6 +191,61 @@ def test_get_date_archives_month(settings, tz_settings):
     assert isinstance(dates[0], datetime.date)
 
 
+@pytest.mark.django_db(transaction=True)
+def test_get_date_archives_histogram(locmem_cache, django_assert_num_queries):
+    blog = BlogFactory()
+
+    def post_on(year, month, **kwargs):
+        return PostFactory(
+            blog=blog, pub_date=make_aware(datetime.datetime(year, month, 15)), **kwargs
+        )
+
+    def archives(**kwargs):
+        return [(d.year, d.month, d.num_posts) for d in get_date_archives(blog.slug, **kwargs)]
+
+    post_on(2019, 3)
+    post_on(2019, 3)
+    moving = post_on(2019, 11)
+    post_on(2020, 6)
+    post_on(2020, 7, published=False)
+    post_on(2020, 8, trashed=True)
+    post_on(2020, 9, ptype="page")
+
+    assert archives(dtype="month") == [(2020, 6, 1), (2019, 11, 1), (2019, 3, 2)]
+    assert archives(dtype="year") == [(2020, 1, 1), (2019, 1, 3)]
+    assert archives(dtype="month", start="20190401", end="20200131") == [(2019, 11, 1)]
+    with django_assert_num_queries(0):
+        archives(dtype="month")
+
+    # Changing pub_date moves a post between months; trashing or deleting removes it.
+    moving.pub_date = make_aware(datetime.datetime(2020, 6, 1))
+    moving.save()
+    assert archives(dtype="month") == [(2020, 6, 2), (2019, 3, 2)]
+    moving.trashed = True
+    moving.save()
+    assert archives(dtype="month") == [(2020, 6, 1), (2019, 3, 2)]
+    Post.objects.filter(pub_date__year=2019).first().delete()
+    assert archives(dtype="month") == [(2020, 6, 1), (2019, 3, 1)]
+
+    # So does saving a post loaded with fields deferred, without recounting every blog's months.
+    june = Post.objects.only("title").get(pub_date__month=6, trashed=False)
+    june.pub_date = make_aware(datetime.datetime(2019, 3, 20))
+    with CaptureQueriesContext(connection) as ctx:
+        june.save()
+    archive_table = connection.ops.quote_name(ArchiveMonth._meta.db_table)
+    assert not [
+        q for q in ctx.captured_queries if q["sql"].startswith("DELETE FROM " + archive_table)
+    ]
+    assert archives(dtype="month") == [(2019, 3, 2)]
+
+    # Counts kept up incrementally match a full rebuild.
+    incremental = set(
+        ArchiveMonth.objects.filter(num_posts__gt=0).values_list("month", "num_posts")
+    )
+    call_command("tangerine_rebuild_archives")
+    assert set(ArchiveMonth.objects.values_list("month", "num_posts")) == incremental
+
+
 def test_gravatar_tag():
     img_url = gravatar("you@example.com")
     assert img_url.startswith("http://www.gravatar.com/avatar/")
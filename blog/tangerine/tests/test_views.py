@@ -1,11 +1,26 @@
 import datetime
 import pytest
 
+from django.contrib.messages import constants
+from django.contrib.messages.storage.base import Message
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.db import connection
+from django.http import HttpRequest
+from django.template.loader import render_to_string
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils.timezone import make_aware
 
-from tangerine.factories import CategoryFactory, PostFactory, ConfigFactory, CommentFactory
-from tangerine.models import Post, Comment
+from tangerine.caching import clear_request_memo
+from tangerine.factories import (
+    BlogFactory,
+    CategoryFactory,
+    PostFactory,
+    ConfigFactory,
+    CommentFactory,
+    RelatedLinkFactory,
+)
+from tangerine.models import Post, Comment, RelatedLinkGroup
 
 
 @pytest.fixture
@@ -180,3 +195,257 @@ def access_comment_management(config, posts_with_comments, admin_client, client)
     # With no auth
     response = client.get(url)
     assert response.status_code == 302
+
+
+@pytest.mark.django_db
+def test_list_view_query_count_independent_of_page_size(client):
+    # List views preload blog, author, categories and comment counts, so rendering more posts per
+    # page must not cost more queries.
+
+    def make_posts(blog, num):
+        cat = CategoryFactory(blog=blog, slug="{}-cat".format(blog.slug))
+        for post in PostFactory.create_batch(num, blog=blog):
+            post.categories.add(cat)
+            CommentFactory.create_batch(2, post=post)
+
+    def count_queries(blog):
+        url = reverse("tangerine:home", args=[blog.slug])
+        with CaptureQueriesContext(connection) as ctx:
+            response = client.get(url)
+        assert response.status_code == 200
+        return len(ctx.captured_queries)
+
+    blog = BlogFactory(num_posts_per_list_view=3)
+    make_posts(blog, 3)
+    small_page = count_queries(blog)
+
+    blog.num_posts_per_list_view = 20
+    blog.save()
+    make_posts(blog, 17)
+    large_page = count_queries(blog)
+
+    assert large_page == small_page
+
+
+def render_sidebar(blog):
+    """Render the sidebar include as one request would, returning its HTML and number of queries."""
+
+    # The sidebar only shows on sites whose base template has a sidebar block; render it directly.
+    clear_request_memo()
+    with CaptureQueriesContext(connection) as ctx:
+        content = render_to_string("tangerine/include/sidebar.html", {"blog_slug": blog.slug})
+    return content, len(ctx.captured_queries)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_sidebar_cached_until_content_changes(locmem_cache):
+    blog = BlogFactory()
+    PostFactory(blog=blog)
+
+    first_content, first_queries = render_sidebar(blog)
+    content, cached_queries = render_sidebar(blog)
+    assert content == first_content
+    assert cached_queries < first_queries
+
+    # A new comment, category or blog shows up in the sidebar straight away.
+    post = Post.objects.get(blog=blog)
+    CommentFactory(post=post, name="Duke Ellington")
+    post.categories.add(CategoryFactory(blog=blog, title="Big Band"))
+    BlogFactory(title="Second Blog")
+    content, queries = render_sidebar(blog)
+    assert "Duke Ellington" in content
+    assert "Big Band" in content
+    assert "Second Blog" in content
+    assert queries > cached_queries
+
+
+@pytest.mark.django_db(transaction=True)
+def test_sidebar_follows_post_categories(locmem_cache):
+    blog = BlogFactory()
+    post, other_post = PostFactory.create_batch(2, blog=blog)
+    swing = CategoryFactory(blog=blog, title="Swing")
+    bebop = CategoryFactory(blog=blog, title="Bebop")
+
+    def sidebar():
+        return render_sidebar(blog)[0]
+
+    assert "Swing" not in sidebar()
+
+    # Adding a post to a category, from either side, leaves the categories themselves unsaved.
+    post.categories.add(swing)
+    assert "Swing</a> (1)" in sidebar()
+    bebop.post_set.add(post, other_post)
+    assert "Bebop</a> (2)" in sidebar()
+    bebop.post_set.remove(other_post)
+    assert "Bebop</a> (1)" in sidebar()
+    bebop.post_set.clear()
+    assert "Bebop" not in sidebar()
+    post.categories.clear()
+    assert "Swing" not in sidebar()
+
+
+@pytest.mark.django_db
+def test_post_detail_query_count(client):
+    blog = BlogFactory()
+    group = RelatedLinkGroup.objects.create(blog=blog)
+    RelatedLinkFactory.create_batch(3, group=group)
+    post = PostFactory(blog=blog)
+    CommentFactory.create_batch(3, post=post)
+
+    # get_settings, get_related_links and get_all_blogs are called all over the templates,
+    # but Blogs are read from the database just once per request.
+    with CaptureQueriesContext(connection) as ctx:
+        response = client.get(post.get_absolute_url())
+    assert response.status_code == 200
+    blog_queries = [q["sql"] for q in ctx.captured_queries if 'FROM "blog_blog"' in q["sql"]]
+    assert len(blog_queries) <= 1
+
+
+@pytest.mark.django_db(transaction=True)
+def test_anonymous_page_cache(client, locmem_cache, django_user_model):
+    blog, other_blog = BlogFactory.create_batch(2)
+    post, other_post = PostFactory.create_batch(2, blog=blog)
+    comment = CommentFactory(post=post, approved=False, name="Duke Ellington")
+    home = reverse("tangerine:home", args=[blog.slug])
+
+    def queries(url, **kwargs):
+        with CaptureQueriesContext(connection) as ctx:
+            response = client.get(url, **kwargs)
+        assert response.status_code == 200
+        return len(ctx.captured_queries)
+
+    for url in (home, post.get_absolute_url(), other_post.get_absolute_url()):
+        assert queries(url) > 0
+        assert queries(url) == 0
+    # The query string is part of the key, in any order.
+    assert queries(home, data={"a": 1, "b": 2}) > 0
+    assert queries(home + "?b=2&a=1") == 0
+
+    # Cached pages with a comment form still hand out a usable CSRF token.
+    response = client.get(post.get_absolute_url())
+    assert b"__tangerine_csrf_token__" not in response.content
+    assert b'name="csrfmiddlewaretoken"' in response.content
+
+    # Approving a comment drops its post's page and the blog's list pages, and nothing else.
+    comment.approved = True
+    comment.save()
+    PostFactory(blog=other_blog)
+    assert queries(other_post.get_absolute_url()) == 0
+    assert queries(home) > 0
+    assert "Duke Ellington" in client.get(post.get_absolute_url()).content.decode()
+
+    # Saving a post drops its own page.
+    other_post.title = "Take the A Train"
+    other_post.save()
+    assert "Take the A Train" in client.get(other_post.get_absolute_url()).content.decode()
+
+    # Flash messages and logged-in users skip the cache.
+    queries(home)
+    assert queries(home) == 0
+    storage = CookieStorage(HttpRequest())
+    client.cookies["messages"] = storage._encode([Message(constants.INFO, "Comment held")])
+    assert queries(home) > 0
+    del client.cookies["messages"]
+    client.force_login(django_user_model.objects.create_user("ella"))
+    assert queries(home) > 0
+
+
+@pytest.mark.django_db(transaction=True)
+def test_anonymous_page_cache_post_categories(client, locmem_cache):
+    blog = BlogFactory()
+    post = PostFactory(blog=blog, title="Cotton Tail")
+    other_post = PostFactory(blog=blog)
+    swing = CategoryFactory(blog=blog, title="Swing")
+    home = reverse("tangerine:home", args=[blog.slug])
+    category = reverse("tangerine:category", args=[blog.slug, swing.slug])
+
+    def page(url):
+        with CaptureQueriesContext(connection) as ctx:
+            content = client.get(url).content.decode()
+        return content, len(ctx.captured_queries)
+
+    for url in (home, category, post.get_absolute_url(), other_post.get_absolute_url()):
+        page(url)
+        assert page(url)[1] == 0
+
+    # Linking a post to an existing category drops the blog's list pages and that post's page, not
+    # the others.
+    post.categories.add(swing)
+    assert page(other_post.get_absolute_url())[1] == 0
+    for url in (home, category, post.get_absolute_url()):
+        content, queries = page(url)
+        assert queries > 0
+        assert "Cotton Tail" in content
+    assert ">Swing</a>" in page(post.get_absolute_url())[0]
+
+    # Likewise from the category's side.
+    swing.post_set.remove(post)
+    assert "Cotton Tail" not in page(category)[0]
+    assert ">Swing</a>" not in page(post.get_absolute_url())[0]
+
+
+@pytest.mark.django_db
+def test_feed_conditional_get(client, locmem_cache, settings):
+    settings.MIDDLEWARE = [m for m in settings.MIDDLEWARE if not m.endswith("PageCacheMiddleware")]
+    blog = BlogFactory()
+    post = PostFactory(blog=blog, pub_date=make_aware(datetime.datetime(2021, 3, 4, 12, 30)))
+    url = reverse("tangerine:feed", args=[blog.slug])
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response["Content-Type"] == "application/rss+xml; charset=utf-8"
+    content = response.getvalue()
+    assert "<pubDate>Thu, 04 Mar 2021 12:30:00" in content.decode()
+    etag, last_modified = response["ETag"], response["Last-Modified"]
+
+    # Readers with the current feed get a 304, with one query and no rendering.
+    with CaptureQueriesContext(connection) as ctx:
+        assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 304
+    assert len(ctx.captured_queries) == 1
+    assert client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code == 304
+
+    # Everyone else gets the cached body, until a post changes.
+    with CaptureQueriesContext(connection) as ctx:
+        assert client.get(url).content == content
+    assert len(ctx.captured_queries) == 1
+    post.title = "Take the A Train"
+    post.save()
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert "Take the A Train" in response.getvalue().decode()
+    assert response["ETag"] != etag
+
+
+@pytest.mark.django_db
+def test_post_detail_conditional_get(client, django_user_model):
+    post = PostFactory(blog=BlogFactory())
+    url = post.get_absolute_url()
+    client.get(url)  # Picks up a CSRF cookie.
+
+    response = client.get(url)
+    etag, last_modified = response["ETag"], response["Last-Modified"]
+    assert "Cookie" in response["Vary"]
+    assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 304
+    assert client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code == 304
+
+    # An approved comment changes the page; an unapproved one doesn't.
+    CommentFactory(post=post, approved=False)
+    assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 304
+    CommentFactory(post=post, approved=True)
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    etag = response["ETag"]
+
+    # So does editing the post, even through a partial save.
+    post.title = "Take the A Train"
+    post.save(update_fields=["title"])
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    etag = response["ETag"]
+
+    # Logged-in users see their own version of the page, validated by ETag alone.
+    client.force_login(django_user_model.objects.create_user("ella", email="ella@example.com"))
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert "Last-Modified" not in response
+    assert client.get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code == 304
@@ -13,15 +13,21 @@ urlpatterns = [
     path("<int:year>/<int:month>/", views.date_archive, name="date_archive"),
     path("<int:year>/", views.date_archive, name="date_archive"),
     path("cat/<str:cat_slug>/", views.category, name="category"),
+    path("cat/<str:cat_slug>/feed", views.category_feed, name="category_feed"),
+    path("cat/<str:cat_slug>/feed.<str:feed_format>", views.category_feed, name="category_feed"),
     path("tag/<str:tag_slug>/", views.tag, name="tag"),
     path("<str:slug>/", views.page_detail, name="page_detail"),
     path("authors/<str:username>/", views.author, name="author"),
+    path("authors/<str:username>/feed", views.author_feed, name="author_feed"),
+    path("authors/<str:username>/feed.<str:feed_format>", views.author_feed, name="author_feed"),
     path("search", views.search, name="search"),
     path(
         "feed",
         views.feed,
         name="feed",
     ),
+    # Other feed formats: feed.atom, feed.json (and feed.rss).
+    path("feed.<str:feed_format>", views.feed, name="feed"),
     path("", views.home, name="home"),
     #  ##################
     # Paths for management interface
@@ -43,4 +49,9 @@ urlpatterns = [
         views.delete_comment,
         name="delete_comment",
     ),
+    path(
+        "manage/comments/bulk/",
+        views.bulk_moderate_comments,
+        name="bulk_moderate_comments",
+    ),
 ]
@@ -1,37 +1,101 @@
 import datetime
+import hashlib
 
 # from taggit.models import Tag
 
 from django.conf import settings
 from django.contrib import messages
+from django.contrib.messages import get_messages
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import user_passes_test
-from django.contrib.sites.shortcuts import get_current_site
 from django.core.paginator import Paginator
 from django.http import HttpResponseRedirect
-from django.db.models import Q
+from django.db.models import Count, Max, Q
 from django.shortcuts import render, get_object_or_404, redirect
+from django.views.decorators.http import require_POST
+from django.utils.cache import get_conditional_response, patch_vary_headers, quote_etag
+from django.utils.http import http_date
 
+from blog.tangerine import feeds
+from blog.tangerine.caching import get_blog_or_404
 from blog.tangerine.forms import CommentForm, CommentSearchForm
-from blog.tangerine.models import Category, Post, Comment, Blog
-from blog.tangerine.ops import toggle_approval, toggle_spam, process_comment, get_search_qs
+from blog.tangerine.models import Category, Post, Comment
+from blog.tangerine.ops import (
+    MODERATION_ACTIONS,
+    moderate_comments,
+    process_comment,
+    toggle_approval,
+    toggle_spam,
+)
+from blog.tangerine.pagination import paginate_posts
+from blog.tangerine.search import get_ranked_post_ids
 
 
 def home(request, blog_slug):
-    blog = get_object_or_404(Blog, slug=blog_slug)
-    posts = Post.pub.filter(blog=blog)
-    num_posts = blog.num_posts_per_list_view
-
-    paginator = Paginator(posts, num_posts)
-    page = request.GET.get("page")
-    posts = paginator.get_page(page)
+    blog = get_blog_or_404(blog_slug)
+    posts = Post.pub.filter(blog=blog).listing()
+    posts = paginate_posts(request, posts, blog)
 
     return render(request, "tangerine/home.html", {"posts": posts, "blog_slug": blog_slug})
 
 
+def with_page_validators(posts):
+    """Annotate `posts` with what `conditional_post_page` needs to know about their approved
+    comments."""
+
+    approved = Q(comment__approved=True)
+    return posts.annotate(
+        comments_modified=Max("comment__modified", filter=approved),
+        num_approved_comments=Count("comment", filter=approved),
+    )
+
+
+def conditional_post_page(request, post, render_page):
+    """Return `render_page()`, with an ETag and Last-Modified time, or a 304 if the client's copy is
+    current.
+
+    A post's page changes when the post is edited or its approved comments change. It also varies by
+    user (the comment form is pre-filled for logged-in users, superusers get an edit link) and
+    carries a CSRF token tied to the visitor's cookie, so the ETag covers those too. Last-Modified
+    can't tell users apart, so only anonymous visitors get one. Requests with flash messages to show
+    always get a fresh page."""
+
+    if request.method not in ("GET", "HEAD") or get_messages(request):
+        return render_page()
+
+    user = request.user
+    viewer = (
+        (user.pk, user.is_superuser, user.get_full_name(), user.email)
+        if user.is_authenticated
+        else None
+    )
+    state = (
+        post.pk,
+        post.modified,
+        post.comments_modified,
+        post.num_approved_comments,
+        viewer,
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME),
+    )
+    etag = quote_etag(hashlib.md5(repr(state).encode()).hexdigest())
+    last_modified = None
+    if viewer is None:
+        last_modified = int(max(filter(None, (post.modified, post.comments_modified))).timestamp())
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = render_page()
+    if response.status_code in (200, 304):
+        response["ETag"] = etag
+        if last_modified:
+            response["Last-Modified"] = http_date(last_modified)
+        patch_vary_headers(response, ["Cookie"])
+    return response
+
+
 def post_detail(request, blog_slug, year, month, day, slug):
     post = get_object_or_404(
-        Post,
+        with_page_validators(Post.objects.all()),
         blog__slug=blog_slug,
         published=True,
         trashed=False,
@@ -64,48 +128,51 @@ def post_detail(request, blog_slug, year, month, day, slug):
         else:
             form = CommentForm()
 
-    try:
-        next_post = Post.get_next_by_pub_date(post, ptype="post")
-    except Post.DoesNotExist:
-        next_post = None
-    try:
-        previous_post = Post.get_previous_by_pub_date(post, ptype="post")
-    except Post.DoesNotExist:
-        previous_post = None
+    def render_page():
+        try:
+            next_post = Post.get_next_by_pub_date(post, ptype="post")
+        except Post.DoesNotExist:
+            next_post = None
+        try:
+            previous_post = Post.get_previous_by_pub_date(post, ptype="post")
+        except Post.DoesNotExist:
+            previous_post = None
+
+        return render(
+            request,
+            "tangerine/post_detail.html",
+            {
+                "post": post,
+                "form": form,
+                "next_post": next_post,
+                "previous_post": previous_post,
+                "blog_slug": blog_slug,
+            },
+        )
 
-    return render(
-        request,
-        "tangerine/post_detail.html",
-        {
-            "post": post,
-            "form": form,
-            "next_post": next_post,
-            "previous_post": previous_post,
-            "blog_slug": blog_slug,
-        },
-    )
+    return conditional_post_page(request, post, render_page)
 
 
 def page_detail(request, blog_slug, slug):
-    post = get_object_or_404(Post, published=True, trashed=False, slug=slug)
-    return render(request, "tangerine/post_detail.html", {"post": post, "blog_slug": blog_slug})
+    post = get_object_or_404(
+        with_page_validators(Post.objects.all()), published=True, trashed=False, slug=slug
+    )
+    return conditional_post_page(
+        request,
+        post,
+        lambda: render(
+            request, "tangerine/post_detail.html", {"post": post, "blog_slug": blog_slug}
+        ),
+    )
 
 
 def category(request, blog_slug, cat_slug):
     # This view shows all posts in category `cat_slug` for the current blog
-    blog = get_object_or_404(Blog, slug=blog_slug)
+    blog = get_blog_or_404(blog_slug)
     cat = get_object_or_404(Category, slug=cat_slug, blog=blog)
-    posts = Post.pub.filter(
-        blog=blog,
-        categories__in=[
-            cat,
-        ],
-    ).order_by("-pub_date")
-
-    num_posts = blog.num_posts_per_list_view
-    paginator = Paginator(posts, num_posts)
-    page = request.GET.get("page")
-    posts = paginator.get_page(page)
+    posts = Post.pub.filter(blog=blog, categories__in=[cat]).order_by("-pub_date").listing()
+
+    posts = paginate_posts(request, posts, blog)
 
     return render(
         request,
@@ -116,17 +183,12 @@ def category(request, blog_slug, cat_slug):
 
 def tag(request, blog_slug, tag_slug):
     # This view shows all posts tagged with `tag_slug`
-    blog = get_object_or_404(Blog, slug=blog_slug)
+    blog = get_blog_or_404(blog_slug)
     # tag = get_object_or_404(Tag, slug=tag_slug)
     # posts = Post.pub.filter(blog=blog, tags__in=[tag, ]).order_by('-pub_date')
-    posts = Post.pub.filter(
-        blog=blog,
-    ).order_by("-pub_date")
+    posts = Post.pub.filter(blog=blog).order_by("-pub_date").listing()
 
-    num_posts = blog.num_posts_per_list_view
-    paginator = Paginator(posts, num_posts)
-    page = request.GET.get("page")
-    posts = paginator.get_page(page)
+    posts = paginate_posts(request, posts, blog)
     # FIXME: Can we re-use category.html here? Very similar.
     # return render(request, "tangerine/tag.html", {'tag':  tag, 'posts': posts, 'blog_slug': blog_slug})
     return render(request, "tangerine/tag.html", {"posts": posts, "blog_slug": blog_slug})
@@ -135,17 +197,14 @@ def tag(request, blog_slug, tag_slug):
 def date_archive(request, blog_slug, year, month=None, day=None):
     """Get posts by year | year and month | year and month and day."""
 
-    blog = get_object_or_404(Blog, slug=blog_slug)
-    posts = Post.pub.filter(blog=blog, pub_date__year=year).order_by("-pub_date")
+    blog = get_blog_or_404(blog_slug)
+    posts = Post.pub.filter(blog=blog, pub_date__year=year).order_by("-pub_date").listing()
     if month:
         posts = posts.filter(pub_date__month=month)
     if day:
         posts = posts.filter(pub_date__day=day)
 
-    num_posts = blog.num_posts_per_list_view
-    paginator = Paginator(posts, num_posts)
-    page = request.GET.get("page")
-    posts = paginator.get_page(page)
+    posts = paginate_posts(request, posts, blog)
 
     # For use in template display, compose a proper date object from passed in params.
     # We always have year; If month or day are missing, sub in today's month/day.
@@ -175,41 +234,41 @@ def author(request, blog_slug, username):
 
 
 def search(request, blog_slug):
-    """Display results of search for Post or Page objects.
-    FIXME: Currently searching all blogs. Should this be able to search just one blog at a time?"""
-
-    if request.GET.get("q"):
-        qs = get_search_qs(request.GET.get("q"))
+    """Display results of search for Post or Page objects in this blog, most relevant first."""
 
-    blog = get_object_or_404(Blog, slug=blog_slug)
-    qs = qs.filter(blog=blog).order_by("-pub_date")
+    blog = get_blog_or_404(blog_slug)
+    q = request.GET.get("q", "")
 
-    paginator = Paginator(qs, 25)
-    page = request.GET.get("page")
-    posts = paginator.get_page(page)
+    # Page through the (cached) ranked ids, then fetch just the posts on this page. Results are
+    # ranked by relevance rather than date, so they're paged by number whatever the blog's
+    # pagination style.
+    paginator = Paginator(get_ranked_post_ids(q, blog), 25)
+    posts = paginator.get_page(request.GET.get("page"))
+    posts_by_id = Post.objects.listing().in_bulk(posts.object_list)
+    posts.object_list = [posts_by_id[pk] for pk in posts.object_list if pk in posts_by_id]
 
-    context = {"posts": posts, "q": request.GET.get("q"), "blog_slug": blog_slug}
+    context = {"posts": posts, "q": q, "blog_slug": blog_slug}
     return render(request, "tangerine/search.html", context)
 
 
-def feed(request, blog_slug):
-    """Generate RSS 2 feed for the selected blog.
-    Using standard view and template rather than Django RSS Feed class due to difficulty of passing in blog_slug
-    for uniqueness of multiple feeds. Note `content_type` of return."""
+def feed(request, blog_slug, feed_format="rss"):
+    """Feed of the selected blog's latest posts, as RSS 2 (default), Atom or JSON Feed.
+    See `feeds.py` for how feeds are written, cached and validated."""
 
-    blog = get_object_or_404(Blog, slug=blog_slug)
-    lang = settings.LANGUAGE_CODE
-    posts = Post.pub.filter(blog=blog).order_by("-pub_date")[: blog.num_posts_per_list_view]
-    site = get_current_site(request)
+    blog = get_blog_or_404(blog_slug)
+    return feeds.serve_feed(request, feeds.blog_feed(blog), feed_format)
 
-    context = {
-        "blog": blog,
-        "lang": lang,
-        "site": site,
-        "posts": posts,
-    }
 
-    return render(request, "tangerine/rss.xml", context, content_type="application/xhtml+xml")
+def category_feed(request, blog_slug, cat_slug, feed_format="rss"):
+    blog = get_blog_or_404(blog_slug)
+    category = get_object_or_404(Category, blog=blog, slug=cat_slug)
+    return feeds.serve_feed(request, feeds.category_feed(blog, category), feed_format)
+
+
+def author_feed(request, blog_slug, username, feed_format="rss"):
+    blog = get_blog_or_404(blog_slug)
+    user = get_object_or_404(get_user_model(), username=username)
+    return feeds.serve_feed(request, feeds.author_feed(blog, user), feed_format)
 
 
 # ===============  Private management interfaces  ===============
@@ -244,6 +303,7 @@ def manage_comments(request, comment_id=None):
         "comments": comments,
         "form": form,
         "q": q,
+        "actions": MODERATION_ACTIONS,
     }
     return render(request, "tangerine/management/comments.html", context)
 
@@ -283,3 +343,24 @@ def delete_comment(request, comment_id):
     messages.add_message(request, messages.SUCCESS, "Comment deleted.")
 
     return redirect("tangerine:manage_comments")
+
+
+@require_POST
+@user_passes_test(lambda u: u.is_superuser)
+def bulk_moderate_comments(request):
+    """Apply one moderation action to all comments checked in the list, in one go (see
+    `ops.moderate_comments`)."""
+
+    action = request.POST.get("action")
+    comment_ids = [pk for pk in request.POST.getlist("comment_ids") if pk.isdigit()]
+    if action in MODERATION_ACTIONS and comment_ids:
+        num_changed = moderate_comments(Comment.objects.filter(id__in=comment_ids), action)
+        messages.add_message(
+            request,
+            messages.SUCCESS,
+            "{} comment(s) {}.".format(num_changed, MODERATION_ACTIONS[action]),
+        )
+    else:
+        messages.add_message(request, messages.WARNING, "Select some comments and an action.")
+
+    return redirect("tangerine:manage_comments")